@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Movie cards: the caption, keyboard and poster sent for a movie.
+
+Handlers build a MovieRecord from a TMDb result and call render() with the
+variant of card they need. Rendered cards are memoized per (movie_id, variant,
+locale) in a bounded LRU, so a popular movie is rendered once and then served
+from a dictionary lookup. Per-update additions such as the stale-data notice
+are applied by the caller, never cached.
+"""
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.markdown import hbold, hitalic
+
+# Use absolute imports
+from src.config import CARD_CACHE_SIZE, DAILY_ANOTHER_BUTTON
+from src.services import metrics, tmdb
+
+logger = logging.getLogger(__name__)
+
+# Card variants
+DAILY = "daily"          # Daily suggestion card
+SUGGESTION = "suggestion"  # Genre suggestion card
+FAVORITE = "favorite"    # Entry of the favorites list, with a remove button
+SEARCH = "search"        # Line of a search results message, with an add button
+
+DEFAULT_LOCALE = "ar"
+
+# Callback data of the daily card's "another suggestion" button
+ANOTHER_SUGGESTION_CALLBACK = "daily_more"
+# Callback data prefix of the "users who liked this also liked" button
+SIMILAR_CALLBACK_PREFIX = "sim_"
+
+_STRINGS: Dict[str, Dict[str, str]] = {
+    "ar": {
+        "daily_header": "☀️ اقتراح اليوم!",
+        "release_date": "📅 تاريخ الإصدار",
+        "rating": "⭐ التقييم",
+        "director": "🎬 المخرج",
+        "cast": "🎭 الممثلون",
+        "overview": "📝 الوصف",
+        "no_overview": "لا يوجد وصف.",
+        "unknown": "غير معروف",
+        "add_favorite": "➕ إضافة للمفضلة",
+        "add_search_result": "➕ إضافة",
+        "remove_favorite": "❌ إزالة",
+        "another_suggestion": "🔀 اقتراح آخر",
+        "similar": "👥 من أحبه أحب أيضًا",
+        "similar_short": "👥",
+    },
+}
+
+@dataclass(frozen=True)
+class MovieRecord:
+    """The fields of a movie that cards are rendered from."""
+    id: int
+    title: str
+    release_date: str = ""
+    vote_average: float = 0
+    overview: str = ""
+    poster_path: Optional[str] = None
+    director: Optional[str] = None
+    actors: Tuple[str, ...] = ()
+
+    @property
+    def year(self) -> str:
+        return self.release_date[:4] if self.release_date else ""
+
+    @property
+    def has_credits(self) -> bool:
+        return bool(self.director or self.actors)
+
+    @classmethod
+    def from_tmdb(cls, movie: Dict[str, Any], title: Optional[str] = None) -> "MovieRecord":
+        """Builds a record from a list result or a details response (credits are read if appended)."""
+        record = cls(
+            id=movie.get("id"),
+            title=title or movie.get("title") or "غير متوفر",
+            release_date=movie.get("release_date") or "",
+            vote_average=movie.get("vote_average") or 0,
+            overview=movie.get("overview") or "",
+            poster_path=movie.get("poster_path"),
+        )
+        return record.with_credits(movie) if movie.get("credits") else record
+
+    def with_credits(self, details: Optional[Dict[str, Any]], max_actors: int = 5) -> "MovieRecord":
+        """Returns a copy with director and top actors taken from a details response with credits."""
+        if not details or not details.get("credits"):
+            return self
+        credits = details["credits"]
+        director = next((member.get("name") for member in credits.get("crew", []) if member.get("job") == "Director"), None)
+        actors = tuple(actor["name"] for actor in credits.get("cast", [])[:max_actors] if actor.get("name"))
+        return replace(self, director=director, actors=actors)
+
+@dataclass(frozen=True)
+class Card:
+    caption: str
+    keyboard: Optional[InlineKeyboardMarkup]
+    poster: Optional[str]  # Poster URL (or a Telegram file_id once the poster has been uploaded)
+    has_credits: bool = False
+
+_cards: "OrderedDict[Tuple[int, str, str], Tuple[MovieRecord, Card]]" = OrderedDict()
+
+def _caption(record: MovieRecord, variant: str, s: Dict[str, str]) -> str:
+    if variant == FAVORITE:
+        return f"🎬 {hbold(record.title)} ({record.year or 'N/A'})"
+    if variant == SEARCH:
+        overview = record.overview[:100] + ("..." if len(record.overview) > 100 else "")
+        return f"**{record.title} ({record.year or '----'})**\n{overview}"
+
+    credits = ""
+    if record.has_credits:
+        credits = (
+            f"{s['director']}: {record.director or s['unknown']}\n"
+            f"{s['cast']}: {', '.join(record.actors) if record.actors else s['unknown']}\n"
+        )
+    header = f"{hbold(s['daily_header'])}\n\n" if variant == DAILY else ""
+    return (
+        f"{header}"
+        f"🎬 {hbold(record.title)}\n\n"
+        f"{s['release_date']}: {record.release_date or s['unknown']}\n"
+        f"{s['rating']}: {record.vote_average}/10\n"
+        f"{credits}\n"
+        f"{s['overview']}: {hitalic(record.overview) if record.overview else s['no_overview']}"
+    )
+
+def _keyboard(record: MovieRecord, variant: str, s: Dict[str, str]) -> InlineKeyboardMarkup:
+    similar_data = f"{SIMILAR_CALLBACK_PREFIX}{record.id}"
+    if variant == SEARCH:
+        # Search results share one message, so each gets a single row
+        button = InlineKeyboardButton(text=f"{s['add_search_result']} {record.title[:20]}...", callback_data=f"fav_add_{record.id}")
+        similar = InlineKeyboardButton(text=s["similar_short"], callback_data=similar_data)
+        return InlineKeyboardMarkup(inline_keyboard=[[button, similar]])
+    if variant == FAVORITE:
+        button = InlineKeyboardButton(text=s["remove_favorite"], callback_data=f"fav_rem_{record.id}")
+    else:
+        button = InlineKeyboardButton(text=s["add_favorite"], callback_data=f"fav_add_{record.id}")
+    rows = [[button], [InlineKeyboardButton(text=s["similar"], callback_data=similar_data)]]
+    if variant == DAILY and DAILY_ANOTHER_BUTTON:
+        rows.append([InlineKeyboardButton(text=s["another_suggestion"], callback_data=ANOTHER_SUGGESTION_CALLBACK)])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def _render(record: MovieRecord, variant: str, locale: str) -> Card:
+    strings = _STRINGS.get(locale) or _STRINGS[DEFAULT_LOCALE]
+    poster = tmdb.get_poster_url(record.poster_path) if variant != SEARCH else None
+    return Card(_caption(record, variant, strings), _keyboard(record, variant, strings), poster, record.has_credits)
+
+def render(record: MovieRecord, variant: str = SUGGESTION, locale: str = DEFAULT_LOCALE) -> Card:
+    """
+    Returns the card of `record`, rendering it only if the cached one was built from different data.
+
+    A record without credits is also served the cached card of the same movie with
+    credits, so once a movie's details were seen its card goes out complete.
+    """
+    key = (record.id, variant, locale)
+    cached = _cards.get(key)
+    if cached is not None:
+        cached_record, card = cached
+        if cached_record == record or (
+            not record.has_credits and replace(cached_record, director=None, actors=()) == record
+        ):
+            _cards.move_to_end(key)
+            metrics.cache_hit("cards")
+            return card
+    metrics.cache_miss("cards")
+    card = _render(record, variant, locale)
+    _cards[key] = (record, card)
+    _cards.move_to_end(key)
+    if len(_cards) > CARD_CACHE_SIZE:
+        _cards.popitem(last=False)
+    return card
+
+def stats() -> Dict[str, float]:
+    """Returns the number of memoized cards, for metrics."""
+    return {"entries": len(_cards)}
@@ -21,3 +21,109 @@ ADMIN_ID = int(os.getenv("ADMIN_ID", "7813451177")) # Default to the ID provided
 # Database Path
 DATABASE_PATH = os.getenv("DATABASE_PATH", "/home/ubuntu/movie_suggester_bot/data/bot_data.db")
 
+
+# FSM storage: "sqlite" persists conversation state in the bot database, "memory" keeps it in-process
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+FSM_TTL_SECONDS = int(os.getenv("FSM_TTL_SECONDS", str(7 * 24 * 3600))) # Idle state/data expires after this
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000")) # Max chats held in memory (cache or in-memory storage)
+
+# Drop updates queued at Telegram while the bot was down (polling startup and webhook registration)
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "false").lower() == "true"
+
+# Webhook mode (python3 -m src.webhook)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") # Public HTTPS base URL, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") # Checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1")) # Worker processes sharing WEBHOOK_PORT
+WEBHOOK_INTERNAL_PORT = int(os.getenv("WEBHOOK_INTERNAL_PORT", "9100")) # Worker i also listens on localhost:(this + i)
+
+# Update processing: chats run concurrently, updates within a chat run in order
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32")) # Max handlers running at once
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1000")) # Queued + running updates before backpressure
+
+# Per-user anti-flood limits: a burst of N updates, refilled at M per minute
+THROTTLE_SEARCH_BURST = float(os.getenv("THROTTLE_SEARCH_BURST", "4"))
+THROTTLE_SEARCH_PER_MINUTE = float(os.getenv("THROTTLE_SEARCH_PER_MINUTE", "12"))
+THROTTLE_SUGGEST_BURST = float(os.getenv("THROTTLE_SUGGEST_BURST", "5"))
+THROTTLE_SUGGEST_PER_MINUTE = float(os.getenv("THROTTLE_SUGGEST_PER_MINUTE", "20"))
+THROTTLE_CALLBACK_BURST = float(os.getenv("THROTTLE_CALLBACK_BURST", "10"))
+THROTTLE_CALLBACK_PER_MINUTE = float(os.getenv("THROTTLE_CALLBACK_PER_MINUTE", "60"))
+
+# Prometheus metrics exporter on localhost (0 disables); webhook worker i uses METRICS_PORT + i
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Event loop watchdog: lag that triggers a stack snapshot, and the per-update handler budget
+LOOP_LAG_THRESHOLD_MS = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "200"))
+SLOW_UPDATE_BUDGET_MS = int(os.getenv("SLOW_UPDATE_BUDGET_MS", "2000"))
+SLOW_UPDATE_LOG_SIZE = int(os.getenv("SLOW_UPDATE_LOG_SIZE", "100")) # Slow updates kept for the admin dump
+
+# Logging: level, and the fraction of aiogram's per-update "is handled" INFO lines that are kept
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_UPDATE_SAMPLE_RATE = float(os.getenv("LOG_UPDATE_SAMPLE_RATE", "0.05"))
+
+# Startup: opt-in uvloop (pip install uvloop) and a warm-up phase before updates are accepted
+USE_UVLOOP = os.getenv("USE_UVLOOP", "false").lower() == "true"
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "20")) # Startup continues after this even if steps are pending
+SUGGESTION_POOL_TTL = int(os.getenv("SUGGESTION_POOL_TTL", "3600")) # Seconds before the popular-movies pool is refetched
+TMDB_KEEPALIVE_SECONDS = float(os.getenv("TMDB_KEEPALIVE_SECONDS", "75")) # Idle TMDb connections are kept open this long
+
+# TMDb resilience: request timeout, circuit breaker and the stale responses served while TMDb is failing
+TMDB_TIMEOUT_SECONDS = float(os.getenv("TMDB_TIMEOUT_SECONDS", "8"))
+TMDB_BREAKER_FAILURES = int(os.getenv("TMDB_BREAKER_FAILURES", "5")) # Consecutive failed/slow requests that open the circuit
+TMDB_BREAKER_SLOW_SECONDS = float(os.getenv("TMDB_BREAKER_SLOW_SECONDS", "4")) # Successful requests slower than this count as failures
+TMDB_BREAKER_OPEN_SECONDS = float(os.getenv("TMDB_BREAKER_OPEN_SECONDS", "30")) # Fail fast this long before probing again
+TMDB_STALE_CACHE_SIZE = int(os.getenv("TMDB_STALE_CACHE_SIZE", "500")) # Last good responses kept for stale serving
+
+# Hedged TMDb GETs (details and search): a second request is sent when the first is slower than
+# the endpoint's recent latency percentile, for at most TMDB_HEDGE_MAX_RATIO of those requests
+TMDB_HEDGE_ENABLED = os.getenv("TMDB_HEDGE_ENABLED", "true").lower() == "true"
+TMDB_HEDGE_PERCENTILE = float(os.getenv("TMDB_HEDGE_PERCENTILE", "0.95"))
+TMDB_HEDGE_MAX_RATIO = float(os.getenv("TMDB_HEDGE_MAX_RATIO", "0.05"))
+TMDB_HEDGE_MIN_DELAY_MS = int(os.getenv("TMDB_HEDGE_MIN_DELAY_MS", "150"))
+
+# TMDb request scheduling: overall request rate, and per-priority concurrency and rate share
+TMDB_RATE_PER_SECOND = float(os.getenv("TMDB_RATE_PER_SECOND", "40"))
+TMDB_INTERACTIVE_CONCURRENCY = int(os.getenv("TMDB_INTERACTIVE_CONCURRENCY", "16"))
+TMDB_BACKGROUND_CONCURRENCY = int(os.getenv("TMDB_BACKGROUND_CONCURRENCY", "4"))
+TMDB_BACKGROUND_SHARE = float(os.getenv("TMDB_BACKGROUND_SHARE", "0.25")) # Max fraction of the rate background requests may use
+
+# Callback work runs after the button is answered; it degrades to a fallback message after this unless it has started writing
+CALLBACK_WORK_DEADLINE_SECONDS = float(os.getenv("CALLBACK_WORK_DEADLINE_SECONDS", "15"))
+CARD_DETAILS_DEADLINE_SECONDS = float(os.getenv("CARD_DETAILS_DEADLINE_SECONDS", "4")) # Director/cast edits later than this are skipped
+CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", "2000")) # Rendered movie cards kept per (movie, variant, locale)
+
+# Movie of the day: one pick per timezone bucket (IANA names, comma separated; the first is the default)
+# computed at each bucket's local midnight, plus an optional "another suggestion" button drawing from the pool
+DAILY_TIMEZONES = [zone.strip() for zone in os.getenv("DAILY_TIMEZONES", "Asia/Baghdad").split(",") if zone.strip()]
+DAILY_REPEAT_DAYS = int(os.getenv("DAILY_REPEAT_DAYS", "30")) # A movie is not picked again within this many days
+DAILY_ANOTHER_BUTTON = os.getenv("DAILY_ANOTHER_BUTTON", "true").lower() == "true"
+
+# Daily push to subscribers: sends are paced to finish within DAILY_PUSH_SPREAD_MINUTES of each hour,
+# at no more than DAILY_PUSH_MAX_PER_SECOND messages per second (Telegram allows about 30)
+DAILY_PUSH_ENABLED = os.getenv("DAILY_PUSH_ENABLED", "true").lower() == "true"
+DAILY_PUSH_DEFAULT_HOUR = int(os.getenv("DAILY_PUSH_DEFAULT_HOUR", "9")) # Local hour used by /subscribe without an hour
+DAILY_PUSH_SPREAD_MINUTES = float(os.getenv("DAILY_PUSH_SPREAD_MINUTES", "50"))
+DAILY_PUSH_MAX_PER_SECOND = float(os.getenv("DAILY_PUSH_MAX_PER_SECOND", "20"))
+
+# Suggestions skip movies a user has already been shown or favorited (per-user Bloom filters)
+SEEN_CACHE_SIZE = int(os.getenv("SEEN_CACHE_SIZE", "10000")) # Users whose seen-movies filters are kept in memory (~300 bytes each)
+
+# Combined genre/decade/rating filters: discover result pages are cached per filter for SUGGESTION_POOL_TTL
+DISCOVER_POOL_SIGNATURES = int(os.getenv("DISCOVER_POOL_SIGNATURES", "256")) # Filter combinations whose pages are kept in memory
+DISCOVER_SAMPLE_PAGES = int(os.getenv("DISCOVER_SAMPLE_PAGES", "10")) # Suggestions are drawn from a random one of the first N pages
+
+# "For you" suggestions ranked by each user's favorites (all catalogue movies are scored if numpy is installed)
+FOR_YOU_CACHE_SIZE = int(os.getenv("FOR_YOU_CACHE_SIZE", "5000")) # Users whose rankings are kept in memory
+FOR_YOU_PROFILE_FAVORITES = int(os.getenv("FOR_YOU_PROFILE_FAVORITES", "50")) # Most recent favorites a taste profile is built from
+FOR_YOU_TOP = int(os.getenv("FOR_YOU_TOP", "200")) # Best-ranked movies kept per user
+
+# "Users who liked this also liked": similar movies from favorites co-occurrence, recomputed in the background
+SIMILAR_TOP_K = int(os.getenv("SIMILAR_TOP_K", "20")) # Similar movies stored per movie
+SIMILAR_SHOWN = int(os.getenv("SIMILAR_SHOWN", "5")) # Similar movies offered by the card button
+SIMILAR_REFRESH_SECONDS = float(os.getenv("SIMILAR_REFRESH_SECONDS", "60")) # How often changed lists are recomputed and reloaded
+
+# Local catalogue snapshot (optional, needs numpy): suggestions are sampled from it without calling TMDb
+CATALOGUE_DIR = os.getenv("CATALOGUE_DIR", "/home/ubuntu/movie_suggester_bot/data/catalogue") # Snapshot built by src.tools.build_catalogue
@@ -1,19 +1,24 @@
 # -*- coding: utf-8 -*-
 import logging
 import asyncio
+import contextvars
+from typing import Optional
 
 from aiogram import Router, F, Bot
 from aiogram.filters import Command, StateFilter
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.filters.command import CommandObject
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, BufferedInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 # Use absolute imports
 from src.config import ADMIN_ID
 from src.services.database import get_user_count, get_total_favorites_count, get_all_user_ids # Corrected import
+from src.services import profiler
+from src.services.watchdog import LoopWatchdog
 
 logger = logging.getLogger(__name__)
-admin_router = Router()
+admin_router = Router(name="admin")
 
 # Define states for broadcast message
 class BroadcastState(StatesGroup):
@@ -27,7 +32,9 @@ def is_admin(message: Message) -> bool:
 async def handle_admin_command(message: Message):
     """Handles the /admin command and shows the admin panel."""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📊 عرض الإحصائيات", callback_data="admin_stats")],
+        [InlineKeyboardButton(text="📊 عرض الإحصائيات", callback_data="admin_stats"),
+         InlineKeyboardButton(text="🔬 تحليل الأداء", callback_data="admin_profile")],
+        [InlineKeyboardButton(text="🐢 التحديثات البطيئة", callback_data="admin_slow_updates")],
         [InlineKeyboardButton(text="📢 إرسال رسالة عامة", callback_data="admin_broadcast")]
         # Add more admin buttons here if needed
     ])
@@ -44,6 +51,78 @@ async def handle_stats_button(callback_query: CallbackQuery):
     await callback_query.message.answer(stats_text)
     await callback_query.answer() # Acknowledge the callback
 
+DEFAULT_PROFILE_SECONDS = 15
+
+# The running profile, if any; kept so it is not garbage collected and can be cancelled on shutdown
+_profile_task: Optional[asyncio.Task] = None
+
+async def run_profile(message: Message, seconds: float, mode: str):
+    """Profiles the event loop for `seconds` and sends the report as a document."""
+    try:
+        report = await profiler.profile_event_loop(seconds, mode=mode)
+        extension = "folded" if mode == "sample" else "txt"
+        document = BufferedInputFile(report.encode("utf-8"), filename=f"profile_{int(seconds)}s.{extension}")
+        await message.answer_document(document, caption="📄 تقرير تحليل الأداء")
+    except profiler.ProfilerBusyError:
+        await message.answer("⚠️ يوجد تحليل أداء قيد التشغيل بالفعل، يرجى الانتظار حتى ينتهي.")
+    except Exception as e:
+        logger.error(f"Profiling the event loop failed: {e}", exc_info=True)
+        await message.answer("حدث خطأ أثناء تحليل الأداء.")
+
+async def start_profile(message: Message, seconds: float, mode: str):
+    """
+    Starts a profile in the background and returns at once; the report is sent when it finishes.
+
+    The profile window is mostly sleep, so it must not hold the chat's place in the
+    update ordering or a handler slot, nor be logged as a slow update.
+    """
+    global _profile_task
+    if _profile_task is not None and not _profile_task.done():
+        await message.answer("⚠️ يوجد تحليل أداء قيد التشغيل بالفعل، يرجى الانتظار حتى ينتهي.")
+        return
+    await message.answer(f"🔬 جاري تحليل الأداء لمدة {int(seconds)} ثانية ({mode})، سيصلك التقرير عند انتهائه...")
+    # A fresh context, so the report's Telegram call is not timed as a stage of this finished update
+    _profile_task = asyncio.create_task(run_profile(message, seconds, mode), context=contextvars.Context())
+
+@admin_router.shutdown()
+async def cancel_profile():
+    """Cancels a profile still running when the bot stops."""
+    if _profile_task is not None and not _profile_task.done():
+        _profile_task.cancel()
+        await asyncio.gather(_profile_task, return_exceptions=True)
+
+@admin_router.message(Command("profile"), is_admin)
+async def handle_profile_command(message: Message, command: CommandObject):
+    """Handles /profile [seconds] [sample|cprofile]."""
+    args = (command.args or "").split()
+    try:
+        seconds = float(args[0]) if args else DEFAULT_PROFILE_SECONDS
+    except ValueError:
+        await message.answer(f"الاستخدام: /profile <ثواني (حتى {profiler.MAX_SECONDS})> [sample|cprofile]")
+        return
+    mode = args[1] if len(args) > 1 and args[1] in ("sample", "cprofile") else "sample"
+    seconds = max(1, min(seconds, profiler.MAX_SECONDS))
+    await start_profile(message, seconds, mode)
+
+@admin_router.callback_query(F.data == "admin_profile", is_admin)
+async def handle_profile_button(callback_query: CallbackQuery):
+    """Handles the profile button press from the admin panel."""
+    await callback_query.answer() # Acknowledge the callback before the profile window starts
+    await start_profile(callback_query.message, DEFAULT_PROFILE_SECONDS, "sample")
+
+@admin_router.callback_query(F.data == "admin_slow_updates", is_admin)
+async def handle_slow_updates_button(callback_query: CallbackQuery, watchdog: LoopWatchdog):
+    """Sends the slow-update log and recent event loop stalls as a document."""
+    await callback_query.answer()
+    if not watchdog.slow_updates and not watchdog.stalls:
+        await callback_query.message.answer("✅ لا توجد تحديثات بطيئة أو توقفات في حلقة الأحداث حتى الآن.")
+        return
+    document = BufferedInputFile(watchdog.report().encode("utf-8"), filename="slow_updates.txt")
+    await callback_query.message.answer_document(
+        document,
+        caption=f"🐢 {len(watchdog.slow_updates)} تحديث بطيء، {len(watchdog.stalls)} توقف لحلقة الأحداث",
+    )
+
 @admin_router.callback_query(F.data == "admin_broadcast", is_admin)
 async def handle_broadcast_button(callback_query: CallbackQuery, state: FSMContext):
     """Handles the broadcast button press and asks for the message."""
@@ -86,7 +165,7 @@ async def process_broadcast_message(message: Message, state: FSMContext, bot: Bo
 ❌ فشل الإرسال إلى: {failed_count} مستخدم.""")
 
 # Fallback for non-admin users trying admin commands
-@admin_router.message(Command("admin"))
+@admin_router.message(Command("admin", "profile"))
 async def handle_non_admin_command(message: Message):
     await message.answer("عذرًا، هذا الأمر مخصص للمدير فقط.")
 
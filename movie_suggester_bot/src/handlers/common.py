@@ -4,29 +4,34 @@ import aiohttp
 
 from aiogram import Router, F, Bot
 from aiogram.filters import CommandStart
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, CallbackQuery
 from aiogram.utils.markdown import hbold
 
 # Use absolute imports
 from src.handlers.genre import send_genre_selection_keyboard
 from src.handlers.daily import send_daily_suggestion
 from src.handlers.favorites import show_favorites_list
+from src.handlers.for_you import send_for_you_suggestion
 from src.services import database # Import database service
+from src.services.daily_movie import DailyMovie
+from src.utils import NOOP_CALLBACK
 
 logger = logging.getLogger(__name__)
-common_router = Router()
+common_router = Router(name="common")
 
 # Define Reply Keyboard Buttons
 button_genre = KeyboardButton(text="🎬 اقتراح فيلم")
 button_daily = KeyboardButton(text="☀️ اقتراح اليوم")
 button_favorites = KeyboardButton(text="⭐ مفضلتي")
+button_for_you = KeyboardButton(text="🎯 مقترح لك")
 button_search_info = KeyboardButton(text="🔍 بحث") # This button will just show info
 
 # Define Reply Keyboard Layout
 main_keyboard = ReplyKeyboardMarkup(
     keyboard=[
         [button_genre, button_daily],
-        [button_favorites, button_search_info]
+        [button_for_you, button_favorites],
+        [button_search_info]
     ],
     resize_keyboard=True,
     input_field_placeholder="اختر أمرًا أو اكتب اسم فيلم للبحث..."
@@ -48,8 +53,10 @@ async def command_start_handler(message: Message) -> None:
         f"يمكنك استخدام الأزرار أدناه أو كتابة اسم فيلم للبحث عنه مباشرة.\n\n"
         f"الأوامر المتاحة:\n"
         f"/genre - لاختيار نوع فيلم والحصول على اقتراح.\n"
-        f"/daily - للحصول على اقتراح فيلم شائع.\n"
-        f"/favorites - لعرض وإدارة قائمة أفلامك المفضلة.\n\n"
+        f"/daily - لعرض فيلم اليوم.\n"
+        f"/favorites - لعرض وإدارة قائمة أفلامك المفضلة.\n"
+        f"/foryou - لاقتراح فيلم يناسب ذوقك بناءً على مفضلتك.\n"
+        f"/subscribe - لاستلام فيلم اليوم تلقائيًا كل يوم.\n\n"
         f"اكتب اسم فيلم أو كلمة مفتاحية للبحث."
     )
     await message.answer(welcome_message, reply_markup=main_keyboard)
@@ -62,17 +69,26 @@ async def handle_genre_button(message: Message, session: aiohttp.ClientSession):
     await send_genre_selection_keyboard(message, session)
 
 @common_router.message(F.text == "☀️ اقتراح اليوم")
-async def handle_daily_button(message: Message, session: aiohttp.ClientSession, bot: Bot):
+async def handle_daily_button(message: Message, session: aiohttp.ClientSession, bot: Bot, daily_movie: DailyMovie):
     """Handles the reply keyboard button for daily suggestion by directly sending a suggestion."""
-    await send_daily_suggestion(message, session, bot)
+    await send_daily_suggestion(message, session, bot, daily_movie)
 
 @common_router.message(F.text == "⭐ مفضلتي")
 async def handle_favorites_button(message: Message, session: aiohttp.ClientSession, bot: Bot):
     """Handles the reply keyboard button for favorites by directly showing the list."""
     await show_favorites_list(message, session, bot)
 
+@common_router.message(F.text == "🎯 مقترح لك")
+async def handle_for_you_button(message: Message, session: aiohttp.ClientSession, bot: Bot):
+    """Handles the reply keyboard button for personalized suggestions."""
+    await send_for_you_suggestion(message, session, bot)
+
 @common_router.message(F.text == "🔍 بحث")
 async def handle_search_info_button(message: Message):
     """Handles the reply keyboard button for search info."""
     await message.answer("للبحث عن فيلم، ما عليك سوى كتابة اسمه أو كلمة مفتاحية في حقل الإدخال وإرسالها.")
 
+@common_router.callback_query(F.data == NOOP_CALLBACK)
+async def handle_noop_callback(callback_query: CallbackQuery):
+    """Status buttons (progress, "added") do nothing; just stop the spinner."""
+    await callback_query.answer()
@@ -1,21 +1,24 @@
 # -*- coding: utf-8 -*-
 import logging
-import random
 import aiohttp
 
 from aiogram import Router, F, Bot
-from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.utils.markdown import hbold, hitalic
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, CallbackQuery
 
 # Use absolute imports
-from src.services import tmdb, database
+from src import cards
+from src.cards import MovieRecord
+from src.services import database, seen, catalogue
+from src.config import DAILY_PUSH_ENABLED, DAILY_PUSH_DEFAULT_HOUR
+from src.services.daily_movie import DailyMovie, get_popular_pool
+from src.utils import with_stale_notice, complete_card, prefetch_details, answer_then_run, begin_writes
 
 logger = logging.getLogger(__name__)
-daily_router = Router()
+daily_router = Router(name="daily")
 
-async def send_daily_suggestion(message: Message, session: aiohttp.ClientSession, bot: Bot):
-    """Fetches a popular movie and sends it as a daily suggestion."""
+async def send_daily_suggestion(message: Message, session: aiohttp.ClientSession, bot: Bot, daily_movie: DailyMovie):
+    """Sends today's movie of the day, normally straight from memory."""
     # Add user to DB if not exists
     await database.add_user_if_not_exists(
         user_id=message.from_user.id,
@@ -23,64 +26,142 @@ async def send_daily_suggestion(message: Message, session: aiohttp.ClientSession
         last_name=message.from_user.last_name,
         username=message.from_user.username
     )
-    await message.answer("جاري البحث عن اقتراح اليوم...")
-
-    # Fetch popular movies (consider fetching more pages or randomizing page)
-    movies = await tmdb.get_popular_movies(session, page=random.randint(1, 5)) # Get from first 5 pages
-
-    if movies:
-        selected_movie = random.choice(movies)
-        movie_id = selected_movie.get("id")
-        title = selected_movie.get("title", "غير متوفر")
-        overview = selected_movie.get("overview", "لا يوجد وصف متاح.")
-        release_date = selected_movie.get("release_date", "غير معروف")
-        vote_average = selected_movie.get("vote_average", 0)
-        poster_path = selected_movie.get("poster_path")
-        poster_url = tmdb.get_poster_url(poster_path)
-
-        # Fetch more details (optional, for director/cast)
-        details = await tmdb.get_movie_details(session, movie_id)
-        director = "غير معروف"
-        cast_list = []
-        if details and details.get("credits"):
-            crew = details["credits"].get("crew", [])
-            cast = details["credits"].get("cast", [])
-            for member in crew:
-                if member.get("job") == "Director":
-                    director = member.get("name", "غير معروف")
-                    break
-            cast_list = [actor.get("name") for actor in cast[:5]] # Top 5 actors
-
-        # Prepare actors string separately
-        actors_str = ", ".join(cast_list) if cast_list else 'غير معروف'
-        # Corrected caption f-string
-        caption = (
-            f"☀️ {hbold('اقتراح اليوم!')}\n\n"
-            f"🎬 {hbold(title)}\n\n"
-            f"📅 تاريخ الإصدار: {release_date}\n"
-            f"⭐ التقييم: {vote_average}/10\n"
-            f"🎬 المخرج: {director}\n"
-            f"🎭 الممثلون: {actors_str}\n\n" # Use the pre-formatted actors string
-            f"📝 الوصف: {hitalic(overview) if overview else 'لا يوجد وصف.'}"
-        )
 
-        # Add favorite button
-        fav_button = InlineKeyboardButton(text="➕ إضافة للمفضلة", callback_data=f"fav_add_{movie_id}") # Pass only movie_id
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[fav_button]])
+    # Subscribers get the movie of the timezone they chose; the lookup is skipped with a single bucket
+    bucket = None
+    if len(daily_movie.zones) > 1:
+        bucket = daily_movie.bucket_of(await database.get_subscriber_bucket(message.from_user.id))
+    pick = daily_movie.current(bucket)
+    if pick is None:
+        # Only right after midnight or startup, before the scheduled task has stored today's pick
+        await message.answer("جاري البحث عن اقتراح اليوم...")
+        pick = await daily_movie.get(session, bucket)
+    if pick is None:
+        await message.answer("عذرًا، لم أتمكن من العثور على اقتراح اليوم حاليًا. يرجى المحاولة مرة أخرى لاحقًا.")
+        return
+
+    # So "another suggestion" does not repeat today's movie
+    await seen.mark_seen(message.from_user.id, [pick.record.id])
+
+    # The pick is stored and served all day, so it carries no stale-data notice
+    caption = pick.card.caption
+    if pick.photo:
+        try:
+            sent = await bot.send_photo(message.chat.id, photo=pick.photo, caption=caption, reply_markup=pick.card.keyboard)
+            if sent.photo:
+                # Later sends reuse the uploaded poster instead of having Telegram fetch the URL again
+                await daily_movie.remember_file_id(pick, sent.photo[-1].file_id)
+            return
+        except Exception as e:
+            logger.warning(f"Failed to send photo for daily suggestion movie {pick.record.id}. Sending text instead. Error: {e}")
+    await message.answer(caption, reply_markup=pick.card.keyboard)
+
+async def send_pool_suggestion(message: Message, user_id: int, session: aiohttp.ClientSession, bot: Bot):
+    """Sends a random movie the user has not seen, filling in director and cast when they arrive."""
+    # Sampled from the local catalogue snapshot if there is one, else from the popular pool;
+    # either way movies this user was already shown or has favorited are skipped
+    movie = await catalogue.pick_for_user(session, user_id)
+    if movie is None:
+        movies = await get_popular_pool(session)
+        movie = await seen.pick_unseen(user_id, movies) if movies else None
+    if movie is None:
+        await message.answer("عذرًا، لم أتمكن من العثور على اقتراح آخر حاليًا. يرجى المحاولة مرة أخرى لاحقًا.")
+        return
+    await send_movie_card(message, user_id, movie, session, bot)
+
+async def send_movie_card(message: Message, user_id: int, movie: dict, session: aiohttp.ClientSession, bot: Bot):
+    """Sends a suggestion card for a TMDb list result and marks it seen, filling in director and cast when they arrive."""
+    record = MovieRecord.from_tmdb(movie)
+    card = cards.render(record, cards.SUGGESTION)
 
-        if poster_url:
+    # Fetch director/cast concurrently unless the cached card already has them
+    details_task = None if card.has_credits else prefetch_details(session, record.id)
+    caption = with_stale_notice(card.caption, movie)
+
+    # Sending and marking the movie seen are not interrupted by a callback deadline
+    begin_writes()
+    sent = None
+    try:
+        if card.poster:
             try:
-                await bot.send_photo(message.chat.id, photo=poster_url, caption=caption, reply_markup=keyboard)
+                sent = await bot.send_photo(message.chat.id, photo=card.poster, caption=caption, reply_markup=card.keyboard)
             except Exception as e:
-                logger.warning(f"Failed to send photo for daily suggestion movie {movie_id}. Sending text instead. Error: {e}")
-                await message.answer(caption, reply_markup=keyboard)
+                logger.warning(f"Failed to send photo for suggestion movie {record.id}. Sending text instead. Error: {e}")
+                sent = await message.answer(caption, reply_markup=card.keyboard)
         else:
-            await message.answer(caption, reply_markup=keyboard)
-    else:
-        await message.answer("عذرًا، لم أتمكن من العثور على اقتراح اليوم حاليًا. يرجى المحاولة مرة أخرى لاحقًا.")
+            sent = await message.answer(caption, reply_markup=card.keyboard)
+    finally:
+        if sent is not None:
+            await seen.mark_seen(user_id, [record.id])
+        if details_task:
+            # Fill in director and cast when they arrive, or leave the card as is
+            await complete_card(sent, details_task, lambda details: with_stale_notice(
+                cards.render(record.with_credits(details), cards.SUGGESTION).caption, movie, details))
 
 @daily_router.message(Command("daily"))
-async def handle_daily_command(message: Message, session: aiohttp.ClientSession, bot: Bot):
+async def handle_daily_command(message: Message, session: aiohttp.ClientSession, bot: Bot, daily_movie: DailyMovie):
     """Handles the /daily command."""
-    await send_daily_suggestion(message, session, bot)
+    await send_daily_suggestion(message, session, bot, daily_movie)
+
+@daily_router.callback_query(F.data == cards.ANOTHER_SUGGESTION_CALLBACK)
+async def handle_another_suggestion(callback_query: CallbackQuery, session: aiohttp.ClientSession, bot: Bot):
+    """Handles the daily card's "another suggestion" button; the daily card itself is left untouched."""
+    async def send_error(text: str):
+        await callback_query.message.answer(text)
+
+    await answer_then_run(
+        callback_query, "another_suggestion",
+        lambda: send_pool_suggestion(callback_query.message, callback_query.from_user.id, session, bot),
+        fallback=send_error,
+    )
 
+@daily_router.message(Command("subscribe"))
+async def handle_subscribe_command(message: Message, command: CommandObject, daily_movie: DailyMovie):
+    """Subscribes the user to the daily push: /subscribe [hour 0-23] [timezone]."""
+    if not DAILY_PUSH_ENABLED:
+        await message.answer("عذرًا، الإرسال اليومي غير مفعّل حاليًا. يمكنك استخدام /daily في أي وقت.")
+        return
+    # In backticks so underscores in names like America/New_York are not read as Markdown
+    zones = ", ".join(f"`{zone}`" for zone in daily_movie.zones)
+    hour = DAILY_PUSH_DEFAULT_HOUR
+    bucket = None
+    for arg in (command.args or "").split():
+        if arg.isdigit():
+            hour = int(arg)
+            if not 0 <= hour <= 23:
+                await message.answer("الرجاء تحديد ساعة الإرسال كرقم من 0 إلى 23، مثال: /subscribe 9")
+                return
+        else:
+            bucket = daily_movie.find_bucket(arg)
+            if bucket is None:
+                await message.answer(f"المنطقة الزمنية غير متاحة. المناطق المتاحة: {zones}\nمثال: `/subscribe 9 {daily_movie.default_bucket}`")
+                return
+
+    await database.add_user_if_not_exists(
+        user_id=message.from_user.id,
+        first_name=message.from_user.first_name,
+        last_name=message.from_user.last_name,
+        username=message.from_user.username
+    )
+    if bucket is None:
+        # Changing only the hour keeps the timezone chosen earlier
+        bucket = daily_movie.bucket_of(await database.get_subscriber_bucket(message.from_user.id))
+    if await database.subscribe_user(message.from_user.id, bucket, hour):
+        zone_hint = f"\nالمناطق الزمنية المتاحة: {zones}" if len(daily_movie.zones) > 1 else ""
+        await message.answer(
+            f"✅ تم الاشتراك! سيصلك فيلم اليوم يوميًا عند الساعة {hour:02d}:00 بتوقيت `{bucket}`.\n"
+            f"لتغيير الساعة أو المنطقة الزمنية أرسل /subscribe متبوعًا بهما، ولإلغاء الاشتراك أرسل /unsubscribe.{zone_hint}"
+        )
+    else:
+        await message.answer("حدث خطأ أثناء الاشتراك. يرجى المحاولة مرة أخرى لاحقًا.")
+
+@daily_router.message(Command("unsubscribe"))
+async def handle_unsubscribe_command(message: Message):
+    """Removes the user from the daily push."""
+    removed = await database.unsubscribe_user(message.from_user.id)
+    if removed is True:
+        await message.answer("تم إلغاء الاشتراك في الإرسال اليومي.")
+    elif removed is False:
+        await message.answer("أنت غير مشترك في الإرسال اليومي. للاشتراك أرسل /subscribe")
+    else:
+        await message.answer("حدث خطأ أثناء إلغاء الاشتراك. يرجى المحاولة مرة أخرى لاحقًا.")
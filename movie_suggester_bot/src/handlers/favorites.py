@@ -1,17 +1,21 @@
 # -*- coding: utf-8 -*-
 import logging
+from typing import Awaitable, Callable
+
 import aiohttp
 
 from aiogram import Router, F, Bot
 from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from aiogram.utils.markdown import hbold, hitalic
+from aiogram.types import Message, CallbackQuery
 
 # Use absolute imports
-from src.services import tmdb, database
+from src import cards
+from src.cards import MovieRecord
+from src.services import tmdb, database, seen, for_you
+from src.utils import with_stale_notice, answer_then_run, status_keyboard, begin_writes
 
 logger = logging.getLogger(__name__)
-favorites_router = Router()
+favorites_router = Router(name="favorites")
 
 async def show_favorites_list(message: Message, session: aiohttp.ClientSession, bot: Bot):
     """Displays the user's favorite movies with remove buttons."""
@@ -36,26 +40,20 @@ async def show_favorites_list(message: Message, session: aiohttp.ClientSession,
     for movie_id, movie_title in favorite_movies:
         # Fetch details for poster and release date (optional, could be stored too)
         details = await tmdb.get_movie_details(session, movie_id)
-        release_date = "غير معروف"
-        poster_url = None
-        if details:
-            release_date = details.get("release_date", "غير معروف")
-            poster_path = details.get("poster_path")
-            poster_url = tmdb.get_poster_url(poster_path)
-
-        caption = f"🎬 {hbold(movie_title)} ({release_date[:4] if release_date else 'N/A'})"
-        remove_button = InlineKeyboardButton(text="❌ إزالة", callback_data=f"fav_rem_{movie_id}")
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[remove_button]])
-
-        if poster_url:
+        record = MovieRecord.from_tmdb(details, title=movie_title) if details else MovieRecord(movie_id, movie_title)
+        card = cards.render(record, cards.FAVORITE)
+        # Per card: one stale favorite does not mark the others
+        caption = with_stale_notice(card.caption, details)
+
+        if card.poster:
             try:
                 # Send to user's chat ID directly
-                await bot.send_photo(user_id, photo=poster_url, caption=caption, reply_markup=keyboard)
+                await bot.send_photo(user_id, photo=card.poster, caption=caption, reply_markup=card.keyboard)
             except Exception as e:
                 logger.warning(f"Failed to send photo for favorite movie {movie_id}. Sending text. Error: {e}")
-                await bot.send_message(user_id, caption, reply_markup=keyboard)
+                await bot.send_message(user_id, caption, reply_markup=card.keyboard)
         else:
-            await bot.send_message(user_id, caption, reply_markup=keyboard)
+            await bot.send_message(user_id, caption, reply_markup=card.keyboard)
 
 @favorites_router.message(Command("favorites"))
 async def handle_favorites_command(message: Message, session: aiohttp.ClientSession, bot: Bot):
@@ -73,33 +71,59 @@ async def handle_add_favorite(callback_query: CallbackQuery, session: aiohttp.Cl
         await callback_query.answer("خطأ في بيانات الإضافة.", show_alert=True)
         return
 
+    original_markup = callback_query.message.reply_markup
+
+    async def restore_button(text: str):
+        # Put the add button back so the user can try again
+        try:
+            await callback_query.message.edit_reply_markup(reply_markup=original_markup)
+        except Exception as e:
+            logger.warning(f"Could not restore add button after failed favorite: {e}")
+        await callback_query.message.answer(text)
+
+    # Acknowledge right away and show progress on the button; the title lookup and insert run in the background
+    await answer_then_run(
+        callback_query, "add_favorite",
+        lambda: add_favorite(callback_query, session, movie_id, restore_button),
+        answer_text="⏳ جاري الإضافة إلى المفضلة...",
+        progress_markup=status_keyboard("⏳ جاري الإضافة..."),
+        fallback=restore_button,
+    )
+
+async def add_favorite(callback_query: CallbackQuery, session: aiohttp.ClientSession, movie_id: int,
+                       restore_button: Callable[[str], Awaitable[None]]):
+    """Looks up the movie title, stores the favorite and shows the result on the message's button."""
     user_id = callback_query.from_user.id
 
     # Fetch movie details to get the full title
     details = await tmdb.get_movie_details(session, movie_id)
     if not details or not details.get("title"):
         logger.error(f"Could not fetch details or title for movie ID {movie_id} to add to favorites.")
-        await callback_query.answer("عذرًا، لم أتمكن من جلب تفاصيل الفيلم للإضافة.", show_alert=True)
+        await restore_button("عذرًا، لم أتمكن من جلب تفاصيل الفيلم للإضافة.")
         return
 
     movie_title = details["title"]
 
-    # Add to database using the fetched full title
+    # Add to database using the fetched full title; past this point the deadline no longer cancels.
+    # The pair counts behind "users who liked this also liked" are updated in the same transaction.
+    begin_writes()
     added = await database.add_favorite_db(user_id, movie_id, movie_title)
 
     if added is True:
-        await callback_query.answer(f"تمت إضافة '{movie_title}' إلى المفضلة بنجاح!", show_alert=False) # Less intrusive alert
-        # Optionally, edit the original message to show confirmation or remove button
-        try:
-            # Create a new keyboard without the add button, maybe add a remove button?
-            # For simplicity, just remove the keyboard
-            await callback_query.message.edit_reply_markup(reply_markup=None)
-        except Exception as e:
-            logger.warning(f"Could not edit message after adding favorite: {e}")
+        await seen.mark_seen(user_id, [movie_id])
+        # The details came with TMDb's recommendations; keep them for "for you" suggestions
+        await for_you.remember_details(details)
+        for_you.invalidate(user_id)
+        result_markup = status_keyboard("✅ تمت الإضافة إلى المفضلة")
     elif added is False:
-        await callback_query.answer("هذا الفيلم موجود بالفعل في المفضلة.", show_alert=True)
+        result_markup = status_keyboard("⭐ موجود بالفعل في المفضلة")
     else:
-        await callback_query.answer("حدث خطأ أثناء إضافة الفيلم للمفضلة.", show_alert=True)
+        await restore_button("حدث خطأ أثناء إضافة الفيلم للمفضلة.")
+        return
+    try:
+        await callback_query.message.edit_reply_markup(reply_markup=result_markup)
+    except Exception as e:
+        logger.warning(f"Could not edit message after adding favorite: {e}")
 
 @favorites_router.callback_query(F.data.startswith("fav_rem_"))
 async def handle_remove_favorite(callback_query: CallbackQuery, session: aiohttp.ClientSession, bot: Bot):
@@ -115,6 +139,7 @@ async def handle_remove_favorite(callback_query: CallbackQuery, session: aiohttp
     removed = await database.remove_favorite_db(user_id, movie_id)
 
     if removed is True:
+        for_you.invalidate(user_id)
         await callback_query.answer("تمت إزالة الفيلم من المفضلة بنجاح!", show_alert=False) # Less intrusive
         # Remove the message containing the removed favorite
         try:
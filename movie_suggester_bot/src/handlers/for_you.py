@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import logging
+import aiohttp
+
+from aiogram import Router, Bot
+from aiogram.filters import Command
+from aiogram.types import Message
+
+# Use absolute imports
+from src.handlers.daily import send_movie_card
+from src.services import database, for_you
+
+logger = logging.getLogger(__name__)
+for_you_router = Router(name="for_you")
+
+async def send_for_you_suggestion(message: Message, session: aiohttp.ClientSession, bot: Bot):
+    """Sends a movie ranked by the user's favorites."""
+    user_id = message.from_user.id
+    # Add user to DB if not exists
+    await database.add_user_if_not_exists(
+        user_id=user_id,
+        first_name=message.from_user.first_name,
+        last_name=message.from_user.last_name,
+        username=message.from_user.username
+    )
+
+    favorite_ids = await database.get_favorite_ids(user_id)
+    if not favorite_ids:
+        await message.answer("أضف بعض الأفلام إلى مفضلتك أولًا (زر ⭐ في بطاقة الفيلم)، وسأقترح عليك أفلامًا تناسب ذوقك.")
+        return
+
+    movie = await for_you.pick(session, user_id, favorite_ids)
+    if movie is None:
+        await message.answer("عذرًا، لم أتمكن من العثور على اقتراح مناسب لك حاليًا. يرجى المحاولة مرة أخرى لاحقًا.")
+        return
+    await send_movie_card(message, user_id, movie, session, bot)
+
+@for_you_router.message(Command("foryou"))
+async def handle_for_you_command(message: Message, session: aiohttp.ClientSession, bot: Bot):
+    """Handles the /foryou command."""
+    await send_for_you_suggestion(message, session, bot)
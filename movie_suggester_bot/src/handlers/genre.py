@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import logging
-import random
 import aiohttp
 
 from aiogram import Router, F, Bot
@@ -9,11 +8,16 @@ from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, C
 from aiogram.utils.markdown import hbold, hitalic, hlink
 
 # Use absolute imports
-from src.services import tmdb, database
+from src.services import tmdb, database, metrics, seen, catalogue, discover_pool
+from src.services.catalogue import GENRE_BITS
+from src.services.discover_pool import DiscoverFilter
 from src.config import ADMIN_ID # Import ADMIN_ID
+from src import cards
+from src.cards import MovieRecord
+from src.utils import with_stale_notice, answer_then_run, complete_card, prefetch_details, begin_writes
 
 logger = logging.getLogger(__name__)
-genre_router = Router()
+genre_router = Router(name="genre")
 
 # Cache for genres to avoid frequent API calls
 genre_cache: dict[int, str] = {}
@@ -21,7 +25,10 @@ genre_cache: dict[int, str] = {}
 async def get_genres_cached(session: aiohttp.ClientSession) -> dict[int, str]:
     """Returns genres from cache or fetches them if cache is empty."""
     global genre_cache
-    if not genre_cache:
+    if genre_cache:
+        metrics.cache_hit("genres")
+    else:
+        metrics.cache_miss("genres")
         genres = await tmdb.get_genres(session)
         if genres:
             genre_cache = genres
@@ -31,22 +38,51 @@ async def get_genres_cached(session: aiohttp.ClientSession) -> dict[int, str]:
             return {} # Return empty dict on failure
     return genre_cache
 
-async def build_genre_keyboard(session: aiohttp.ClientSession) -> InlineKeyboardMarkup:
-    """Builds the inline keyboard with genre buttons."""
+async def build_genre_keyboard(session: aiohttp.ClientSession, flt: DiscoverFilter = DiscoverFilter()) -> InlineKeyboardMarkup:
+    """
+    Builds the filter keyboard: genre toggles, decade and minimum rating, and the suggest button.
+
+    Every button carries the filter it leads to in its callback data, so no state is stored.
+    """
     genres = await get_genres_cached(session)
     buttons = []
     row = []
-    # Sort genres alphabetically by name for consistent order
-    sorted_genres = sorted(genres.items(), key=lambda item: item[1])
+    # Sort genres alphabetically by name for consistent order; only genres the filter can encode
+    sorted_genres = sorted((item for item in genres.items() if item[0] in GENRE_BITS), key=lambda item: item[1])
     for genre_id, genre_name in sorted_genres:
-        row.append(InlineKeyboardButton(text=genre_name, callback_data=f"genre_{genre_id}"))
+        text = f"✅ {genre_name}" if genre_id in flt.genres else genre_name
+        row.append(InlineKeyboardButton(text=text, callback_data=f"gf_{flt.toggle_genre(genre_id).encode()}"))
         if len(row) == 2: # Adjust number of columns if needed
             buttons.append(row)
             row = []
     if row: # Add the last row if it has buttons
         buttons.append(row)
+    if not buttons:
+        return InlineKeyboardMarkup(inline_keyboard=[])
+
+    decade_text = f"{flt.decade}–{flt.decade + 9}" if flt.decade else "كل الفترات"
+    rating_text = f"{flt.min_rating}+" if flt.min_rating else "أي تقييم"
+    buttons.append([
+        InlineKeyboardButton(text=f"📅 {decade_text}", callback_data=f"gf_{flt.next_decade().encode()}"),
+        InlineKeyboardButton(text=f"⭐ {rating_text}", callback_data=f"gf_{flt.next_rating().encode()}"),
+    ])
+    last_row = [InlineKeyboardButton(text="🎬 اقترح فيلمًا", callback_data=f"gfgo_{flt.encode()}")]
+    if flt != DiscoverFilter():
+        last_row.append(InlineKeyboardButton(text="🔄 مسح", callback_data=f"gf_{DiscoverFilter().encode()}"))
+    buttons.append(last_row)
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+def describe_filter(flt: DiscoverFilter) -> str:
+    """Short Arabic description of a filter for progress and error messages."""
+    parts = []
+    if flt.genres:
+        parts.append("، ".join(genre_cache.get(genre_id, str(genre_id)) for genre_id in flt.genres))
+    if flt.decade:
+        parts.append(f"{flt.decade}–{flt.decade + 9}")
+    if flt.min_rating:
+        parts.append(f"تقييم {flt.min_rating}+")
+    return " | ".join(parts)
+
 async def send_genre_selection_keyboard(message: Message, session: aiohttp.ClientSession):
     """Sends the message with the genre selection keyboard."""
     # Add user to DB if not exists
@@ -60,81 +96,112 @@ async def send_genre_selection_keyboard(message: Message, session: aiohttp.Clien
     if not keyboard.inline_keyboard: # Check if keyboard is empty (fetch failed)
         await message.answer("عذرًا، لم أتمكن من جلب قائمة الأنواع حاليًا. يرجى المحاولة مرة أخرى لاحقًا.")
         return
-    await message.answer("الرجاء اختيار نوع الفيلم المفضل لديك:", reply_markup=keyboard)
+    await message.answer(
+        "اختر نوعًا أو أكثر، ويمكنك تحديد الفترة والتقييم الأدنى، ثم اضغط «🎬 اقترح فيلمًا»:",
+        reply_markup=keyboard,
+    )
 
 @genre_router.message(Command("genre"))
 async def handle_genre_command(message: Message, session: aiohttp.ClientSession):
     """Handles the /genre command."""
     await send_genre_selection_keyboard(message, session)
 
+@genre_router.callback_query(F.data.startswith("gf_"))
+async def handle_filter_toggle(callback_query: CallbackQuery, session: aiohttp.ClientSession):
+    """Handles a genre, decade or rating toggle by redrawing the keyboard with the new filter."""
+    flt = DiscoverFilter.decode(callback_query.data[len("gf_"):])
+    if flt is None:
+        logger.error(f"Invalid filter callback data received: {callback_query.data}")
+        await callback_query.answer("حدث خطأ غير متوقع.", show_alert=True)
+        return
+    await callback_query.answer()
+    try:
+        await callback_query.message.edit_reply_markup(reply_markup=await build_genre_keyboard(session, flt))
+    except Exception as e:
+        logger.warning(f"Could not update filter keyboard: {e}")
+
+@genre_router.callback_query(F.data.startswith("gfgo_"))
+async def handle_filter_suggest(callback_query: CallbackQuery, session: aiohttp.ClientSession, bot: Bot):
+    """Handles the suggest button of the filter keyboard."""
+    flt = DiscoverFilter.decode(callback_query.data[len("gfgo_"):])
+    if flt is None:
+        logger.error(f"Invalid filter callback data received: {callback_query.data}")
+        await callback_query.answer("حدث خطأ غير متوقع.", show_alert=True)
+        return
+    await start_suggestion(callback_query, session, bot, flt)
+
 @genre_router.callback_query(F.data.startswith("genre_"))
 async def handle_genre_selection(callback_query: CallbackQuery, session: aiohttp.ClientSession, bot: Bot):
-    """Handles the selection of a genre from the inline keyboard."""
+    """Handles single-genre buttons of keyboards sent before filters existed."""
     genre_id_str = callback_query.data.split("_")[1]
     try:
         genre_id = int(genre_id_str)
-        logger.info(f"Received genre selection callback. Genre ID string: {genre_id_str}, Parsed integer ID: {genre_id}")
+        logger.debug("Received genre selection callback for genre %s", genre_id)
     except (ValueError, IndexError):
         logger.error(f"Invalid genre callback data received: {callback_query.data}")
         await callback_query.answer("حدث خطأ غير متوقع.", show_alert=True)
         return
+    flt = DiscoverFilter(genres=(genre_id,)) if genre_id in GENRE_BITS else DiscoverFilter()
+    await start_suggestion(callback_query, session, bot, flt)
+
+async def start_suggestion(callback_query: CallbackQuery, session: aiohttp.ClientSession, bot: Bot, flt: DiscoverFilter):
+    # Acknowledge and show progress right away; the movie is picked in the background
+    description = describe_filter(flt)
+    progress_text = f"جاري البحث عن فيلم: {hbold(description)}..." if description else "جاري البحث عن فيلم..."
+    await answer_then_run(
+        callback_query, "suggest_from_genre",
+        lambda: suggest_from_genre(callback_query, session, bot, flt),
+        progress_text=progress_text,
+    )
 
-    genres = await get_genres_cached(session)
-    genre_name = genres.get(genre_id, "غير معروف")
-
-    await callback_query.message.edit_text(f"جاري البحث عن فيلم من نوع: {hbold(genre_name)}...")
-
-    movies = await tmdb.discover_movies_by_genre(session, genre_id)
-
-    if movies:
-        selected_movie = random.choice(movies)
-        movie_id = selected_movie.get("id")
-        title = selected_movie.get("title", "غير متوفر")
-        overview = selected_movie.get("overview", "لا يوجد وصف متاح.")
-        release_date = selected_movie.get("release_date", "غير معروف")
-        vote_average = selected_movie.get("vote_average", 0)
-        poster_path = selected_movie.get("poster_path")
-        poster_url = tmdb.get_poster_url(poster_path)
-
-        # Fetch more details (optional, for director/cast)
-        details = await tmdb.get_movie_details(session, movie_id)
-        director = "غير معروف"
-        cast_list = []
-        if details and details.get("credits"):
-            crew = details["credits"].get("crew", [])
-            cast = details["credits"].get("cast", [])
-            for member in crew:
-                if member.get("job") == "Director":
-                    director = member.get("name", "غير معروف")
-                    break
-            cast_list = [actor.get("name") for actor in cast[:5]] # Top 5 actors
-
-        # Corrected caption f-string (used single quotes for join separator)
-        caption = (
-            f"🎬 {hbold(title)}\n\n"
-            f"📅 تاريخ الإصدار: {release_date}\n"
-            f"⭐ التقييم: {vote_average}/10\n"
-            f"🎬 المخرج: {director}\n"
-            f"🎭 الممثلون: {', '.join(cast_list) if cast_list else 'غير معروف'}\n\n"
-            f"📝 الوصف: {hitalic(overview) if overview else 'لا يوجد وصف.'}"
-        )
-
-        # Add favorite button
-        fav_button = InlineKeyboardButton(text="➕ إضافة للمفضلة", callback_data=f"fav_add_{movie_id}") # Pass only movie_id
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[fav_button]])
-
-        if poster_url:
-            try:
-                await callback_query.message.delete() # Delete the "Searching..." message
-                await bot.send_photo(callback_query.from_user.id, photo=poster_url, caption=caption, reply_markup=keyboard)
-            except Exception as e:
-                logger.warning(f"Failed to send photo for movie {movie_id}. Sending text instead. Error: {e}")
-                await bot.send_message(callback_query.from_user.id, caption, reply_markup=keyboard)
-        else:
-            await callback_query.message.edit_text(caption, reply_markup=keyboard)
+async def suggest_from_genre(callback_query: CallbackQuery, session: aiohttp.ClientSession, bot: Bot, flt: DiscoverFilter):
+    """Picks a movie matching the filter and replaces the progress message with its card."""
+    await get_genres_cached(session)
+    user_id = callback_query.from_user.id
+
+    # Movies this user was already shown or has favorited are skipped either way
+    movie = None
+    if not flt.decade and not flt.min_rating and len(flt.genres) <= 1:
+        # A single genre (or none) is sampled from the local catalogue snapshot if there is one
+        movie = await catalogue.pick_for_user(session, user_id, flt.genres[0] if flt.genres else None)
+    if movie is None:
+        # One combined discover query per filter, with its result pages cached
+        movie = await discover_pool.pick(session, flt, user_id)
+
+    if movie:
+        record = MovieRecord.from_tmdb(movie)
+        card = cards.render(record, cards.SUGGESTION)
+
+        # Fetch director/cast concurrently unless the cached card already has them
+        details_task = None if card.has_credits else prefetch_details(session, record.id)
+        caption = with_stale_notice(card.caption, movie)
+
+        # Replacing the progress message and marking the movie seen are not interrupted by the deadline
+        begin_writes()
+        sent = None
+        try:
+            if card.poster:
+                try:
+                    await callback_query.message.delete() # Delete the "Searching..." message
+                    sent = await bot.send_photo(callback_query.from_user.id, photo=card.poster, caption=caption, reply_markup=card.keyboard)
+                except Exception as e:
+                    logger.warning(f"Failed to send photo for movie {record.id}. Sending text instead. Error: {e}")
+                    sent = await bot.send_message(callback_query.from_user.id, caption, reply_markup=card.keyboard)
+            else:
+                edited = await callback_query.message.edit_text(caption, reply_markup=card.keyboard)
+                sent = edited if isinstance(edited, Message) else None
+        finally:
+            if sent is not None:
+                await seen.mark_seen(user_id, [record.id])
+            if details_task:
+                # Fill in director and cast when they arrive, or leave the card as is
+                await complete_card(sent, details_task, lambda details: with_stale_notice(
+                    cards.render(record.with_credits(details), cards.SUGGESTION).caption, movie, details))
 
     else:
-        await callback_query.message.edit_text(f"عذرًا، لم يتم العثور على أفلام من نوع {hbold(genre_name)} حاليًا أو حدث خطأ.")
-
-    await callback_query.answer() # Acknowledge the callback query
+        description = describe_filter(flt)
+        if description:
+            await callback_query.message.edit_text(f"عذرًا، لم يتم العثور على أفلام تطابق: {hbold(description)} حاليًا أو حدث خطأ.")
+        else:
+            await callback_query.message.edit_text("عذرًا، لم يتم العثور على أفلام حاليًا أو حدث خطأ.")
 
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import logging
+import aiohttp
+
+from aiogram import Router, F, Bot
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+
+# Use absolute imports
+from src import cards
+from src.config import SIMILAR_SHOWN
+from src.handlers.daily import send_movie_card
+from src.services import catalogue, tmdb
+from src.services.similar_movies import SimilarMovies
+from src.utils import answer_then_run
+
+logger = logging.getLogger(__name__)
+similar_router = Router(name="similar")
+
+@similar_router.callback_query(F.data.startswith(cards.SIMILAR_CALLBACK_PREFIX))
+async def handle_similar(callback_query: CallbackQuery, similar_movies: SimilarMovies):
+    """Handles a card's "users who liked this also liked" button from the precomputed lists."""
+    try:
+        movie_id = int(callback_query.data[len(cards.SIMILAR_CALLBACK_PREFIX):])
+    except ValueError:
+        logger.error(f"Invalid similar callback data: {callback_query.data}")
+        await callback_query.answer("حدث خطأ غير متوقع.", show_alert=True)
+        return
+
+    neighbors = similar_movies.neighbors(movie_id, SIMILAR_SHOWN)
+    if not neighbors:
+        await callback_query.answer("لا توجد بيانات كافية بعد عن محبي هذا الفيلم.", show_alert=True)
+        return
+    await callback_query.answer()
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"🎬 {title[:40]}", callback_data=f"simcard_{other}")] for other, title in neighbors
+    ])
+    await callback_query.message.answer("👥 من أضاف هذا الفيلم إلى مفضلته أضاف أيضًا:", reply_markup=keyboard)
+
+@similar_router.callback_query(F.data.startswith("simcard_"))
+async def handle_similar_card(callback_query: CallbackQuery, session: aiohttp.ClientSession, bot: Bot):
+    """Sends the card of a movie picked from a similar-movies list."""
+    try:
+        movie_id = int(callback_query.data.split("_")[1])
+    except (IndexError, ValueError):
+        logger.error(f"Invalid similar card callback data: {callback_query.data}")
+        await callback_query.answer("حدث خطأ غير متوقع.", show_alert=True)
+        return
+
+    async def send_error(text: str):
+        await callback_query.message.answer(text)
+
+    async def send_card():
+        # Favorited movies are usually in the catalogue table; otherwise their details are fetched
+        movie = await catalogue.get_movie(session, movie_id) or await tmdb.get_movie_details(session, movie_id)
+        if not movie:
+            await send_error("عذرًا، لم أتمكن من جلب تفاصيل الفيلم حاليًا. يرجى المحاولة مرة أخرى لاحقًا.")
+            return
+        await send_movie_card(callback_query.message, callback_query.from_user.id, movie, session, bot)
+
+    await answer_then_run(callback_query, "similar_card", send_card, fallback=send_error)
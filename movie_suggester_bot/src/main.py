@@ -1,63 +1,187 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import logging
-import aiohttp
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties # Import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
 
 # Use absolute imports based on the project structure when running as a module
-from src.config import TELEGRAM_BOT_TOKEN
-from src.services import database
+from src.config import (
+    TELEGRAM_BOT_TOKEN, FSM_STORAGE, FSM_TTL_SECONDS, FSM_CACHE_SIZE, DROP_PENDING_UPDATES,
+    UPDATE_CONCURRENCY, UPDATE_MAX_PENDING,
+    THROTTLE_SEARCH_BURST, THROTTLE_SEARCH_PER_MINUTE, THROTTLE_SUGGEST_BURST, THROTTLE_SUGGEST_PER_MINUTE,
+    THROTTLE_CALLBACK_BURST, THROTTLE_CALLBACK_PER_MINUTE, METRICS_PORT,
+    LOOP_LAG_THRESHOLD_MS, SLOW_UPDATE_BUDGET_MS, SLOW_UPDATE_LOG_SIZE, LOG_LEVEL, LOG_UPDATE_SAMPLE_RATE,
+    USE_UVLOOP, WARMUP_ENABLED, DAILY_TIMEZONES, DAILY_PUSH_ENABLED,
+)
+from src.services import database, metrics, tmdb, seen, catalogue, discover_pool, for_you
+from src.services.fsm_storage import SQLiteStorage, BoundedMemoryStorage
+from src.services.watchdog import LoopWatchdog
+from src.services.daily_movie import DailyMovie
+from src.services.daily_push import DailyPush
+from src.services.similar_movies import SimilarMovies
+from src.services.logging_setup import setup_logging
+from src.middlewares.ordering import ChatOrderingMiddleware
+from src.middlewares import throttling
+from src.middlewares.timing import TelegramTimingMiddleware, setup_handler_timing
 from src.handlers.common import common_router
 from src.handlers.genre import genre_router
 from src.handlers.daily import daily_router
 from src.handlers.favorites import favorites_router
+from src.handlers.for_you import for_you_router
+from src.handlers.similar import similar_router
 from src.handlers.search import search_router
 from src.handlers.admin import admin_router # Import the admin router
+from src.warmup import warm_up
+from src import cards, utils
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format=	'%(asctime)s - %(name)s - %(levelname)s - %(message)s	')
+# Configure logging: records are written by a background thread, per-update lines are sampled
+log_handler = setup_logging(
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
+    sample_rates={"aiogram.event": LOG_UPDATE_SAMPLE_RATE},
+)
 logger = logging.getLogger(__name__)
 
+def create_bot() -> Bot:
+    """Creates the Bot instance with the project's default properties."""
+    bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode="Markdown"))
+    bot.session.middleware(TelegramTimingMiddleware())
+    return bot
+
+def create_dispatcher(daily_push_enabled: bool = DAILY_PUSH_ENABLED) -> Dispatcher:
+    """
+    Creates the Dispatcher with the configured FSM storage and all routers registered.
+
+    `daily_push_enabled` starts the daily push; only one process may run it (see src.webhook).
+    """
+    # Persist FSM states in SQLite so in-progress flows survive restarts
+    if FSM_STORAGE == "sqlite":
+        storage = SQLiteStorage(ttl=FSM_TTL_SECONDS, cache_size=FSM_CACHE_SIZE)
+    else:
+        storage = BoundedMemoryStorage(ttl=FSM_TTL_SECONDS, max_entries=FSM_CACHE_SIZE)
+    dp = Dispatcher(storage=storage)
+
+    # Drop floods before they are queued or reach TMDb
+    throttle = throttling.ThrottlingMiddleware(limits={
+        throttling.SEARCH: (THROTTLE_SEARCH_BURST, THROTTLE_SEARCH_PER_MINUTE),
+        throttling.SUGGEST: (THROTTLE_SUGGEST_BURST, THROTTLE_SUGGEST_PER_MINUTE),
+        throttling.CALLBACK: (THROTTLE_CALLBACK_BURST, THROTTLE_CALLBACK_PER_MINUTE),
+    })
+    dp.update.outer_middleware(throttle)
+    dp["throttle"] = throttle
+
+    # Bounded concurrency across chats, strict ordering within a chat
+    update_scheduler = ChatOrderingMiddleware(max_concurrency=UPDATE_CONCURRENCY, max_pending=UPDATE_MAX_PENDING)
+    dp.update.outer_middleware(update_scheduler)
+    dp.shutdown.register(update_scheduler.close)
+    dp["update_scheduler"] = update_scheduler
+
+    # Register routers
+    # Order matters if handlers overlap (e.g., search catching all text)
+    dp.include_router(admin_router) # Register admin router first
+    dp.include_router(common_router)
+    dp.include_router(genre_router)
+    dp.include_router(daily_router)
+    dp.include_router(favorites_router)
+    dp.include_router(for_you_router)
+    dp.include_router(similar_router)
+    dp.include_router(search_router) # Register search last as it catches generic text
+
+    # Loop lag watchdog and slow-update log, dumped from the admin panel
+    watchdog = LoopWatchdog(
+        threshold=LOOP_LAG_THRESHOLD_MS / 1000,
+        slow_update_budget=SLOW_UPDATE_BUDGET_MS / 1000,
+        log_size=SLOW_UPDATE_LOG_SIZE,
+    )
+    dp.startup.register(watchdog.start)
+    dp.shutdown.register(watchdog.stop)
+    dp["watchdog"] = watchdog
+
+    # Movie of the day, recomputed at each timezone bucket's midnight
+    daily_movie = DailyMovie(DAILY_TIMEZONES)
+    dp.startup.register(daily_movie.start)
+    dp.shutdown.register(daily_movie.stop)
+    dp["daily_movie"] = daily_movie
+
+    # Daily push of the movie of the day to subscribers, paced across each hour
+    daily_push = DailyPush(daily_movie)
+    if daily_push_enabled:
+        dp.startup.register(daily_push.start)
+        dp.shutdown.register(daily_push.stop)
+
+    # "Users who liked this also liked" lists, loaded now and refreshed as favorites change
+    similar_movies = SimilarMovies()
+    dp.startup.register(similar_movies.start)
+    dp.shutdown.register(similar_movies.stop)
+    dp["similar_movies"] = similar_movies
+
+    # Metrics: per-handler latency and component gauges
+    setup_handler_timing(dp, watchdog)
+    metrics.register_source("update_scheduler", update_scheduler.stats)
+    metrics.register_source("throttle", throttle.stats)
+    metrics.register_source("fsm", storage.stats)
+    metrics.register_source("watchdog", watchdog.stats)
+    metrics.register_source("tmdb_breaker", tmdb.breaker.stats)
+    metrics.register_source("tmdb_hedging", tmdb.hedger.stats)
+    metrics.register_source("tmdb_scheduler", tmdb.scheduler.stats)
+    metrics.register_source("callback_work", utils.callback_work_stats)
+    metrics.register_source("cards", cards.stats)
+    metrics.register_source("daily_movie", daily_movie.stats)
+    metrics.register_source("daily_push", daily_push.stats)
+    metrics.register_source("seen", seen.stats)
+    metrics.register_source("discover_pool", discover_pool.stats)
+    metrics.register_source("for_you", for_you.stats)
+    metrics.register_source("similar_movies", similar_movies.stats)
+
+    # Local catalogue snapshot for suggestions, if one has been built
+    catalogue.load()
+    metrics.register_source("catalogue", catalogue.stats)
+    metrics.register_source("logging", lambda: {"dropped_records": log_handler.dropped})
+    return dp
+
 async def main():
     # Initialize database
     await database.init_db()
 
-    # Initialize Bot and Dispatcher with new default properties method
-    bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode="Markdown")) # New way
-    
-    # Use MemoryStorage for FSM states for simplicity, can be changed later
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    bot = create_bot()
+    dp = create_dispatcher()
 
     # Create a single aiohttp session to be used across handlers
-    async with aiohttp.ClientSession() as session:
-        # Pass the session and bot instance to the dispatcher context
+    async with tmdb.create_session() as session:
+        # Pass the session to the dispatcher context; aiogram provides bot via handler args
         dp["session"] = session
-        # dp["bot"] = bot # Pass bot instance if needed directly in handlers (e.g., for broadcast)
-        # Note: Passing bot via context is less common now; aiogram provides it via handler args
-
-        # Register routers
-        # Order matters if handlers overlap (e.g., search catching all text)
-        dp.include_router(admin_router) # Register admin router first
-        dp.include_router(common_router)
-        dp.include_router(genre_router)
-        dp.include_router(daily_router)
-        dp.include_router(favorites_router)
-        dp.include_router(search_router) # Register search last as it catches generic text
+
+        # Take the cold paths (DB, genres, suggestion pool, TMDb connections) before the first update
+        if WARMUP_ENABLED:
+            await warm_up(dp, session)
+
+        metrics_runner = await metrics.start_metrics_server(METRICS_PORT) if METRICS_PORT else None
 
         # Start polling
         logger.info("Starting bot polling...")
-        # Remove any pending updates
-        await bot.delete_webhook(drop_pending_updates=True)
-        # Pass bot instance directly to start_polling if needed by handlers like broadcast
-        await dp.start_polling(bot, session=session) # Pass session here too
+        # Switch from webhook to polling; pending updates are kept unless explicitly dropped
+        await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+        # Updates are fed one by one; the update scheduler fans them out per chat
+        try:
+            await dp.start_polling(bot, session=session, handle_as_tasks=False)
+        finally:
+            if metrics_runner:
+                await metrics_runner.cleanup()
+
+def run(coro):
+    """Runs an entry-point coroutine, on uvloop when USE_UVLOOP is set and uvloop is installed."""
+    if USE_UVLOOP:
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning("USE_UVLOOP is set but uvloop is not installed; using the default event loop.")
+        else:
+            return uvloop.run(coro)
+    return asyncio.run(coro)
 
 if __name__ == '__main__':
     try:
-        asyncio.run(main())
+        run(main())
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped manually.")
     except Exception as e:
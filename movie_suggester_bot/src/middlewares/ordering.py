@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+class ChatOrderingMiddleware(BaseMiddleware):
+    """
+    Outer update middleware that processes chats concurrently but each chat in order.
+
+    Every update is appended to its chat's queue and the middleware returns at once;
+    one drain task per non-empty queue runs the chat's updates one after another.
+    At most `max_concurrency` handlers run at the same time across all chats. When
+    `max_pending` updates are queued or running, new updates wait before being
+    accepted, which stalls the polling loop (or the webhook task) instead of letting
+    the backlog grow without bound.
+    """
+
+    def __init__(self, max_concurrency: int = 32, max_pending: int = 1000):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._queues: Dict[int, Deque[Tuple[Handler, TelegramObject, Dict[str, Any], float, contextvars.Context]]] = {}
+        self._drain_tasks: Set[asyncio.Task] = set()
+        self._pending = 0
+        self._space_available = asyncio.Event()
+        self._space_available.set()
+        # Wait-time statistics since startup
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.backpressure_events = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Returns current queue depth and queueing delay figures, for metrics."""
+        return {
+            "pending": self._pending,
+            "active_chats": len(self._queues),
+            "processed": self.processed,
+            "avg_wait_seconds": self.total_wait / self.processed if self.processed else 0.0,
+            "max_wait_seconds": self.max_wait,
+            "backpressure_events": self.backpressure_events,
+        }
+
+    @staticmethod
+    def _chat_key(data: Dict[str, Any]) -> Optional[int]:
+        # Populated by aiogram's UserContextMiddleware, which runs before this one
+        chat = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user = data.get("event_from_user")
+        return user.id if user is not None else None
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        chat_key = self._chat_key(data)
+        if chat_key is None:
+            # Nothing to order against
+            return await handler(event, data)
+
+        if self._pending >= self.max_pending:
+            self.backpressure_events += 1
+            if self._space_available.is_set():
+                # Log once per episode rather than for every held update
+                logger.warning(f"Update backlog reached {self._pending}; holding new updates")
+            while self._pending >= self.max_pending:
+                self._space_available.clear()
+                await self._space_available.wait()
+
+        self._pending += 1
+        # Each update keeps the context it was fed in, so per-update context variables
+        # do not leak between updates drained one after another by the same task
+        item = (handler, event, data, time.monotonic(), contextvars.copy_context())
+        queue = self._queues.get(chat_key)
+        if queue is not None:
+            queue.append(item)
+            return None
+
+        self._queues[chat_key] = deque([item])
+        task = asyncio.create_task(self._drain(chat_key))
+        self._drain_tasks.add(task)
+        task.add_done_callback(self._drain_tasks.discard)
+        return None
+
+    async def _drain(self, chat_key: int):
+        queue = self._queues[chat_key]
+        try:
+            while queue:
+                handler, event, data, enqueued_at, context = queue[0]
+                async with self._slots:
+                    wait = time.monotonic() - enqueued_at
+                    self.processed += 1
+                    self.total_wait += wait
+                    self.max_wait = max(self.max_wait, wait)
+                    try:
+                        # aiogram's FSM middleware read the state when the update was queued; an
+                        # earlier update of this chat may have changed it since (e.g. "broadcast")
+                        state = data.get("state")
+                        if state is not None:
+                            data["raw_state"] = await state.get_state()
+                        await context.run(asyncio.create_task, handler(event, data))
+                    except Exception as e:
+                        logger.error(f"Error while processing update for chat {chat_key}: {e}", exc_info=True)
+                queue.popleft()
+                self._pending -= 1
+                self._space_available.set()
+        finally:
+            # However the drain ends (normally, or cancelled e.g. at shutdown), the chat must not
+            # keep a queue without a drainer, or __call__ would only ever append to it
+            if queue:
+                logger.warning(f"Drain of chat {chat_key} stopped with {len(queue)} updates queued; dropping them")
+                self._pending -= len(queue)
+                queue.clear()
+                self._space_available.set()
+            del self._queues[chat_key]
+
+    async def close(self, timeout: float = 10):
+        """Waits for queued updates to finish; registered as a dispatcher shutdown hook."""
+        if self._drain_tasks:
+            logger.info(f"Waiting for {self._pending} queued updates to finish...")
+            await asyncio.wait(set(self._drain_tasks), timeout=timeout)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, Update
+
+# Use absolute imports
+from src.config import ADMIN_ID
+from src.handlers.common import button_genre, button_daily, button_favorites, button_for_you
+
+logger = logging.getLogger(__name__)
+
+# Budget classes, in the order their levels are stored per user
+SEARCH, SUGGEST, CALLBACK = 0, 1, 2
+CLASS_NAMES = ("search", "suggest", "callback")
+
+# Index of the timestamps stored after the three bucket levels
+_LAST_SEEN = 3
+_LAST_WARNED = 4
+
+SUGGEST_COMMANDS = ("/genre", "/daily", "/favorites", "/foryou")
+SUGGEST_BUTTONS = (button_genre.text, button_daily.text, button_favorites.text, button_for_you.text)
+
+SLOW_DOWN_TEXT = "⏳ طلبات كثيرة في وقت قصير، يرجى الانتظار قليلاً ثم المحاولة مرة أخرى."
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer update middleware applying a per-user leaky bucket to expensive updates.
+
+    Searches (free text), suggestions (genre/daily/favorites/for-you commands, buttons and
+    genre callbacks) and other callbacks each have their own budget: a bucket of
+    `burst` updates that drains at `per_minute`. Updates that would overflow the
+    bucket are dropped before they reach any handler or TMDb; the user gets at most
+    one "slow down" reply per `warn_interval` seconds. Callbacks are always answered
+    so the button stops spinning.
+
+    State is one small array of doubles per user (three levels and two timestamps),
+    kept in an LRU map capped at `max_users`.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[int, Tuple[float, float]],
+        max_users: int = 50_000,
+        warn_interval: float = 10.0,
+    ):
+        # Per class: (burst capacity, leak rate in updates per second)
+        self.capacity = [limits[c][0] for c in (SEARCH, SUGGEST, CALLBACK)]
+        self.leak_rate = [limits[c][1] / 60.0 for c in (SEARCH, SUGGEST, CALLBACK)]
+        self.max_users = max_users
+        self.warn_interval = warn_interval
+        self._buckets: "OrderedDict[int, array]" = OrderedDict()
+        self.dropped = [0, 0, 0]
+
+    def stats(self) -> Dict[str, int]:
+        """Returns tracked users and dropped updates per class, for metrics."""
+        stats = {"tracked_users": len(self._buckets)}
+        for budget_class, name in enumerate(CLASS_NAMES):
+            stats[f"dropped_{name}"] = self.dropped[budget_class]
+        return stats
+
+    @staticmethod
+    def classify(update: Update) -> Optional[int]:
+        """Returns the budget class of an update, or None if it is not throttled."""
+        if update.message is not None:
+            text = update.message.text
+            if not text:
+                return None
+            if text.startswith("/"):
+                return SUGGEST if text.split()[0].split("@")[0] in SUGGEST_COMMANDS else None
+            return SUGGEST if text in SUGGEST_BUTTONS else SEARCH
+        if update.callback_query is not None:
+            data = update.callback_query.data or ""
+            return SUGGEST if data.startswith(("genre_", "gfgo_", "simcard_")) else CALLBACK
+        return None
+
+    def _allow(self, user_id: int, budget_class: int, now: float) -> Tuple[bool, bool]:
+        """Takes one unit from the user's bucket. Returns (allowed, should_warn)."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = array("d", (0.0, 0.0, 0.0, now, 0.0))
+            self._buckets[user_id] = bucket
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            elapsed = now - bucket[_LAST_SEEN]
+            for c in (SEARCH, SUGGEST, CALLBACK):
+                bucket[c] = max(0.0, bucket[c] - elapsed * self.leak_rate[c])
+            bucket[_LAST_SEEN] = now
+
+        if bucket[budget_class] + 1.0 <= self.capacity[budget_class]:
+            bucket[budget_class] += 1.0
+            return True, False
+
+        should_warn = now - bucket[_LAST_WARNED] >= self.warn_interval
+        if should_warn:
+            bucket[_LAST_WARNED] = now
+        return False, should_warn
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        budget_class = self.classify(event)
+        if user is None or budget_class is None or user.id == ADMIN_ID:
+            return await handler(event, data)
+
+        allowed, should_warn = self._allow(user.id, budget_class, time.monotonic())
+        if allowed:
+            return await handler(event, data)
+
+        self.dropped[budget_class] += 1
+        logger.info("Throttled %s update from user %s", CLASS_NAMES[budget_class], user.id)
+        try:
+            if isinstance(event.event, CallbackQuery):
+                await event.event.answer(SLOW_DOWN_TEXT if should_warn else None)
+            elif should_warn and isinstance(event.event, Message):
+                await event.event.answer(SLOW_DOWN_TEXT)
+        except Exception as e:
+            logger.warning(f"Could not send slow-down notice to user {user.id}: {e}")
+        return None
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher, BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+# Use absolute import
+from src.services import metrics
+from src.services.watchdog import LoopWatchdog
+
+def describe_event(event: TelegramObject) -> str:
+    """Short, privacy-preserving description of an update for the slow-update log."""
+    if isinstance(event, Message):
+        text = event.text or ""
+        if text.startswith("/"):
+            return text.split()[0]
+        return f"text({len(text)} chars)" if text else (event.content_type or "message")
+    if isinstance(event, CallbackQuery):
+        return f"data={event.data}"
+    return ""
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Inner middleware timing each handler call, labelled by router and handler name.
+
+    When a watchdog is given, the per-stage breakdown of each call is collected in
+    metrics.current_stages and over-budget calls go to its slow-update log.
+    """
+
+    def __init__(self, watchdog: Optional[LoopWatchdog] = None):
+        self.watchdog = watchdog
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        router = data.get("event_router")
+        handler_object = data.get("handler")
+        router_name = router.name if router is not None else "unknown"
+        handler_name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        stages: Dict[str, float] = {}
+        token = metrics.current_stages.set(stages)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.current_stages.reset(token)
+            metrics.HANDLER_SECONDS.observe(elapsed, router_name, handler_name)
+            if self.watchdog is not None:
+                chat = data.get("event_chat")
+                self.watchdog.record_update(
+                    type(event).__name__, describe_event(event), chat.id if chat else None,
+                    f"{router_name}.{handler_name}", elapsed, stages,
+                )
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Bot session middleware timing every Bot API call by method name."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            metrics.TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, method.__api_method__)
+
+def setup_handler_timing(dp: Dispatcher, watchdog: Optional[LoopWatchdog] = None):
+    """Registers handler timing for messages and callbacks; inner middlewares apply to child routers too."""
+    middleware = HandlerTimingMiddleware(watchdog)
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped catalogue snapshot for weighted movie sampling without TMDb calls.
+
+The snapshot is a directory of .npy files built from the filled-in rows of the
+catalogue table by `python3 -m src.tools.build_catalogue`:
+
+* movies.npy: one row per movie (id, popularity, vote_average, year, genre_mask)
+* alias.npy: Vose alias tables, one per genre plus one over all movies,
+  concatenated; each column holds (row, prob, alias_row)
+* alias_offsets.npy: (genre_bit, start, stop) of each table in alias.npy,
+  with genre_bit -1 for the table over all movies
+
+Each build writes a new generation directory inside CATALOGUE_DIR and then
+replaces the CURRENT file naming it, so a loader sees one whole generation or
+the previous one, never a mix. The files are opened with mmap_mode="r", so
+worker processes share one copy in
+the page cache and nothing is parsed at startup. Sampling a movie of a genre,
+weighted by popularity and rating, is one random column and one comparison.
+NumPy is optional: without it, or without a snapshot, load() returns False and
+suggestions keep using TMDb.
+"""
+import logging
+import math
+import os
+import random
+import shutil
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency; suggestions fall back to TMDb
+    np = None
+
+# Use absolute imports
+from src.config import CATALOGUE_DIR
+from src.services import database, seen, tmdb
+
+logger = logging.getLogger(__name__)
+
+# Bit of each TMDb movie genre in genre_mask; bits must never be reassigned
+GENRE_BITS: Dict[int, int] = {
+    28: 0, 12: 1, 16: 2, 35: 3, 80: 4, 99: 5, 18: 6, 10751: 7, 14: 8, 36: 9,
+    27: 10, 10402: 11, 9648: 12, 10749: 13, 878: 14, 10770: 15, 53: 16, 10752: 17, 37: 18,
+}
+ALL_GENRES = -1
+
+MOVIE_DTYPE = [("id", "<i4"), ("popularity", "<f4"), ("vote_average", "<f4"), ("year", "<u2"), ("genre_mask", "<u4")]
+ALIAS_DTYPE = [("row", "<i4"), ("prob", "<f4"), ("alias", "<i4")]
+
+# File in the catalogue directory naming the generation directory in use
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "snapshot-"
+
+def genre_mask(genre_ids: Iterable[int]) -> int:
+    """Returns the bitmask of TMDb genre IDs (unknown genres are ignored)."""
+    mask = 0
+    for genre_id in genre_ids:
+        bit = GENRE_BITS.get(genre_id)
+        if bit is not None:
+            mask |= 1 << bit
+    return mask
+
+def catalogue_row(movie: Dict[str, Any]) -> tuple:
+    """Returns the catalogue row of a TMDb list result or details response (see database.upsert_catalogue_movies)."""
+    genre_ids = movie.get("genre_ids") or [genre["id"] for genre in movie.get("genres", [])]
+    return (
+        movie["id"], movie.get("title"), movie.get("original_title"), movie.get("release_date") or None,
+        movie.get("popularity") or 0.0, movie.get("vote_average") or 0.0,
+        genre_mask(genre_ids), movie.get("poster_path"), movie.get("overview"),
+    )
+
+def weight(popularity: float, vote_average: float) -> float:
+    """Sampling weight: grows with the log of popularity and with the rating (unrated counts as 5/10)."""
+    return math.log1p(max(popularity, 0.0)) * ((vote_average or 5.0) / 10.0) ** 2
+
+def build_alias(weights: List[float]) -> Tuple[List[float], List[int]]:
+    """Vose's alias method: returns (prob, alias) columns for sampling indices proportionally to `weights`."""
+    n = len(weights)
+    total = sum(weights)
+    if n == 0 or total <= 0:
+        return [1.0] * n, list(range(n))
+    scaled = [w * n / total for w in weights]
+    prob = [0.0] * n
+    alias = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    for i in small + large:
+        prob[i] = 1.0
+    return prob, alias
+
+def write_snapshot(directory: str, movies: List[Tuple[int, float, float, int, int]]) -> Dict[str, int]:
+    """
+    Writes a snapshot of (id, popularity, vote_average, year, genre_mask) rows as a new
+    generation in `directory` and makes it current.
+
+    The previous generation is kept for bots still mapping it; older ones are
+    removed. Returns the number of movies per table key, for reporting.
+    """
+    if np is None:
+        raise RuntimeError("numpy is required to build the catalogue snapshot (pip install numpy)")
+    generation = f"{GENERATION_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    target = os.path.join(directory, generation)
+    os.makedirs(target)
+    table = np.array(movies, dtype=MOVIE_DTYPE)
+    weights = [weight(float(p), float(v)) for p, v in zip(table["popularity"], table["vote_average"])]
+
+    columns: List[np.ndarray] = []
+    offsets = []
+    counts = {}
+    start = 0
+    for key in [ALL_GENRES, *sorted(GENRE_BITS.values())]:
+        if key == ALL_GENRES:
+            rows = np.arange(len(table), dtype="<i4")
+        else:
+            rows = np.flatnonzero(table["genre_mask"] & (1 << key)).astype("<i4")
+        if len(rows) == 0:
+            continue
+        prob, alias = build_alias([weights[r] for r in rows])
+        column = np.empty(len(rows), dtype=ALIAS_DTYPE)
+        column["row"] = rows
+        column["prob"] = prob
+        column["alias"] = rows[alias]
+        columns.append(column)
+        offsets.append((key, start, start + len(rows)))
+        counts[str(key)] = len(rows)
+        start += len(rows)
+
+    alias_table = np.concatenate(columns) if columns else np.empty(0, dtype=ALIAS_DTYPE)
+    offsets_table = np.array(offsets, dtype="<i8").reshape(-1, 3)
+    for name, array in (("alias.npy", alias_table), ("alias_offsets.npy", offsets_table), ("movies.npy", table)):
+        with open(os.path.join(target, name), "wb") as f:
+            np.save(f, array)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # The generation is complete; switching CURRENT is the one atomic step that publishes it
+    previous = current_generation(directory)
+    pointer = os.path.join(directory, CURRENT_FILE)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(generation)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer + ".tmp", pointer)
+
+    for name in os.listdir(directory):
+        if name.startswith(GENERATION_PREFIX) and name not in (generation, previous):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return counts
+
+def current_generation(directory: str) -> Optional[str]:
+    """Returns the name of the generation CURRENT points to, or None if no snapshot was built yet."""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+class CatalogueSnapshot:
+    def __init__(self, movies, alias, offsets):
+        self.movies = movies
+        self.alias = alias
+        self.tables: Dict[int, Tuple[int, int]] = {int(key): (int(start), int(stop)) for key, start, stop in offsets}
+        if any(stop > len(alias) for _, stop in self.tables.values()):
+            raise ValueError("alias offsets do not match alias.npy")
+        self.samples = 0
+        self.enriched = 0
+
+    def __len__(self) -> int:
+        return len(self.movies)
+
+    @classmethod
+    def open(cls, directory: str) -> "CatalogueSnapshot":
+        return cls(
+            np.load(os.path.join(directory, "movies.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "alias.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "alias_offsets.npy")),
+        )
+
+    def sample(self, genre_id: Optional[int] = None, exclude: Optional[Callable[[int], bool]] = None,
+               attempts: int = 8) -> Optional[int]:
+        """
+        Returns a movie ID of `genre_id` (any genre if None), weighted by popularity and rating.
+
+        Movies for which `exclude(movie_id)` is true are redrawn up to `attempts`
+        times, after which the last draw is returned anyway. None if the genre has
+        no movies in the snapshot.
+        """
+        key = ALL_GENRES if genre_id is None else GENRE_BITS.get(genre_id)
+        bounds = self.tables.get(key) if key is not None else None
+        if bounds is None:
+            return None
+        start, stop = bounds
+        movie_id = None
+        for _ in range(attempts):
+            column = self.alias[random.randrange(start, stop)]
+            row = column["row"] if random.random() < column["prob"] else column["alias"]
+            movie_id = int(self.movies[row]["id"])
+            if exclude is None or not exclude(movie_id):
+                break
+        self.samples += 1
+        return movie_id
+
+snapshot: Optional[CatalogueSnapshot] = None
+
+def load(directory: str = CATALOGUE_DIR) -> bool:
+    """Maps the snapshot in `directory`, if numpy and the snapshot are available. Returns whether it is in use."""
+    global snapshot
+    if np is None:
+        logger.info("numpy is not installed; suggestions are drawn from TMDb.")
+        return False
+    generation = current_generation(directory)
+    if generation is None:
+        logger.info(f"No catalogue snapshot in {directory}; suggestions are drawn from TMDb.")
+        return False
+    try:
+        snapshot = CatalogueSnapshot.open(os.path.join(directory, generation))
+    except Exception as e:
+        logger.error(f"Could not load the catalogue snapshot {generation} from {directory}: {e}")
+        return False
+    logger.info(f"Catalogue snapshot {generation} loaded: {len(snapshot)} movies, {len(snapshot.tables)} sampling tables")
+    return True
+
+def sample(genre_id: Optional[int] = None, exclude: Optional[Callable[[int], bool]] = None) -> Optional[int]:
+    """Samples a movie ID from the snapshot, or returns None if no snapshot is loaded or the genre is empty."""
+    if snapshot is None:
+        return None
+    return snapshot.sample(genre_id, exclude)
+
+async def pick_for_user(session: aiohttp.ClientSession, user_id: int, genre_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Samples a movie the user has not seen and returns it as get_movie() does.
+
+    None if no snapshot is loaded, so the caller falls back to TMDb.
+    """
+    if snapshot is None:
+        return None
+    seen_movies = await seen.get_filter(user_id)
+    movie_id = snapshot.sample(genre_id, exclude=seen_movies.__contains__)
+    if movie_id is None:
+        return None
+    return await get_movie(session, movie_id)
+
+async def get_movie(session: aiohttp.ClientSession, movie_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Returns a catalogue movie shaped like a TMDb list result, or None if it is unknown or cannot be filled in.
+
+    Movies only known from an ID export are filled in from their details (and
+    the details are returned).
+    """
+    movie = await database.get_catalogue_movie(movie_id)
+    if movie is not None and movie["title"] is None:
+        # Filling in the catalogue draws from the background share of the TMDb quota
+        with tmdb.background_priority():
+            details = await tmdb.get_movie_details(session, movie_id)
+        if not details or not details.get("title"):
+            return None
+        await database.upsert_catalogue_movies([catalogue_row(details)])
+        if snapshot is not None:
+            snapshot.enriched += 1
+        return details
+    return movie
+
+def stats() -> Dict[str, float]:
+    """Returns snapshot size, samples drawn and movies filled in on demand, for metrics."""
+    if snapshot is None:
+        return {"movies": 0, "samples": 0, "enriched": 0}
+    return {"movies": len(snapshot), "samples": snapshot.samples, "enriched": snapshot.enriched}
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Movie of the day and the popular-movies pool it is drawn from.
+
+One movie is picked per timezone bucket and local date, at the bucket's local
+midnight, by a background task (background TMDb priority). The pick is stored
+in the daily_movies table with its rendered card, and its poster's Telegram
+file_id once it has been uploaded, so every /daily press for the rest of the
+day is served from memory without calling TMDb or re-uploading the poster.
+The pick is seeded by the date, and the first stored row wins, so every
+worker process serves the same movie. Users choose their bucket with
+/subscribe; everyone else is served the default (first) bucket.
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import aiohttp
+
+# Use absolute imports
+from src import cards
+from src.cards import Card, MovieRecord
+from src.config import SUGGESTION_POOL_TTL, DAILY_REPEAT_DAYS
+from src.services import tmdb, database, metrics
+from src.services.request_scheduler import background_priority
+
+logger = logging.getLogger(__name__)
+
+# Pool of popular movies suggestions are drawn from (first POPULAR_POOL_PAGES pages)
+POPULAR_POOL_PAGES = 5
+popular_pool: list[dict] = []
+popular_pool_loaded_at = 0.0
+_popular_pool_lock = asyncio.Lock()
+
+async def get_popular_pool(session: aiohttp.ClientSession) -> list[dict]:
+    """Returns the popular-movies pool, refetching all pages concurrently once it is older than SUGGESTION_POOL_TTL."""
+    global popular_pool, popular_pool_loaded_at
+    if popular_pool and time.monotonic() - popular_pool_loaded_at < SUGGESTION_POOL_TTL:
+        metrics.cache_hit("popular_pool")
+        return popular_pool
+    async with _popular_pool_lock:
+        # Another update may have refreshed the pool while we waited
+        if popular_pool and time.monotonic() - popular_pool_loaded_at < SUGGESTION_POOL_TTL:
+            metrics.cache_hit("popular_pool")
+            return popular_pool
+        metrics.cache_miss("popular_pool")
+        pages = await asyncio.gather(*(
+            tmdb.get_popular_movies(session, page=page) for page in range(1, POPULAR_POOL_PAGES + 1)
+        ))
+        movies = [movie for page in pages if page for movie in page]
+        if movies and all(page and not tmdb.is_stale(page) for page in pages):
+            popular_pool = movies
+            popular_pool_loaded_at = time.monotonic()
+        else:
+            # Some pages failed or came from TMDb's stale fallback; never cached as fresh, so
+            # the next call tries again. Movies of stale pages are already marked stale.
+            logger.warning("Failed to refresh the popular movies pool; keeping the previous one.")
+            popular_pool = tmdb.stale_copy(popular_pool) if popular_pool else movies
+    return popular_pool
+
+@dataclass
+class DailyPick:
+    bucket: str
+    day: str
+    record: MovieRecord
+    card: Card
+    poster_file_id: Optional[str] = None
+
+    @property
+    def photo(self) -> Optional[str]:
+        """The uploaded poster's file_id if known, else the poster URL."""
+        return self.poster_file_id or self.card.poster
+
+class DailyMovie:
+    def __init__(self, timezones: List[str]):
+        """`timezones` are IANA names, one bucket each; the first is used for users without a bucket."""
+        self.zones: Dict[str, ZoneInfo] = {}
+        for name in timezones:
+            try:
+                self.zones[name] = ZoneInfo(name)
+            except (ZoneInfoNotFoundError, ValueError):
+                logger.error(f"Unknown timezone {name!r} in DAILY_TIMEZONES; skipping it.")
+        if not self.zones:
+            self.zones["UTC"] = ZoneInfo("UTC")
+        self.default_bucket = next(iter(self.zones))
+        self._picks: Dict[str, DailyPick] = {}
+        self._locks: Dict[str, asyncio.Lock] = {name: asyncio.Lock() for name in self.zones}
+        self._task: Optional[asyncio.Task] = None
+        self.served = 0
+        self.computed = 0
+        self.missed = 0
+
+    def find_bucket(self, name: str) -> Optional[str]:
+        """Returns the configured bucket matching a timezone name typed by a user (case-insensitive), or None."""
+        name = name.strip().lower()
+        return next((bucket for bucket in self.zones if bucket.lower() == name), None)
+
+    def bucket_of(self, bucket: Optional[str]) -> str:
+        """Returns `bucket` if it is still configured, else the default bucket."""
+        return bucket if bucket in self.zones else self.default_bucket
+
+    def today(self, bucket: str) -> str:
+        return datetime.now(self.zones[bucket]).date().isoformat()
+
+    def current(self, bucket: Optional[str] = None) -> Optional[DailyPick]:
+        """Returns today's pick of `bucket` if it is in memory (no I/O)."""
+        bucket = bucket or self.default_bucket
+        pick = self._picks.get(bucket)
+        if pick is not None and pick.day == self.today(bucket):
+            self.served += 1
+            return pick
+        return None
+
+    async def get(self, session: aiohttp.ClientSession, bucket: Optional[str] = None) -> Optional[DailyPick]:
+        """Returns today's pick of `bucket`, loading or computing it now if the scheduled task has not yet."""
+        bucket = bucket or self.default_bucket
+        pick = self.current(bucket)
+        if pick is None:
+            self.missed += 1
+            pick = await self._ensure(session, bucket, self.today(bucket))
+        return pick
+
+    async def remember_file_id(self, pick: DailyPick, file_id: str):
+        """Stores the file_id of the pick's uploaded poster so later sends reuse it."""
+        if pick.poster_file_id:
+            return
+        pick.poster_file_id = file_id
+        await database.set_daily_poster_file_id(pick.bucket, pick.day, file_id)
+
+    async def _ensure(self, session: aiohttp.ClientSession, bucket: str, day: str) -> Optional[DailyPick]:
+        async with self._locks[bucket]:
+            pick = self._picks.get(bucket)
+            if pick is not None and pick.day == day:
+                return pick
+            row = await database.get_daily_movie(bucket, day)
+            if row is None:
+                record = await self._choose(session, bucket, day)
+                if record is None:
+                    return None
+                caption = cards.render(record, cards.DAILY).caption
+                await database.save_daily_movie(bucket, day, record.id, json.dumps(asdict(record), ensure_ascii=False), caption)
+                self.computed += 1
+                # Another worker may have stored its pick first; serve the stored one
+                row = await database.get_daily_movie(bucket, day) or (record.id, None, caption, None)
+            _, record_json, caption, poster_file_id = row
+            if record_json is not None:
+                data = json.loads(record_json)
+                record = MovieRecord(**{**data, "actors": tuple(data.get("actors", ()))})
+            pick = DailyPick(bucket, day, record, replace(cards.render(record, cards.DAILY), caption=caption), poster_file_id)
+            self._picks[bucket] = pick
+            logger.info(f"Movie of the day for {bucket} on {day}: {record.id} ({record.title})")
+            return pick
+
+    async def _choose(self, session: aiohttp.ClientSession, bucket: str, day: str) -> Optional[MovieRecord]:
+        movies = await get_popular_pool(session)
+        if not movies:
+            return None
+        recent = set(await database.get_recent_daily_movie_ids(bucket, DAILY_REPEAT_DAYS))
+        candidates = sorted((m for m in movies if m.get("id") not in recent), key=lambda m: m["id"]) or movies
+        # Seeded by the date, so buckets and workers reaching the same date pick the same movie
+        movie = random.Random(day).choice(candidates)
+        details = await tmdb.get_movie_details(session, movie["id"])
+        return MovieRecord.from_tmdb(movie).with_credits(details)
+
+    def _seconds_to_midnight(self) -> float:
+        """Seconds until the next local midnight of any bucket."""
+        seconds = []
+        for zone in self.zones.values():
+            now = datetime.now(zone)
+            midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+            seconds.append((midnight - now).total_seconds())
+        return min(seconds)
+
+    async def _run(self, session: aiohttp.ClientSession):
+        with background_priority():
+            while True:
+                for bucket in self.zones:
+                    try:
+                        if await self._ensure(session, bucket, self.today(bucket)) is None:
+                            logger.warning(f"Could not pick the movie of the day for {bucket}; retrying in a minute.")
+                            await asyncio.sleep(60)
+                            break
+                    except Exception as e:
+                        logger.error(f"Error computing the movie of the day for {bucket}: {e}", exc_info=True)
+                        await asyncio.sleep(60)
+                        break
+                else:
+                    # A second past midnight, so the new local date has begun
+                    await asyncio.sleep(self._seconds_to_midnight() + 1)
+
+    async def start(self, session: aiohttp.ClientSession):
+        """Computes today's picks and schedules the midnight rollovers (dispatcher startup hook)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(session))
+
+    async def stop(self):
+        """Cancels the rollover task (dispatcher shutdown hook)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, float]:
+        """Returns served/computed picks and presses that found no pick in memory, for metrics."""
+        return {"served": self.served, "computed": self.computed, "missed": self.missed, "buckets": len(self.zones)}
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Scheduled delivery of the movie of the day to subscribers.
+
+At the start of every local hour of each timezone bucket, subscribers whose
+delivery hour has come and who have not yet received today's movie are sent
+its precomputed card (see DailyMovie). Sends are paced by a token bucket whose
+rate is set so the hour's batch finishes within DAILY_PUSH_SPREAD_MINUTES, at
+least one per second and never above DAILY_PUSH_MAX_PER_SECOND, so large
+subscriber bases are spread evenly instead of sent in a burst. Subscribers are
+claimed just before sending, about one second's worth of sends at a time, so a
+restart never delivers twice and a crash drops at most that many deliveries;
+hours missed while the bot was down are caught up on start. The push runs in a
+single process (worker 0 in webhook mode), so the rate is the whole bot's.
+"""
+import asyncio
+import logging
+import math
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import aiohttp
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+# Use absolute imports
+from src.config import DAILY_PUSH_SPREAD_MINUTES, DAILY_PUSH_MAX_PER_SECOND
+from src.services import database
+from src.services.daily_movie import DailyMovie, DailyPick
+from src.services.request_scheduler import TokenBucket, background_priority
+
+logger = logging.getLogger(__name__)
+
+class DailyPush:
+    def __init__(self, daily_movie: DailyMovie, spread_seconds: float = DAILY_PUSH_SPREAD_MINUTES * 60,
+                 max_per_second: float = DAILY_PUSH_MAX_PER_SECOND):
+        self.daily_movie = daily_movie
+        self.spread_seconds = spread_seconds
+        self.max_per_second = max_per_second
+        self._task: Optional[asyncio.Task] = None
+        self._deliveries: Dict[str, asyncio.Task] = {}
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+
+    def _rate(self, pending: int) -> float:
+        rate = min(self.max_per_second, max(1.0, pending / self.spread_seconds))
+        if pending / rate > 3600:
+            logger.warning(f"{pending} daily push deliveries cannot finish within the hour at {rate:g}/s")
+        return rate
+
+    async def _send(self, bot: Bot, user_id: int, pick: DailyPick) -> bool:
+        for attempt in range(2):
+            try:
+                if pick.photo:
+                    sent = await bot.send_photo(user_id, photo=pick.photo, caption=pick.card.caption, reply_markup=pick.card.keyboard)
+                    if sent.photo:
+                        await self.daily_movie.remember_file_id(pick, sent.photo[-1].file_id)
+                else:
+                    await bot.send_message(user_id, pick.card.caption, reply_markup=pick.card.keyboard)
+                return True
+            except TelegramRetryAfter as e:
+                logger.warning(f"Telegram asked to slow down the daily push; waiting {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except TelegramForbiddenError:
+                # The user blocked the bot; stop sending to them
+                self.blocked += 1
+                await database.unsubscribe_user(user_id)
+                return False
+            except Exception as e:
+                logger.warning("Failed to send the daily push to user %s: %s", user_id, e)
+                return False
+        return False
+
+    async def _deliver(self, bot: Bot, session: aiohttp.ClientSession, bucket: str, day: str, hour: int):
+        pending = await database.count_due_subscribers(bucket, day, hour)
+        if not pending:
+            return
+        pick = await self.daily_movie.get(session, bucket)
+        if pick is None or pick.day != day:
+            logger.warning(f"No movie of the day for {bucket} on {day}; skipping the {hour:02d}:00 push")
+            return
+
+        rate = self._rate(pending)
+        bucket_limiter = TokenBucket(rate, 1.0)
+        logger.info(f"Daily push for {bucket} {hour:02d}:00: {pending} subscribers at {rate:.2f}/s")
+        sent = failed = 0
+        # Claims are marked delivered before sending; claiming one second of sends at a time
+        # bounds what a crash can drop
+        claim_size = max(1, math.ceil(rate))
+        while True:
+            user_ids = await database.claim_due_subscribers(bucket, day, hour, claim_size)
+            if not user_ids:
+                break
+            for user_id in user_ids:
+                await bucket_limiter.take()
+                if await self._send(bot, user_id, pick):
+                    sent += 1
+                    self.sent += 1
+                else:
+                    failed += 1
+                    self.failed += 1
+        logger.info(f"Daily push for {bucket} {hour:02d}:00 finished: {sent} sent, {failed} failed")
+
+    def _seconds_to_next_hour(self) -> float:
+        """Seconds until the next local hour starts in any bucket (zones may be offset by half hours)."""
+        seconds = []
+        for zone in self.daily_movie.zones.values():
+            now = datetime.now(zone)
+            next_hour = (now + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+            seconds.append((next_hour - now).total_seconds())
+        return min(seconds)
+
+    async def _run(self, bot: Bot, session: aiohttp.ClientSession):
+        with background_priority():
+            while True:
+                for bucket, zone in self.daily_movie.zones.items():
+                    running = self._deliveries.get(bucket)
+                    if running is not None and not running.done():
+                        # The previous hour is still being delivered; this hour's subscribers are caught up by the next run
+                        continue
+                    now = datetime.now(zone)
+                    self._deliveries[bucket] = asyncio.create_task(
+                        self._deliver_logged(bot, session, bucket, now.date().isoformat(), now.hour)
+                    )
+                await asyncio.sleep(self._seconds_to_next_hour() + 1)
+
+    async def _deliver_logged(self, bot: Bot, session: aiohttp.ClientSession, bucket: str, day: str, hour: int):
+        try:
+            await self._deliver(bot, session, bucket, day, hour)
+        except Exception as e:
+            logger.error(f"Daily push for {bucket} {hour:02d}:00 failed: {e}", exc_info=True)
+
+    async def start(self, bot: Bot, session: aiohttp.ClientSession):
+        """Starts the hourly delivery loop (dispatcher startup hook)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot, session))
+
+    async def stop(self):
+        """Stops the delivery loop and any running deliveries (dispatcher shutdown hook)."""
+        tasks = [task for task in (self._task, *self._deliveries.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._deliveries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Returns delivered, failed and blocked sends and running deliveries, for metrics."""
+        running = sum(1 for task in self._deliveries.values() if not task.done())
+        return {"sent": self.sent, "failed": self.failed, "blocked": self.blocked, "running": running}
@@ -3,77 +3,273 @@ import aiosqlite
 import logging
 import os
 
+# Use absolute import
+from src.config import DATABASE_PATH
+from src.services import metrics
+
 logger = logging.getLogger(__name__)
-DB_DIR = "/home/ubuntu/movie_suggester_bot/data"
-DB_PATH = os.path.join(DB_DIR, "bot_data.db")
+DB_PATH = DATABASE_PATH
+DB_DIR = os.path.dirname(DB_PATH) or "."
+
+async def _migrate_base_schema(db: aiosqlite.Connection):
+    """Migration 1: base users/favorites tables, reconciling legacy column layouts."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_name TEXT,
+            last_name TEXT,
+            username TEXT,
+            join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS favorites (
+            user_id INTEGER,
+            movie_id INTEGER,
+            movie_title TEXT,
+            add_date TIMESTAMP,
+            PRIMARY KEY (user_id, movie_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+
+    # Databases created by older builds may lack columns or use 'added_timestamp'
+    cursor = await db.execute("PRAGMA table_info(favorites)")
+    columns = [column[1] for column in await cursor.fetchall()]
+
+    if 'movie_title' not in columns:
+        logger.info("Adding missing 'movie_title' column to 'favorites' table.")
+        await db.execute("ALTER TABLE favorites ADD COLUMN movie_title TEXT")
+
+    if 'add_date' not in columns:
+        logger.info("Adding missing 'add_date' column to 'favorites' table.")
+        # Add without default value to comply with SQLite limitations
+        await db.execute("ALTER TABLE favorites ADD COLUMN add_date TIMESTAMP")
+
+    if 'added_timestamp' in columns:
+        logger.info("Copying legacy 'added_timestamp' values into 'add_date'.")
+        await db.execute("UPDATE favorites SET add_date = added_timestamp WHERE add_date IS NULL")
+
+async def _migrate_favorites_indexes(db: aiosqlite.Connection):
+    """Migration 2: indexes for per-user favorites listing and per-movie aggregates."""
+    # Covering index: the favorites list query is answered from the index alone
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_favorites_user_date
+        ON favorites (user_id, add_date DESC, movie_id, movie_title)
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_favorites_movie
+        ON favorites (movie_id, user_id)
+    """)
+
+async def _migrate_fsm_storage(db: aiosqlite.Connection):
+    """Migration 3: table backing the persistent FSM storage."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            storage_key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    # Supports the periodic TTL sweep
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage (updated_at)")
+
+async def _migrate_daily_movies(db: aiosqlite.Connection):
+    """Migration 4: movie of the day per timezone bucket and local date, with its rendered card."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_movies (
+            bucket TEXT NOT NULL,
+            day TEXT NOT NULL,
+            movie_id INTEGER NOT NULL,
+            record TEXT NOT NULL,
+            caption TEXT NOT NULL,
+            poster_file_id TEXT,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (bucket, day)
+        ) WITHOUT ROWID
+    """)
+
+async def _migrate_subscribers(db: aiosqlite.Connection):
+    """Migration 5: daily push subscribers with their delivery hour and last delivered day."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS subscribers (
+            user_id INTEGER PRIMARY KEY,
+            bucket TEXT NOT NULL,
+            delivery_hour INTEGER NOT NULL,
+            last_sent_day TEXT,
+            subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Supports claiming each hour's due subscribers
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_subscribers_due ON subscribers (bucket, delivery_hour, last_sent_day)")
+
+async def _migrate_user_seen(db: aiosqlite.Connection):
+    """Migration 6: per-user Bloom filter of movies already suggested or favorited."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_seen (
+            user_id INTEGER PRIMARY KEY,
+            bloom BLOB NOT NULL,
+            items INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+
+async def _migrate_catalogue(db: aiosqlite.Connection):
+    """Migration 7: local movie catalogue the suggestion snapshot is built from."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS catalogue (
+            movie_id INTEGER PRIMARY KEY,
+            title TEXT,
+            original_title TEXT,
+            release_date TEXT,
+            popularity REAL NOT NULL DEFAULT 0,
+            vote_average REAL NOT NULL DEFAULT 0,
+            genre_mask INTEGER NOT NULL DEFAULT 0,
+            poster_path TEXT,
+            overview TEXT,
+            adult INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )
+    """)
+
+async def _migrate_movie_features(db: aiosqlite.Connection):
+    """Migration 8: taste features of movies whose details were fetched, and their TMDb recommendations."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS movie_features (
+            movie_id INTEGER PRIMARY KEY,
+            year INTEGER NOT NULL DEFAULT 0,
+            genre_mask INTEGER NOT NULL DEFAULT 0,
+            cast_ids TEXT NOT NULL DEFAULT '',
+            updated_at REAL NOT NULL
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS movie_recommendations (
+            movie_id INTEGER NOT NULL,
+            recommended_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            PRIMARY KEY (movie_id, recommended_id)
+        ) WITHOUT ROWID
+    """)
+
+async def _migrate_item_pairs(db: aiosqlite.Connection):
+    """Migration 9: favorites co-occurrence counts and precomputed similar-movie lists, backfilled from favorites."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS item_pairs (
+            movie_a INTEGER NOT NULL,
+            movie_b INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (movie_a, movie_b)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_item_pairs_b ON item_pairs (movie_b)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS item_neighbors (
+            movie_id INTEGER PRIMARY KEY,
+            title TEXT,
+            neighbors BLOB NOT NULL DEFAULT x'',
+            dirty INTEGER NOT NULL DEFAULT 1,
+            updated_at REAL NOT NULL DEFAULT 0
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_item_neighbors_dirty ON item_neighbors (movie_id) WHERE dirty = 1")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_item_neighbors_updated ON item_neighbors (updated_at)")
+    # Every pair of movies favorited by the same user, once per such user (movie_a < movie_b)
+    await db.execute("""
+        INSERT OR IGNORE INTO item_pairs (movie_a, movie_b, count)
+        SELECT a.movie_id, b.movie_id, COUNT(*)
+        FROM favorites a JOIN favorites b ON a.user_id = b.user_id AND a.movie_id < b.movie_id
+        GROUP BY a.movie_id, b.movie_id
+    """)
+    await db.execute("""
+        INSERT OR IGNORE INTO item_neighbors (movie_id)
+        SELECT movie_a FROM item_pairs UNION SELECT movie_b FROM item_pairs
+    """)
+
+# Ordered schema migrations. The 1-based position of a migration in this list is
+# the schema version stored in PRAGMA user_version once it has been applied, so
+# new migrations must only ever be appended.
+MIGRATIONS = [
+    _migrate_base_schema,
+    _migrate_favorites_indexes,
+    _migrate_fsm_storage,
+    _migrate_daily_movies,
+    _migrate_subscribers,
+    _migrate_user_seen,
+    _migrate_catalogue,
+    _migrate_movie_features,
+    _migrate_item_pairs,
+]
 
 async def init_db():
-    """Initializes the database and creates tables if they don't exist."""
+    """Initializes the database, applying any pending schema migrations."""
     os.makedirs(DB_DIR, exist_ok=True)
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            # Create users table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    first_name TEXT,
-                    last_name TEXT,
-                    username TEXT,
-                    join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            # Create favorites table (ensure movie_title and add_date exist)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS favorites (
-                    user_id INTEGER,
-                    movie_id INTEGER,
-                    movie_title TEXT,
-                    add_date TIMESTAMP, -- Removed default here
-                    PRIMARY KEY (user_id, movie_id),
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-
-            # Check columns and add if missing
-            cursor = await db.execute("PRAGMA table_info(favorites)")
-            columns = [column[1] for column in await cursor.fetchall()]
+            async with db.execute("PRAGMA user_version") as cursor:
+                current_version = (await cursor.fetchone())[0]
 
-            if 'movie_title' not in columns:
-                logger.info("Adding missing 'movie_title' column to 'favorites' table.")
-                await db.execute("ALTER TABLE favorites ADD COLUMN movie_title TEXT")
+            if current_version >= len(MIGRATIONS):
+                logger.info(f"Database at {DB_PATH} is up to date (schema version {current_version})")
+                return
 
-            if 'add_date' not in columns:
-                logger.info("Adding missing 'add_date' column to 'favorites' table (without default).")
-                # Add without default value to comply with SQLite limitations
-                await db.execute("ALTER TABLE favorites ADD COLUMN add_date TIMESTAMP")
+            for version in range(current_version + 1, len(MIGRATIONS) + 1):
+                migration = MIGRATIONS[version - 1]
+                logger.info(f"Applying database migration {version}: {migration.__name__}")
+                # Each migration and its version bump are applied atomically
+                await db.execute("BEGIN")
+                try:
+                    await migration(db)
+                    await db.execute(f"PRAGMA user_version = {version}")
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    raise
 
-            await db.commit() # Commit after all checks and alterations
-            logger.info(f"Database initialized successfully at {DB_PATH}")
+            logger.info(f"Database initialized successfully at {DB_PATH} (schema version {len(MIGRATIONS)})")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
         raise
 
+async def enable_wal():
+    """Switches the database to WAL journaling so several worker processes can share it."""
+    os.makedirs(DB_DIR, exist_ok=True)
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute("PRAGMA journal_mode=WAL") as cursor:
+            mode = (await cursor.fetchone())[0]
+        logger.info(f"Database journal mode: {mode}")
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "add_favorite_db")
 async def add_favorite_db(user_id: int, movie_id: int, movie_title: str) -> bool | None:
-    """Adds a movie to the user's favorites list, setting add_date explicitly."""
+    """
+    Adds a movie to the user's favorites list, setting add_date explicitly. The movie's
+    pair counts with the user's other favorites are updated in the same transaction.
+    """
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            # Check if already favorited
-            async with db.execute("SELECT 1 FROM favorites WHERE user_id = ? AND movie_id = ?", (user_id, movie_id)) as cursor:
-                if await cursor.fetchone():
-                    return False # Already exists
-
-            # Insert new favorite, setting add_date explicitly
-            await db.execute(
-                "INSERT INTO favorites (user_id, movie_id, movie_title, add_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
-                (user_id, movie_id, movie_title)
-            )
-            await db.commit()
-            logger.info(f"Added movie {movie_id} ('{movie_title}') to favorites for user {user_id}")
-            return True
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                # Nothing changes if already favorited (favorites' primary key is (user_id, movie_id))
+                cursor = await db.execute(
+                    "INSERT OR IGNORE INTO favorites (user_id, movie_id, movie_title, add_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+                    (user_id, movie_id, movie_title)
+                )
+                added = cursor.rowcount > 0
+                if added:
+                    await _update_item_pairs(db, user_id, movie_id, 1)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        if added:
+            logger.info("Added movie %s (%r) to favorites for user %s", movie_id, movie_title, user_id)
+        return added
     except Exception as e:
         logger.error(f"Error adding favorite movie {movie_id} for user {user_id}: {e}")
         return None # Indicate error
 
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_favorites_with_titles_db")
 async def get_favorites_with_titles_db(user_id: int) -> list[tuple[int, str]]:
     """Retrieves the list of favorite movie IDs and titles for a user."""
     try:
@@ -88,24 +284,61 @@ async def get_favorites_with_titles_db(user_id: int) -> list[tuple[int, str]]:
         # Return empty list on error, log should indicate the problem (e.g., missing add_date if init failed)
         return []
 
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_favorite_ids")
+async def get_favorite_ids(user_id: int) -> list[int]:
+    """Retrieves the IDs of a user's favorite movies, most recently added first."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute("SELECT movie_id FROM favorites WHERE user_id = ? ORDER BY add_date DESC", (user_id,)) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting favorite IDs for user {user_id}: {e}")
+        return []
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "remove_favorite_db")
 async def remove_favorite_db(user_id: int, movie_id: int) -> bool | None:
-    """Removes a movie from the user's favorites list."""
+    """
+    Removes a movie from the user's favorites list. The movie's pair counts with the
+    user's other favorites are updated in the same transaction.
+    """
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("DELETE FROM favorites WHERE user_id = ? AND movie_id = ?", (user_id, movie_id))
-            await db.commit()
-            if cursor.rowcount > 0:
-                logger.info(f"Removed movie {movie_id} from favorites for user {user_id}")
-                return True # Successfully removed
-            else:
-                logger.warning(f"Attempted to remove non-existent favorite movie {movie_id} for user {user_id}")
-                return False # Not found
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute("DELETE FROM favorites WHERE user_id = ? AND movie_id = ?", (user_id, movie_id))
+                removed = cursor.rowcount > 0
+                if removed:
+                    await _update_item_pairs(db, user_id, movie_id, -1)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        if removed:
+            logger.info("Removed movie %s from favorites for user %s", movie_id, user_id)
+            return True # Successfully removed
+        logger.warning(f"Attempted to remove non-existent favorite movie {movie_id} for user {user_id}")
+        return False # Not found
     except Exception as e:
         logger.error(f"Error removing favorite movie {movie_id} for user {user_id}: {e}")
         return None # Indicate error
 
-async def add_user_if_not_exists(user_id: int, first_name: str | None, last_name: str | None, username: str | None):
-    """Adds a user to the database if they don't already exist."""
+# IDs already in the users table; lets add_user_if_not_exists skip the write for returning users
+_known_users: set[int] = set()
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "load_known_users")
+async def load_known_users() -> int:
+    """Loads all user IDs into the known-user set (startup warm-up). Returns the number loaded."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute("SELECT user_id FROM users") as cursor:
+                _known_users.update(row[0] for row in await cursor.fetchall())
+        return len(_known_users)
+    except Exception as e:
+        logger.error(f"Error loading known users: {e}")
+        return 0
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "add_user_if_not_exists")
+async def _insert_user(user_id: int, first_name: str | None, last_name: str | None, username: str | None):
     try:
         async with aiosqlite.connect(DB_PATH) as db:
             await db.execute(
@@ -113,11 +346,19 @@ async def add_user_if_not_exists(user_id: int, first_name: str | None, last_name
                 (user_id, first_name, last_name, username)
             )
             await db.commit()
+        _known_users.add(user_id)
     except Exception as e:
         logger.error(f"Error adding or ignoring user {user_id}: {e}")
 
+async def add_user_if_not_exists(user_id: int, first_name: str | None, last_name: str | None, username: str | None):
+    """Adds a user to the database if they don't already exist."""
+    if user_id in _known_users:
+        return
+    await _insert_user(user_id, first_name, last_name, username)
+
 # --- Admin Specific Functions ---
 
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_user_count")
 async def get_user_count() -> int:
     """Gets the total number of users in the database."""
     try:
@@ -129,6 +370,7 @@ async def get_user_count() -> int:
         logger.error(f"Error getting user count: {e}")
         return 0
 
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_total_favorites_count")
 async def get_total_favorites_count() -> int:
     """Gets the total number of favorite entries across all users."""
     try:
@@ -140,6 +382,7 @@ async def get_total_favorites_count() -> int:
         logger.error(f"Error getting total favorites count: {e}")
         return 0
 
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_all_user_ids")
 async def get_all_user_ids() -> list[int]:
     """Gets all user IDs from the database."""
     try:
@@ -152,3 +395,468 @@ async def get_all_user_ids() -> list[int]:
         return []
 
 
+
+# --- Movie of the day ---
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_daily_movie")
+async def get_daily_movie(bucket: str, day: str) -> tuple[int, str, str, str | None] | None:
+    """Returns (movie_id, record JSON, caption, poster file_id) of a bucket's movie of the day, or None."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT movie_id, record, caption, poster_file_id FROM daily_movies WHERE bucket = ? AND day = ?",
+                (bucket, day)
+            ) as cursor:
+                return await cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error getting movie of the day for {bucket} on {day}: {e}")
+        return None
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "save_daily_movie")
+async def save_daily_movie(bucket: str, day: str, movie_id: int, record: str, caption: str) -> bool:
+    """Stores a bucket's movie of the day unless another worker already stored one. Returns False on error."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                "INSERT OR IGNORE INTO daily_movies (bucket, day, movie_id, record, caption, created_at) "
+                "VALUES (?, ?, ?, ?, ?, strftime('%s', 'now'))",
+                (bucket, day, movie_id, record, caption)
+            )
+            await db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error saving movie of the day for {bucket} on {day}: {e}")
+        return False
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "set_daily_poster_file_id")
+async def set_daily_poster_file_id(bucket: str, day: str, file_id: str):
+    """Remembers the Telegram file_id of an uploaded movie-of-the-day poster."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                "UPDATE daily_movies SET poster_file_id = ? WHERE bucket = ? AND day = ? AND poster_file_id IS NULL",
+                (file_id, bucket, day)
+            )
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Error saving poster file_id for {bucket} on {day}: {e}")
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_recent_daily_movie_ids")
+async def get_recent_daily_movie_ids(bucket: str, days: int) -> list[int]:
+    """Returns the movies of the day of a bucket's last `days` days, newest first."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT movie_id FROM daily_movies WHERE bucket = ? ORDER BY day DESC LIMIT ?", (bucket, days)
+            ) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting recent movies of the day for {bucket}: {e}")
+        return []
+
+# --- Daily push subscribers ---
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "subscribe_user")
+async def subscribe_user(user_id: int, bucket: str, delivery_hour: int) -> bool:
+    """Subscribes a user to the daily push, or changes their delivery hour. Returns False on error."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                "INSERT INTO subscribers (user_id, bucket, delivery_hour) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET bucket = excluded.bucket, delivery_hour = excluded.delivery_hour",
+                (user_id, bucket, delivery_hour)
+            )
+            await db.commit()
+        logger.info("User %s subscribed to the daily push at %02d:00 (%s)", user_id, delivery_hour, bucket)
+        return True
+    except Exception as e:
+        logger.error(f"Error subscribing user {user_id}: {e}")
+        return False
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_subscriber_bucket")
+async def get_subscriber_bucket(user_id: int) -> str | None:
+    """Returns the timezone bucket a user subscribed with, or None if they are not subscribed."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute("SELECT bucket FROM subscribers WHERE user_id = ?", (user_id,)) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Error getting the daily push bucket of user {user_id}: {e}")
+        return None
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "unsubscribe_user")
+async def unsubscribe_user(user_id: int) -> bool | None:
+    """Removes a user from the daily push. Returns False if they were not subscribed, None on error."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute("DELETE FROM subscribers WHERE user_id = ?", (user_id,))
+            await db.commit()
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Error unsubscribing user {user_id}: {e}")
+        return None
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "count_due_subscribers")
+async def count_due_subscribers(bucket: str, day: str, hour: int) -> int:
+    """Counts subscribers of a bucket whose delivery hour has come and who have not received `day`'s movie."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT COUNT(*) FROM subscribers WHERE bucket = ? AND delivery_hour <= ? AND last_sent_day IS NOT ?",
+                (bucket, hour, day)
+            ) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else 0
+    except Exception as e:
+        logger.error(f"Error counting due subscribers for {bucket}: {e}")
+        return 0
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "claim_due_subscribers")
+async def claim_due_subscribers(bucket: str, day: str, hour: int, limit: int) -> list[int]:
+    """
+    Marks up to `limit` due subscribers as delivered for `day` and returns their IDs.
+
+    Claiming before sending means concurrent workers never deliver to the same user twice.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "UPDATE subscribers SET last_sent_day = ? WHERE user_id IN ("
+                "    SELECT user_id FROM subscribers"
+                "    WHERE bucket = ? AND delivery_hour <= ? AND last_sent_day IS NOT ? LIMIT ?"
+                ") RETURNING user_id",
+                (day, bucket, hour, day, limit)
+            ) as cursor:
+                user_ids = [row[0] for row in await cursor.fetchall()]
+            await db.commit()
+            return user_ids
+    except Exception as e:
+        logger.error(f"Error claiming due subscribers for {bucket}: {e}")
+        return []
+
+# --- Seen movies ---
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_user_seen")
+async def get_user_seen(user_id: int) -> tuple[bytes, int] | None:
+    """Returns (Bloom filter bytes, items in its current generation) for a user, or None if there is none."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute("SELECT bloom, items FROM user_seen WHERE user_id = ?", (user_id,)) as cursor:
+                return await cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error getting seen movies for user {user_id}: {e}")
+        return None
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "save_user_seen")
+async def save_user_seen(user_id: int, bloom: bytes, items: int):
+    """Stores a user's seen-movies Bloom filter."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO user_seen (user_id, bloom, items, updated_at) VALUES (?, ?, ?, strftime('%s', 'now'))",
+                (user_id, bloom, items)
+            )
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Error saving seen movies for user {user_id}: {e}")
+
+# --- Catalogue ---
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "upsert_catalogue_movies")
+async def upsert_catalogue_movies(rows: list[tuple]) -> int:
+    """
+    Inserts or updates catalogue movies from TMDb list results in one transaction.
+
+    Each row is (movie_id, title, original_title, release_date, popularity,
+    vote_average, genre_mask, poster_path, overview). Returns the number of rows
+    written, 0 on error.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.executemany("""
+                INSERT INTO catalogue (movie_id, title, original_title, release_date, popularity, vote_average,
+                                       genre_mask, poster_path, overview, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, strftime('%s', 'now'))
+                ON CONFLICT(movie_id) DO UPDATE SET
+                    title = excluded.title, original_title = excluded.original_title,
+                    release_date = excluded.release_date, popularity = excluded.popularity,
+                    vote_average = excluded.vote_average, genre_mask = excluded.genre_mask,
+                    poster_path = excluded.poster_path, overview = excluded.overview,
+                    updated_at = excluded.updated_at
+            """, rows)
+            await db.commit()
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Error upserting {len(rows)} catalogue movies: {e}")
+        return 0
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "upsert_catalogue_ids")
+async def upsert_catalogue_ids(rows: list[tuple]) -> int:
+    """
+    Inserts or updates catalogue movies from a TMDb ID export in one transaction.
+
+    Each row is (movie_id, original_title, popularity). Only those columns are
+    updated, so details filled in from list results are kept. Returns the number
+    of rows written, 0 on error.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.executemany("""
+                INSERT INTO catalogue (movie_id, original_title, popularity, updated_at)
+                VALUES (?, ?, ?, strftime('%s', 'now'))
+                ON CONFLICT(movie_id) DO UPDATE SET
+                    original_title = excluded.original_title, popularity = excluded.popularity,
+                    updated_at = excluded.updated_at
+            """, rows)
+            await db.commit()
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Error upserting {len(rows)} catalogue IDs: {e}")
+        return 0
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_catalogue_movie")
+async def get_catalogue_movie(movie_id: int) -> dict | None:
+    """
+    Returns a catalogue movie shaped like a TMDb list result, or None if it is not in the catalogue.
+
+    Movies only known from an ID export have no title, date, poster or overview yet.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT movie_id, title, original_title, release_date, vote_average, poster_path, overview "
+                "FROM catalogue WHERE movie_id = ?", (movie_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return None
+        keys = ("id", "title", "original_title", "release_date", "vote_average", "poster_path", "overview")
+        return dict(zip(keys, row))
+    except Exception as e:
+        logger.error(f"Error getting catalogue movie {movie_id}: {e}")
+        return None
+
+async def iter_catalogue_movies(min_popularity: float = 0.0):
+    """
+    Yields (movie_id, popularity, vote_average, release_date, genre_mask) for non-adult catalogue
+    movies that are filled in; rows only known from an ID export have no title or genres yet.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            "SELECT movie_id, popularity, vote_average, release_date, genre_mask FROM catalogue "
+            "WHERE adult = 0 AND popularity >= ? AND title IS NOT NULL ORDER BY movie_id", (min_popularity,)
+        ) as cursor:
+            async for row in cursor:
+                yield row
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_unfilled_catalogue_ids")
+async def get_unfilled_catalogue_ids(limit: int, min_popularity: float = 0.0) -> list[int]:
+    """Returns up to `limit` non-adult catalogue movies only known from an ID export, most popular first."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT movie_id FROM catalogue WHERE adult = 0 AND popularity >= ? AND title IS NULL "
+                "ORDER BY popularity DESC LIMIT ?", (min_popularity, limit)
+            ) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting unfilled catalogue movies: {e}")
+        return []
+
+# --- Movie features and recommendations ---
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "save_movie_features")
+async def save_movie_features(movie_id: int, year: int, genre_mask: int, cast_ids: list[int],
+                              recommended_ids: list[int]) -> bool:
+    """
+    Stores a movie's taste features and replaces its TMDb recommendations (in rank order).
+
+    The recommended movies themselves go to the catalogue table (see
+    upsert_catalogue_movies). Returns False on error.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("""
+                INSERT OR REPLACE INTO movie_features (movie_id, year, genre_mask, cast_ids, updated_at)
+                VALUES (?, ?, ?, ?, strftime('%s', 'now'))
+            """, (movie_id, year, genre_mask, ",".join(str(cast_id) for cast_id in cast_ids)))
+            await db.execute("DELETE FROM movie_recommendations WHERE movie_id = ?", (movie_id,))
+            await db.executemany(
+                "INSERT OR IGNORE INTO movie_recommendations (movie_id, recommended_id, rank) VALUES (?, ?, ?)",
+                [(movie_id, recommended_id, rank) for rank, recommended_id in enumerate(recommended_ids)]
+            )
+            await db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error saving features of movie {movie_id}: {e}")
+        return False
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_movie_features")
+async def get_movie_features(movie_ids: list[int]) -> dict[int, tuple[int, int, list[int]]]:
+    """Returns {movie_id: (year, genre_mask, cast_ids)} for the given movies that have stored features."""
+    if not movie_ids:
+        return {}
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            placeholders = ",".join("?" * len(movie_ids))
+            async with db.execute(
+                f"SELECT movie_id, year, genre_mask, cast_ids FROM movie_features WHERE movie_id IN ({placeholders})",
+                movie_ids
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return {row[0]: (row[1], row[2], [int(cast_id) for cast_id in row[3].split(",") if cast_id]) for row in rows}
+    except Exception as e:
+        logger.error(f"Error getting movie features: {e}")
+        return {}
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_recommended_movies")
+async def get_recommended_movies(movie_ids: list[int]) -> list[tuple]:
+    """
+    Returns the catalogue movies TMDb recommends for any of `movie_ids`.
+
+    Rows are (movie_id, popularity, vote_average, release_date, genre_mask,
+    recommending movies, best rank).
+    """
+    if not movie_ids:
+        return []
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            placeholders = ",".join("?" * len(movie_ids))
+            async with db.execute(f"""
+                SELECT c.movie_id, c.popularity, c.vote_average, c.release_date, c.genre_mask, COUNT(*), MIN(r.rank)
+                FROM movie_recommendations r JOIN catalogue c ON c.movie_id = r.recommended_id
+                WHERE r.movie_id IN ({placeholders}) AND c.adult = 0
+                GROUP BY c.movie_id
+            """, movie_ids) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting recommended movies: {e}")
+        return []
+
+# --- Similar movies (favorites co-occurrence) ---
+
+async def _update_item_pairs(db: aiosqlite.Connection, user_id: int, movie_id: int, delta: int):
+    """
+    Adds `delta` (+1 for an added favorite, -1 for a removed one) to the pair counts of
+    `movie_id` with the user's other favorites, and marks their similar-movie lists for
+    recomputation. Runs inside the transaction that changed the favorites row, so the
+    counts move exactly once per change.
+    """
+    others = "SELECT movie_id FROM favorites WHERE user_id = ? AND movie_id != ?"
+    if delta > 0:
+        await db.execute(f"""
+            INSERT INTO item_pairs (movie_a, movie_b, count)
+            SELECT MIN(movie_id, ?), MAX(movie_id, ?), ? FROM ({others})
+            WHERE true
+            ON CONFLICT(movie_a, movie_b) DO UPDATE SET count = count + excluded.count
+        """, (movie_id, movie_id, delta, user_id, movie_id))
+    else:
+        await db.execute(f"""
+            UPDATE item_pairs SET count = count + ?
+            WHERE (movie_a = ? AND movie_b IN ({others})) OR (movie_b = ? AND movie_a IN ({others}))
+        """, (delta, movie_id, user_id, movie_id, movie_id, user_id, movie_id))
+        await db.execute("DELETE FROM item_pairs WHERE count <= 0")
+    await db.execute(f"""
+        INSERT INTO item_neighbors (movie_id)
+        SELECT movie_id FROM (SELECT ? AS movie_id UNION {others}) WHERE true
+        ON CONFLICT(movie_id) DO UPDATE SET dirty = 1
+    """, (movie_id, user_id, movie_id))
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "claim_dirty_items")
+async def claim_dirty_items(limit: int) -> list[int]:
+    """
+    Marks up to `limit` dirty movies as claimed (dirty = 2) and returns them; each is
+    claimed by one worker only. The flag is cleared by save_item_neighbors, or set back
+    to dirty by release_dirty_items, so a failed recomputation is retried.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute("""
+                UPDATE item_neighbors SET dirty = 2
+                WHERE movie_id IN (SELECT movie_id FROM item_neighbors WHERE dirty = 1 LIMIT ?)
+                RETURNING movie_id
+            """, (limit,)) as cursor:
+                movie_ids = [row[0] for row in await cursor.fetchall()]
+            await db.commit()
+        return movie_ids
+    except Exception as e:
+        logger.error(f"Error claiming dirty items: {e}")
+        return []
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "release_dirty_items")
+async def release_dirty_items(movie_ids: list[int] | None = None) -> int:
+    """
+    Flags claimed movies dirty again so they are recomputed later; all claimed movies
+    (e.g. left behind by a crashed worker) if `movie_ids` is None. Returns the number released.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            if movie_ids is None:
+                cursor = await db.execute("UPDATE item_neighbors SET dirty = 1 WHERE dirty = 2")
+            else:
+                placeholders = ",".join("?" * len(movie_ids))
+                cursor = await db.execute(
+                    f"UPDATE item_neighbors SET dirty = 1 WHERE dirty = 2 AND movie_id IN ({placeholders})", movie_ids
+                )
+            await db.commit()
+            return cursor.rowcount
+    except Exception as e:
+        logger.error(f"Error releasing claimed dirty items: {e}")
+        return 0
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "get_item_cooccurrences")
+async def get_item_cooccurrences(movie_id: int) -> tuple[int, str | None, list[tuple[int, int, int]]] | None:
+    """
+    Returns (users who favorited the movie, its title, [(other movie, users who favorited both,
+    users who favorited the other)]), or None on error.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT COUNT(*), MAX(movie_title) FROM favorites WHERE movie_id = ?", (movie_id,)
+            ) as cursor:
+                favorited, title = await cursor.fetchone()
+            async with db.execute("""
+                SELECT p.other, p.count, (SELECT COUNT(*) FROM favorites f WHERE f.movie_id = p.other)
+                FROM (
+                    SELECT movie_b AS other, count FROM item_pairs WHERE movie_a = ?
+                    UNION ALL
+                    SELECT movie_a AS other, count FROM item_pairs WHERE movie_b = ?
+                ) p
+            """, (movie_id, movie_id)) as cursor:
+                return favorited, title, await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting co-occurrences of movie {movie_id}: {e}")
+        return None
+
+@metrics.timed(metrics.DB_QUERY_SECONDS, "save_item_neighbors")
+async def save_item_neighbors(rows: list[tuple[int, str | None, bytes, float]]) -> bool:
+    """
+    Stores recomputed similar-movie lists as (movie_id, title, neighbors blob, updated_at)
+    and clears their claim, unless a favorite change flagged them dirty again meanwhile.
+    Returns False on error.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.executemany("""
+                UPDATE item_neighbors SET title = ?, neighbors = ?, updated_at = ?,
+                    dirty = CASE WHEN dirty = 2 THEN 0 ELSE dirty END
+                WHERE movie_id = ?
+            """,
+                [(title, blob, updated_at, movie_id) for movie_id, title, blob, updated_at in rows]
+            )
+            await db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error saving item neighbors: {e}")
+        return False
+
+async def iter_item_neighbors(since: float = 0.0):
+    """Yields (movie_id, title, neighbors blob, updated_at) of similar-movie lists updated after `since`."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            "SELECT movie_id, title, neighbors, updated_at FROM item_neighbors WHERE updated_at > ?", (since,)
+        ) as cursor:
+            async for row in cursor:
+                yield row
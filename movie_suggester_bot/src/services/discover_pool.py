@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Suggestion filters (genres, decade, minimum rating) and their cached candidate pools.
+
+A DiscoverFilter is normalized (sorted genres, fixed decade and rating steps),
+so every way of toggling to the same selection has the same signature and
+callback encoding. Each signature gets a pool of /discover/movie result pages:
+a suggestion picks a random page among the first DISCOVER_SAMPLE_PAGES (or
+fewer, if the query has fewer), fetching it only if the pool does not have it
+yet. Popular filter combinations are then served entirely from memory. Pools
+are kept in an LRU of DISCOVER_POOL_SIGNATURES signatures and refetched after
+SUGGESTION_POOL_TTL.
+"""
+import logging
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+# Use absolute imports
+from src.config import SUGGESTION_POOL_TTL, DISCOVER_POOL_SIGNATURES, DISCOVER_SAMPLE_PAGES
+from src.services import tmdb, metrics, seen
+from src.services.catalogue import GENRE_BITS
+
+logger = logging.getLogger(__name__)
+
+DECADES = (0, 2020, 2010, 2000, 1990, 1980, 1970, 1960)  # 0 = any decade
+RATINGS = (0, 6, 7, 8)  # 0 = any rating
+MIN_VOTES_FOR_RATING = 50  # A rating filter ignores movies with fewer votes than this
+
+_GENRE_BY_BIT = {bit: genre_id for genre_id, bit in GENRE_BITS.items()}
+
+@dataclass(frozen=True)
+class DiscoverFilter:
+    genres: Tuple[int, ...] = ()  # Any of these genres; sorted
+    decade: int = 0
+    min_rating: int = 0
+
+    def encode(self) -> str:
+        """Compact form used in callback data, e.g. "1a.1990.7"."""
+        mask = 0
+        for genre_id in self.genres:
+            mask |= 1 << GENRE_BITS[genre_id]
+        return f"{mask:x}.{self.decade}.{self.min_rating}"
+
+    @classmethod
+    def decode(cls, data: str) -> Optional["DiscoverFilter"]:
+        """Parses encode()'s output; None if it is malformed or out of range."""
+        try:
+            mask_hex, decade, rating = data.split(".")
+            mask, decade, rating = int(mask_hex, 16), int(decade), int(rating)
+        except ValueError:
+            return None
+        if decade not in DECADES or rating not in RATINGS or mask >> len(GENRE_BITS):
+            return None
+        genres = tuple(sorted(_GENRE_BY_BIT[bit] for bit in _GENRE_BY_BIT if mask & (1 << bit)))
+        return cls(genres, decade, rating)
+
+    def toggle_genre(self, genre_id: int) -> "DiscoverFilter":
+        genres = set(self.genres) ^ {genre_id}
+        return replace(self, genres=tuple(sorted(genres)))
+
+    def next_decade(self) -> "DiscoverFilter":
+        return replace(self, decade=DECADES[(DECADES.index(self.decade) + 1) % len(DECADES)])
+
+    def next_rating(self) -> "DiscoverFilter":
+        return replace(self, min_rating=RATINGS[(RATINGS.index(self.min_rating) + 1) % len(RATINGS)])
+
+    def params(self) -> Dict[str, Any]:
+        """The /discover/movie parameters of this filter."""
+        params: Dict[str, Any] = {}
+        if self.genres:
+            params["with_genres"] = "|".join(str(genre_id) for genre_id in self.genres)
+        if self.decade:
+            params["primary_release_date.gte"] = f"{self.decade}-01-01"
+            params["primary_release_date.lte"] = f"{self.decade + 9}-12-31"
+        if self.min_rating:
+            params["vote_average.gte"] = self.min_rating
+            params["vote_count.gte"] = MIN_VOTES_FOR_RATING
+        return params
+
+class _Pool:
+    __slots__ = ("total_pages", "pages", "loaded_at")
+
+    def __init__(self, total_pages: int):
+        self.total_pages = total_pages
+        self.pages: Dict[int, List[Dict[str, Any]]] = {}
+        self.loaded_at = time.monotonic()
+
+_pools: "OrderedDict[DiscoverFilter, _Pool]" = OrderedDict()
+
+def _get_pool(flt: DiscoverFilter) -> Optional[_Pool]:
+    pool = _pools.get(flt)
+    if pool is None or time.monotonic() - pool.loaded_at >= SUGGESTION_POOL_TTL:
+        return None
+    _pools.move_to_end(flt)
+    return pool
+
+async def _page(session: aiohttp.ClientSession, flt: DiscoverFilter, page: int) -> Tuple[Optional[_Pool], List[Dict[str, Any]]]:
+    """Returns the filter's pool and one page of it, fetching the page if the pool does not have it."""
+    pool = _get_pool(flt)
+    if pool is not None and page in pool.pages:
+        metrics.cache_hit("discover_pool")
+        return pool, pool.pages[page]
+    metrics.cache_miss("discover_pool")
+    result = await tmdb.discover_movies(session, flt.params(), page)
+    if result is None:
+        return pool, []
+    movies, total_pages = result
+    if tmdb.is_stale(movies):
+        # Do not keep stale pages; the next suggestion tries TMDb again
+        return pool, movies
+    if pool is None:
+        pool = _pools[flt] = _Pool(total_pages)
+        if len(_pools) > DISCOVER_POOL_SIGNATURES:
+            _pools.popitem(last=False)
+    pool.total_pages = total_pages
+    pool.pages[page] = movies
+    return pool, movies
+
+async def pick(session: aiohttp.ClientSession, flt: DiscoverFilter, user_id: int) -> Optional[Dict[str, Any]]:
+    """Picks a movie matching the filter that the user has not seen, from a random page of its pool."""
+    pool = _get_pool(flt)
+    if pool is None:
+        # Page 1 tells how many pages the query has
+        pool, movies = await _page(session, flt, 1)
+        if pool is None:
+            return await seen.pick_unseen(user_id, movies) if movies else None
+    page = random.randint(1, min(pool.total_pages, DISCOVER_SAMPLE_PAGES))
+    pool, movies = await _page(session, flt, page)
+    seen_movies = await seen.get_filter(user_id)
+    if movies and all(movie.get("id") in seen_movies for movie in movies) and pool is not None and pool.total_pages > 1:
+        # Everything on this page was seen; one more random page before repeating
+        pool, movies = await _page(session, flt, random.randint(1, min(pool.total_pages, DISCOVER_SAMPLE_PAGES)))
+    return await seen.pick_unseen(user_id, movies) if movies else None
+
+def stats() -> Dict[str, float]:
+    """Returns cached filter signatures and pages, for metrics."""
+    return {"signatures": len(_pools), "pages": sum(len(pool.pages) for pool in _pools.values())}
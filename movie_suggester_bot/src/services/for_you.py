@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+"🎯 For you" suggestions ranked by a user's favorites.
+
+A taste profile is built from the user's FOR_YOU_PROFILE_FAVORITES most recent
+favorites: the share of them in each genre and decade, and how many feature
+each top-billed actor. Candidates are the catalogue snapshot plus the movies
+TMDb recommends for any of the favorites, which remember_details() stores
+whenever a favorite's details are fetched. All candidates are scored in one
+vectorized NumPy pass:
+
+    GENRE_WEIGHT * genre affinity + DECADE_WEIGHT * decade share
+    + CAST_WEIGHT * shared actors + RECOMMENDED_WEIGHT * recommending favorites
+    + QUALITY_WEIGHT * popularity/rating weight (scaled to 0..1)
+
+The FOR_YOU_TOP best are cached per user together with the favorite IDs they
+were ranked from, so a ranking is reused until the favorites change, in any
+worker. Without NumPy only the stored recommendations are ranked.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency; only stored recommendations are ranked
+    np = None
+
+# Use absolute imports
+from src.config import FOR_YOU_CACHE_SIZE, FOR_YOU_PROFILE_FAVORITES, FOR_YOU_TOP
+from src.services import catalogue, database, metrics, seen, tmdb
+from src.services.catalogue import GENRE_BITS
+
+logger = logging.getLogger(__name__)
+
+GENRE_WEIGHT = 3.0
+DECADE_WEIGHT = 1.0
+CAST_WEIGHT = 0.5  # Per actor shared with the favorites (counted once per favorite)
+RECOMMENDED_WEIGHT = 1.5  # Per favorite TMDb recommends the movie for
+QUALITY_WEIGHT = 0.5
+PROFILE_CAST = 10  # Top-billed actors stored per movie
+RANDOM_TOP = 5  # Picks are random among the best few unseen movies, so repeated taps vary
+FIRST_DECADE, LAST_DECADE = 1870, 2030
+
+@dataclass
+class TasteProfile:
+    genres: List[float]  # Share of the favorites having each genre bit
+    decades: Dict[int, float]  # Share of the favorites released in each decade
+    cast: Dict[int, int]  # Favorites featuring each actor
+
+@dataclass
+class _Ranking:
+    favorites: Tuple[int, ...]
+    movie_ids: List[int]
+
+_rankings: "OrderedDict[int, _Ranking]" = OrderedDict()
+_ranked = 0
+_last_rank_ms = 0.0
+_last_candidates = 0
+
+def _year(release_date: Optional[str]) -> int:
+    return int(release_date[:4]) if release_date and release_date[:4].isdigit() else 0
+
+def features_of(details: Dict[str, Any]) -> Tuple[int, int, List[int]]:
+    """Returns (year, genre_mask, top-billed cast IDs) of a get_movie_details response."""
+    cast = (details.get("credits") or {}).get("cast") or []
+    cast_ids = [member["id"] for member in cast[:PROFILE_CAST] if member.get("id")]
+    return _year(details.get("release_date")), catalogue.catalogue_row(details)[6], cast_ids
+
+async def remember_details(details: Dict[str, Any]):
+    """Stores a movie's features and the TMDb recommendations that came with its details."""
+    recommended = [
+        movie for movie in (details.get("recommendations") or {}).get("results") or []
+        if movie.get("id") and not movie.get("adult")
+    ]
+    if recommended:
+        await database.upsert_catalogue_movies([catalogue.catalogue_row(movie) for movie in recommended])
+    year, mask, cast_ids = features_of(details)
+    await database.save_movie_features(details["id"], year, mask, cast_ids, [movie["id"] for movie in recommended])
+
+async def build_profile(session: aiohttp.ClientSession, favorite_ids: Sequence[int]) -> Optional[TasteProfile]:
+    """Builds the taste profile of the given favorites, fetching details of favorites with no stored features."""
+    features = await database.get_movie_features(list(favorite_ids))
+    missing = [movie_id for movie_id in favorite_ids if movie_id not in features]
+    if missing:
+        # Favorites added before features were stored; up to FOR_YOU_PROFILE_FAVORITES fetches,
+        # so they run at background priority and never hold back other users' requests
+        with tmdb.background_priority():
+            fetched = await asyncio.gather(*(tmdb.get_movie_details(session, movie_id) for movie_id in missing))
+        for details in fetched:
+            if details and details.get("id"):
+                await remember_details(details)
+                features[details["id"]] = features_of(details)
+    if not features:
+        return None
+
+    share = 1.0 / len(features)
+    genres = [0.0] * len(GENRE_BITS)
+    decades: Dict[int, float] = {}
+    cast: Dict[int, int] = {}
+    for year, mask, cast_ids in features.values():
+        for bit in range(len(GENRE_BITS)):
+            if mask & (1 << bit):
+                genres[bit] += share
+        if year:
+            decades[year // 10 * 10] = decades.get(year // 10 * 10, 0.0) + share
+        for cast_id in set(cast_ids):
+            cast[cast_id] = cast.get(cast_id, 0) + 1
+    return TasteProfile(genres, decades, cast)
+
+def score(profile: TasteProfile, popularity, vote_average, years, masks, recommended, shared_cast):
+    """Scores candidate columns (NumPy arrays of equal length) against a profile; higher is better."""
+    bits = ((masks.astype(np.uint32)[:, None] >> np.arange(len(GENRE_BITS), dtype=np.uint32)) & 1).astype(np.float32)
+    # Dividing by sqrt(genres) keeps movies tagged with every genre from winning by default
+    genre = bits @ np.asarray(profile.genres, dtype=np.float32) / np.sqrt(np.maximum(bits.sum(axis=1), 1.0))
+
+    decade_shares = np.zeros((LAST_DECADE - FIRST_DECADE) // 10 + 1, dtype=np.float32)
+    for decade, decade_share in profile.decades.items():
+        if FIRST_DECADE <= decade <= LAST_DECADE:
+            decade_shares[(decade - FIRST_DECADE) // 10] = decade_share
+    slots = np.clip((years.astype(np.int32) - FIRST_DECADE) // 10, 0, len(decade_shares) - 1)
+    decade = np.where(years > 0, decade_shares[slots], 0.0)
+
+    # Same weighting as catalogue.weight(), scaled to 0..1
+    quality = np.log1p(np.maximum(popularity, 0.0)) * (np.where(vote_average > 0, vote_average, 5.0) / 10.0) ** 2
+    quality = quality / max(float(quality.max()), 1e-9) if len(quality) else quality
+
+    return (GENRE_WEIGHT * genre + DECADE_WEIGHT * decade + CAST_WEIGHT * shared_cast
+            + RECOMMENDED_WEIGHT * recommended + QUALITY_WEIGHT * quality)
+
+def _score_row(profile: TasteProfile, popularity: float, vote_average: float, year: int, mask: int,
+               recommended: int, shared_cast: int) -> float:
+    """score() for one candidate, used without NumPy."""
+    bits = [bit for bit in range(len(GENRE_BITS)) if mask & (1 << bit)]
+    genre = sum(profile.genres[bit] for bit in bits) / max(len(bits), 1) ** 0.5
+    decade = profile.decades.get(year // 10 * 10, 0.0) if year else 0.0
+    return (GENRE_WEIGHT * genre + DECADE_WEIGHT * decade + CAST_WEIGHT * shared_cast
+            + RECOMMENDED_WEIGHT * recommended + QUALITY_WEIGHT * min(catalogue.weight(popularity, vote_average) / 10.0, 1.0))
+
+async def rank(session: aiohttp.ClientSession, favorite_ids: Sequence[int]) -> List[int]:
+    """Returns up to FOR_YOU_TOP movie IDs for the given favorites, best first (favorites excluded)."""
+    global _ranked, _last_rank_ms, _last_candidates
+    profile = await build_profile(session, favorite_ids)
+    if profile is None:
+        return []
+    started = time.perf_counter()
+    # Recommended movies come with how many favorites recommend them; actors are only known for movies with stored features
+    rows = await database.get_recommended_movies(list(favorite_ids))
+    features = await database.get_movie_features([row[0] for row in rows])
+    shared = [sum(1 for cast_id in features[row[0]][2] if cast_id in profile.cast) if row[0] in features else 0 for row in rows]
+    favorites = set(favorite_ids)
+
+    if np is None:
+        scored = sorted(
+            ((_score_row(profile, row[1], row[2], _year(row[3]), row[4], row[5], shared_cast), row[0])
+             for row, shared_cast in zip(rows, shared) if row[0] not in favorites),
+            reverse=True,
+        )
+        ranking = [movie_id for _, movie_id in scored[:FOR_YOU_TOP]]
+        _last_candidates = len(rows)
+    else:
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        columns = [
+            np.array([row[1] for row in rows], dtype=np.float32),
+            np.array([row[2] for row in rows], dtype=np.float32),
+            np.array([_year(row[3]) for row in rows], dtype=np.int32),
+            np.array([row[4] for row in rows], dtype=np.uint32),
+            np.array([row[5] for row in rows], dtype=np.float32),
+            np.array(shared, dtype=np.float32),
+        ]
+        snapshot = catalogue.snapshot
+        if snapshot is not None:
+            # Snapshot movies that are also recommended appear twice; the recommended copy scores higher
+            movies = snapshot.movies
+            zeros = np.zeros(len(movies), dtype=np.float32)
+            ids = np.concatenate([ids, movies["id"].astype(np.int64)])
+            columns = [
+                np.concatenate([column, extra]) for column, extra in zip(columns, (
+                    movies["popularity"], movies["vote_average"], movies["year"].astype(np.int32),
+                    movies["genre_mask"], zeros, zeros,
+                ))
+            ]
+        scores = score(profile, *columns)
+        scores[np.isin(ids, np.fromiter(favorites, dtype=np.int64))] = -np.inf
+        count = min(FOR_YOU_TOP * 2, len(ids))
+        best = np.argpartition(-scores, count - 1)[:count] if count else np.empty(0, dtype=np.int64)
+        best = best[np.argsort(-scores[best], kind="stable")]
+        ranking = [int(movie_id) for movie_id in dict.fromkeys(ids[best][np.isfinite(scores[best])].tolist())][:FOR_YOU_TOP]
+        _last_candidates = len(ids)
+
+    _ranked += 1
+    _last_rank_ms = (time.perf_counter() - started) * 1000
+    logger.debug("Ranked %d candidates for %d favorites in %.1f ms", _last_candidates, len(favorites), _last_rank_ms)
+    return ranking
+
+async def pick(session: aiohttp.ClientSession, user_id: int, favorite_ids: Sequence[int]) -> Optional[Dict[str, Any]]:
+    """
+    Picks a movie for the user from their cached ranking (recomputed if their favorites changed).
+
+    Movies the user has already been shown are skipped while unseen ones
+    remain. Returns the movie as catalogue.get_movie() does, or None.
+    """
+    favorite_ids = list(favorite_ids)[:FOR_YOU_PROFILE_FAVORITES]
+    key = tuple(sorted(favorite_ids))
+    ranking = _rankings.get(user_id)
+    if ranking is not None and ranking.favorites == key:
+        metrics.cache_hit("for_you")
+        _rankings.move_to_end(user_id)
+    else:
+        metrics.cache_miss("for_you")
+        ranking = _rankings[user_id] = _Ranking(key, await rank(session, favorite_ids))
+        _rankings.move_to_end(user_id)
+        if len(_rankings) > FOR_YOU_CACHE_SIZE:
+            _rankings.popitem(last=False)
+
+    seen_movies = await seen.get_filter(user_id)
+    choices = [movie_id for movie_id in ranking.movie_ids if movie_id not in seen_movies][:RANDOM_TOP]
+    if not choices:
+        choices = ranking.movie_ids[:RANDOM_TOP]
+    random.shuffle(choices)
+    for movie_id in choices:
+        movie = await catalogue.get_movie(session, movie_id)
+        if movie is not None:
+            return movie
+    return None
+
+def invalidate(user_id: int):
+    """Drops a user's cached ranking (their favorites changed)."""
+    _rankings.pop(user_id, None)
+
+def stats() -> Dict[str, float]:
+    """Returns cached rankings, rankings computed and the size and duration of the last one, for metrics."""
+    return {
+        "cached_users": len(_rankings),
+        "ranked": _ranked,
+        "last_candidates": _last_candidates,
+        "last_rank_ms": _last_rank_ms,
+    }
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import pickle
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+# Use absolute import
+from src.services import database, metrics
+
+logger = logging.getLogger(__name__)
+
+class _Record:
+    """FSM state and data for one storage key, as held in the cache."""
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], updated_at: float):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage persisted in the bot's SQLite database.
+
+    Reads are served from an LRU write-through cache of hot keys. Writes update the
+    cache immediately and are flushed to SQLite in batches by a background task, so
+    a burst of state changes costs one transaction. Keys not touched for `ttl`
+    seconds are treated as empty and swept from the table periodically.
+
+    Each chat should be handled by a single process (see webhook chat affinity),
+    otherwise the per-process caches can serve stale state.
+
+    Data is stored as JSON, so it must be JSON-serializable and dict keys come
+    back as strings after a restart; handlers store string keys for that reason.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        ttl: float = 7 * 24 * 3600,
+        cache_size: int = 10_000,
+        flush_interval: float = 0.5,
+        flush_batch_size: int = 500,
+        sweep_interval: float = 300,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        self.db_path = db_path or database.DB_PATH # The bot's database (DATABASE_PATH) by default
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self.sweep_interval = sweep_interval
+        self.key_builder = key_builder or DefaultKeyBuilder()
+
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._pending: Dict[str, _Record] = {}  # Written to the cache but not yet to SQLite
+        self._db: Optional[aiosqlite.Connection] = None
+        self._db_lock = asyncio.Lock()
+        self._flush_wakeup = asyncio.Event()
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._last_sweep = time.time()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns cache size and pending writes, for metrics."""
+        return {"cached": len(self._cache), "pending_writes": len(self._pending)}
+
+    async def open(self):
+        """Opens the database connection ahead of the first update (startup warm-up)."""
+        await self._connection()
+
+    async def _connection(self) -> aiosqlite.Connection:
+        if self._db is None:
+            self._db = await aiosqlite.connect(self.db_path)
+        if self._flusher_task is None:
+            self._flusher_task = asyncio.create_task(self._flush_loop())
+        return self._db
+
+    # --- Cache helpers ---
+
+    def _is_expired(self, record: _Record, now: float) -> bool:
+        return now - record.updated_at > self.ttl
+
+    def _remember(self, key: str, record: _Record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> _Record:
+        """Returns the live record for a key from cache, pending writes or SQLite."""
+        now = time.time()
+        record = self._cache.get(key)
+        if record is None:
+            record = self._pending.get(key)
+        if record is not None:
+            metrics.cache_hit("fsm")
+        else:
+            metrics.cache_miss("fsm")
+            db = await self._connection()
+            async with self._db_lock:
+                with metrics.DB_QUERY_SECONDS.time("fsm_load"):
+                    async with db.execute(
+                        "SELECT state, data, updated_at FROM fsm_storage WHERE storage_key = ?", (key,)
+                    ) as cursor:
+                        row = await cursor.fetchone()
+            if row:
+                record = _Record(row[0], json.loads(row[1]) if row[1] else {}, row[2])
+            else:
+                record = _Record(None, {}, now)
+
+        if self._is_expired(record, now):
+            record = _Record(None, {}, now)
+        self._remember(key, record)
+        return record
+
+    def _write(self, key: str, record: _Record):
+        record.updated_at = time.time()
+        self._remember(key, record)
+        self._pending[key] = record
+        if len(self._pending) >= self.flush_batch_size:
+            self._flush_wakeup.set()
+
+    # --- Background flushing ---
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            try:
+                await self.flush()
+                if time.time() - self._last_sweep >= self.sweep_interval:
+                    await self.sweep_expired()
+            except Exception as e:
+                logger.error(f"Error flushing FSM storage: {e}", exc_info=True)
+
+    async def flush(self):
+        """Writes all pending records to SQLite in a single transaction."""
+        if not self._pending or self._db is None:
+            return
+        pending, self._pending = self._pending, {}
+        upserts = []
+        deletes = []
+        for key, record in pending.items():
+            if record.is_empty():
+                deletes.append((key,))
+            else:
+                upserts.append((key, record.state, json.dumps(record.data, ensure_ascii=False), record.updated_at))
+
+        async with self._db_lock:
+            try:
+                started = time.perf_counter()
+                if upserts:
+                    await self._db.executemany(
+                        "INSERT INTO fsm_storage (storage_key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(storage_key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                        "updated_at = excluded.updated_at",
+                        upserts,
+                    )
+                if deletes:
+                    await self._db.executemany("DELETE FROM fsm_storage WHERE storage_key = ?", deletes)
+                await self._db.commit()
+                metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - started, "fsm_flush")
+            except Exception:
+                # Put the batch back unless newer writes for the same keys arrived meanwhile
+                for key, record in pending.items():
+                    self._pending.setdefault(key, record)
+                raise
+        logger.debug("Flushed %d FSM records and deleted %d", len(upserts), len(deletes))
+
+    async def sweep_expired(self):
+        """Drops records whose TTL has passed from the cache and from SQLite."""
+        now = time.time()
+        self._last_sweep = now
+        for key in [key for key, record in self._cache.items() if self._is_expired(record, now)]:
+            del self._cache[key]
+        if self._db is None:
+            return
+        async with self._db_lock:
+            cursor = await self._db.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (now - self.ttl,))
+            await self._db.commit()
+        if cursor.rowcount:
+            logger.info(f"Swept {cursor.rowcount} expired FSM records")
+
+    # --- BaseStorage interface ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        record = await self._load(storage_key)
+        new_state = state.state if isinstance(state, State) else state
+        self._write(storage_key, _Record(new_state, record.data, record.updated_at))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self.key_builder.build(key))).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        record = await self._load(storage_key)
+        self._write(storage_key, _Record(record.state, dict(data), record.updated_at))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._load(self.key_builder.build(key))).data)
+
+    async def close(self) -> None:
+        if self._flusher_task is not None:
+            self._flusher_task.cancel()
+            try:
+                await self._flusher_task
+            except asyncio.CancelledError:
+                pass
+            self._flusher_task = None
+        if self._db is not None:
+            await self.flush()
+            await self._db.close()
+            self._db = None
+
+class _CompactRecord:
+    """FSM state and pickled data for one key of BoundedMemoryStorage."""
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str], data: bytes, updated_at: float):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+class BoundedMemoryStorage(BaseStorage):
+    """
+    In-process FSM storage with bounded memory use.
+
+    Unlike aiogram's MemoryStorage, keys that were only read are never stored, idle
+    keys are evicted after `ttl` seconds and the total number of keys is capped with
+    LRU eviction. Keys are kept in last-access order, so expiry only has to look at
+    the oldest entries and costs O(1) amortized per access.
+
+    Data is kept pickled: one bytes object per key instead of a dict of Python
+    objects (a five-movie search_results summary takes ~130 bytes instead of ~700),
+    at the cost of decoding on get_data(). Pickling keeps key and value types as
+    MemoryStorage would.
+    """
+
+    def __init__(self, ttl: float = 24 * 3600, max_entries: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._records: "OrderedDict[StorageKey, _CompactRecord]" = OrderedDict()
+        self._data_bytes = 0
+        self.ttl_evictions = 0
+        self.lru_evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the current size, encoded data size and eviction counters, for metrics."""
+        return {
+            "entries": len(self._records),
+            "data_bytes": self._data_bytes,
+            "ttl_evictions": self.ttl_evictions,
+            "lru_evictions": self.lru_evictions,
+        }
+
+    def _drop(self, key: StorageKey):
+        record = self._records.pop(key, None)
+        if record is not None:
+            self._data_bytes -= len(record.data)
+
+    def _evict_expired(self, now: float):
+        deadline = now - self.ttl
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.updated_at >= deadline:
+                break
+            self._drop(key)
+            self.ttl_evictions += 1
+
+    def _get(self, key: StorageKey) -> Optional[_CompactRecord]:
+        now = time.monotonic()
+        self._evict_expired(now)
+        record = self._records.get(key)
+        if record is not None:
+            record.updated_at = now
+            self._records.move_to_end(key)
+        return record
+
+    def _put(self, key: StorageKey, state: Optional[str], data: bytes):
+        self._drop(key)
+        if state is None and not data:
+            # Empty records are represented by absence
+            return
+        self._records[key] = _CompactRecord(state, data, time.monotonic())
+        self._data_bytes += len(data)
+        while len(self._records) > self.max_entries:
+            self._drop(next(iter(self._records)))
+            self.lru_evictions += 1
+
+    @staticmethod
+    def _encode(data: Mapping[str, Any]) -> bytes:
+        return pickle.dumps(dict(data), protocol=pickle.HIGHEST_PROTOCOL) if data else b""
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get(key)
+        new_state = state.state if isinstance(state, State) else state
+        self._put(key, new_state, record.data if record else b"")
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = self._get(key)
+        self._put(key, record.state if record else None, self._encode(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return pickle.loads(record.data) if record and record.data else {}
+
+    async def close(self) -> None:
+        self._records.clear()
+        self._data_bytes = 0
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Logging that keeps I/O off the event loop thread.
+
+Loggers write to a QueueHandler; a QueueListener thread formats the records and
+writes them to the real handlers. The calling thread only creates the record and
+enqueues it. Records are not pre-formatted before enqueueing (the stdlib
+QueueHandler does that on the caller's thread), so arguments should be immutable
+or not modified after the log call. High-volume INFO lines can be sampled before
+they are enqueued.
+"""
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, TextIO
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread and drops records when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes only a fraction of records below WARNING from the configured loggers.
+
+    `rates` maps a logger name (children included) to the fraction of records kept,
+    e.g. {"aiogram.event": 0.1} keeps every tenth "Update id=... is handled" line.
+    Sampling is deterministic per logger, so the kept lines are evenly spaced.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._credit: Dict[str, float] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name not in self.rates:
+            if "." not in name:
+                return True
+            name = name.rsplit(".", 1)[0]
+        credit = self._credit.get(name, 1.0) + self.rates[name]
+        if credit >= 1.0:
+            self._credit[name] = credit - 1.0
+            return True
+        self._credit[name] = credit
+        return False
+
+_listener: Optional[QueueListener] = None
+
+def setup_logging(level: int = logging.INFO, sample_rates: Optional[Dict[str, float]] = None,
+                  max_queue: int = 10_000, stream: Optional[TextIO] = None) -> DeferredQueueHandler:
+    """Routes the root logger through a background listener thread; safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    else:
+        atexit.register(shutdown_logging)
+
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    queue_handler = DeferredQueueHandler(queue.Queue(max_queue))
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    return queue_handler
+
+def shutdown_logging():
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
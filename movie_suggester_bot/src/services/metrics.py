@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Low-overhead in-process metrics exported in Prometheus text format.
+
+Histograms keep one counter per bucket per label set, so an observation is a
+bisect and two additions. Gauge sources are plain callables (usually a
+component's stats() method) evaluated only when metrics are scraped.
+"""
+import functools
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "moviebot"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Time spent per stage (tmdb, db, telegram) by the update being handled in this context,
+# set around each handler call so slow updates can be broken down (see services/watchdog.py)
+current_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("current_stages", default=None)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = f"{PREFIX}_{name}"
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        _registry.append(self)
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    """Fixed-bucket latency histogram with labels."""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        stage: Optional[str] = None,
+    ):
+        self.name = f"{PREFIX}_{name}"
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Observations are also added to the current update's stage breakdown under this name
+        self.stage = stage
+        # Per label set: [count per bucket..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = [0] * (len(self.buckets) + 1) + [0.0]
+            self._series[labels] = series
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+        if self.stage is not None:
+            stages = current_stages.get()
+            if stages is not None:
+                stages[self.stage] = stages.get(self.stage, 0.0) + value
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Context manager observing the duration of its block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return int(sum(series[:-1])) if series else 0
+
+    def quantile(self, q: float, *labels: str) -> Optional[float]:
+        """Estimates a quantile by linear interpolation inside the matching bucket."""
+        series = self._series.get(labels)
+        if not series:
+            return None
+        total = sum(series[:-1])
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for index, upper in enumerate(self.buckets):
+            in_bucket = series[index]
+            if cumulative + in_bucket >= rank:
+                fraction = (rank - cumulative) / in_bucket if in_bucket else 0.0
+                return lower + (upper - lower) * fraction
+            cumulative += in_bucket
+            lower = upper
+        return self.buckets[-1]
+
+    def label_sets(self) -> List[Tuple[str, ...]]:
+        return list(self._series)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in self._series.items():
+            cumulative = 0
+            for index, upper in enumerate(self.buckets):
+                cumulative += series[index]
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % upper)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            bucket_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class _GaugeSource:
+    """Exports each key of a stats() dict as a gauge named <prefix>_<source>_<key>."""
+
+    def __init__(self, source: str, fn: Callable[[], Dict[str, float]]):
+        self.source = source
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.warning(f"Metrics source {self.source} failed: {e}")
+            return []
+        lines = []
+        for key, value in values.items():
+            name = f"{PREFIX}_{self.source}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return lines
+
+_registry: list = []
+
+def register_source(source: str, fn: Callable[[], Dict[str, float]]):
+    """Registers a stats() callable whose values are exported as gauges on every scrape."""
+    _registry[:] = [m for m in _registry if not (isinstance(m, _GaugeSource) and m.source == source)]
+    _registry.append(_GaugeSource(source, fn))
+
+def render() -> str:
+    """Renders all metrics in Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Metrics shared across the bot ---
+
+HANDLER_SECONDS = Histogram("handler_seconds", "Time spent in update handlers.", ("router", "handler"))
+TMDB_REQUEST_SECONDS = Histogram("tmdb_request_seconds", "TMDb API request latency.", ("endpoint", "outcome"), stage="tmdb")
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "SQLite operation latency.", ("operation",), stage="db")
+TELEGRAM_REQUEST_SECONDS = Histogram("telegram_request_seconds", "Telegram Bot API call latency.", ("method",), stage="telegram")
+LOOP_LAG_SECONDS = Histogram("event_loop_lag_seconds", "Delay between when the watchdog tick was due and when it ran.",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+TMDB_HEDGES = Counter("tmdb_hedges_total", "Hedged TMDb requests sent, answered first by the hedge, or skipped for lack of a scheduler slot.", ("endpoint", "result"))
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+
+def cache_hit(cache: str):
+    CACHE_REQUESTS.inc(cache, "hit")
+
+def cache_miss(cache: str):
+    CACHE_REQUESTS.inc(cache, "miss")
+
+def timed(histogram: Histogram, *labels: str):
+    """Decorator timing every call of an async function into `histogram`."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+        return wrapper
+    return decorator
+
+# --- HTTP exporter ---
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+async def start_metrics_server(port: int, host: str = "127.0.0.1") -> web.AppRunner:
+    """Serves GET /metrics on host:port; the caller cleans up the returned runner."""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics exporter listening on http://{host}:{port}/metrics")
+    return runner
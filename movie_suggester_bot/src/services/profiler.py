@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+On-demand profiling of the running event loop.
+
+Two modes are available:
+- "sample": the event loop's stack is snapshotted every few milliseconds of CPU
+  time and aggregated into collapsed stacks (flamegraph.pl / speedscope input).
+  On the main thread this uses a SIGPROF interval timer, so samples land on the
+  Python frame that is actually running; elsewhere a helper thread samples
+  sys._current_frames(), which is biased towards points where the GIL is
+  released. Overhead is one stack walk per sample, independent of call volume.
+- "cprofile": deterministic cProfile over the loop thread; exact call counts but
+  noticeably slower while it runs.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Tuple
+
+MAX_SECONDS = 120
+SAMPLE_INTERVAL = 0.005
+
+_running = False
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when a profile is requested while another one is running."""
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+async def _sample_with_timer(seconds: float, interval: float) -> Tuple[Counter, int]:
+    """Samples the main thread on SIGPROF; only CPU time is sampled, idle waits are not."""
+    stacks: Counter = Counter()
+
+    def _on_sample(signum, frame):
+        if frame is not None:
+            stacks[_collapse(frame)] += 1
+
+    previous = signal.signal(signal.SIGPROF, _on_sample)
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+    return stacks, sum(stacks.values())
+
+def _sample_stacks(thread_id: int, seconds: float, interval: float) -> Tuple[Counter, int]:
+    """Samples the stack of `thread_id` from another thread (fallback off the main thread)."""
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            stacks[_collapse(frame)] += 1
+        time.sleep(interval)
+    return stacks, sum(stacks.values())
+
+def _format_sampled(stacks: Counter, samples: int, seconds: float, top_n: int) -> str:
+    leaf_counts: Counter = Counter()
+    for stack, count in stacks.items():
+        leaf_counts[stack.rsplit(";", 1)[-1]] += count
+    lines = [f"# Sampling profile: {seconds:.0f}s, {samples} samples every {SAMPLE_INTERVAL * 1000:.0f}ms",
+             f"# Top {top_n} functions by self samples:"]
+    for label, count in leaf_counts.most_common(top_n):
+        lines.append(f"#   {count * 100 / max(samples, 1):5.1f}%  {label}")
+    lines.append("# Collapsed stacks follow (flamegraph.pl / speedscope format):")
+    for stack, count in stacks.most_common():
+        lines.append(f"{stack} {count}")
+    return "\n".join(lines) + "\n"
+
+async def profile_event_loop(seconds: float, mode: str = "sample", top_n: int = 40) -> str:
+    """Profiles the current event loop thread for `seconds` and returns a text report."""
+    global _running
+    if _running:
+        raise ProfilerBusyError("A profile is already running")
+    seconds = max(1.0, min(float(seconds), MAX_SECONDS))
+    _running = True
+    try:
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stream.write(f"cProfile over the event loop: {seconds:.0f}s\n\n== By internal time ==\n")
+            stats.sort_stats("tottime").print_stats(top_n)
+            stream.write("\n== By cumulative time ==\n")
+            stats.sort_stats("cumulative").print_stats(top_n)
+            return stream.getvalue()
+
+        if hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread():
+            stacks, samples = await _sample_with_timer(seconds, SAMPLE_INTERVAL)
+        else:
+            loop_thread_id = threading.get_ident()
+            stacks, samples = await asyncio.to_thread(_sample_stacks, loop_thread_id, seconds, SAMPLE_INTERVAL)
+        return _format_sampled(stacks, samples, seconds, top_n)
+    finally:
+        _running = False
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Priority-aware admission for outgoing API requests.
+
+Requests are either interactive (a user is waiting) or background (prefetch,
+warm-up, scheduled refreshes). Each class has its own concurrency limit. All
+requests share a token bucket sized to the upstream quota, and background
+requests additionally draw from a smaller bucket, so they never use more than
+their share of it. A background request only starts when no interactive
+request is waiting, so background work cannot delay a user.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Tuple
+
+INTERACTIVE, BACKGROUND = 0, 1
+PRIORITY_NAMES = ("interactive", "background")
+
+# Priority of requests made from the current context; interactive unless marked otherwise
+request_priority: ContextVar[int] = ContextVar("request_priority", default=INTERACTIVE)
+
+@contextmanager
+def background_priority():
+    """Marks requests made inside the block (and tasks started from it) as background."""
+    token = request_priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`."""
+    __slots__ = ("rate", "capacity", "level", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        return 0.0 if self.level >= 1.0 else (1.0 - self.level) / self.rate
+
+    async def take(self):
+        """Waits until a token is available and takes it."""
+        while True:
+            self.refill(time.monotonic())
+            delay = self.wait_time()
+            if delay <= 0:
+                self.level -= 1.0
+                return
+            await asyncio.sleep(delay)
+
+class PriorityScheduler:
+    def __init__(self, rate_per_second: float, limits: Dict[int, Tuple[int, float]]):
+        """`limits` maps each priority to (max concurrent requests, share of the rate it may use)."""
+        self.concurrency = [limits[p][0] for p in (INTERACTIVE, BACKGROUND)]
+        self._buckets = [
+            TokenBucket(rate_per_second * limits[p][1], max(1.0, rate_per_second * limits[p][1]))
+            for p in (INTERACTIVE, BACKGROUND)
+        ]
+        self._shared = TokenBucket(rate_per_second, max(1.0, rate_per_second))
+        self._active = [0, 0]
+        self._waiting = [0, 0]
+        self._waiters: Tuple[Deque[asyncio.Future], Deque[asyncio.Future]] = (deque(), deque())
+        self.started = [0, 0]
+        self.total_wait = [0.0, 0.0]
+
+    def stats(self) -> Dict[str, float]:
+        """Returns running and waiting requests and average admission delay per priority, for metrics."""
+        stats = {}
+        for priority, name in enumerate(PRIORITY_NAMES):
+            stats[f"{name}_active"] = self._active[priority]
+            stats[f"{name}_waiting"] = self._waiting[priority]
+            stats[f"{name}_started"] = self.started[priority]
+            stats[f"{name}_avg_wait_seconds"] = self.total_wait[priority] / self.started[priority] if self.started[priority] else 0.0
+        return stats
+
+    def _has_slot(self, priority: int) -> bool:
+        if self._active[priority] >= self.concurrency[priority]:
+            return False
+        # Background yields to any interactive request that is waiting for a slot or a token
+        return priority == INTERACTIVE or self._waiting[INTERACTIVE] == 0
+
+    def _token_wait(self, priority: int) -> float:
+        now = time.monotonic()
+        self._shared.refill(now)
+        self._buckets[priority].refill(now)
+        return max(self._shared.wait_time(), self._buckets[priority].wait_time())
+
+    def _wake(self):
+        for priority in (INTERACTIVE, BACKGROUND):
+            waiters = self._waiters[priority]
+            while waiters and self._has_slot(priority):
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+
+    async def _acquire(self, priority: int):
+        self._waiting[priority] += 1
+        try:
+            while True:
+                if not self._has_slot(priority):
+                    waiter = asyncio.get_running_loop().create_future()
+                    self._waiters[priority].append(waiter)
+                    try:
+                        await waiter
+                    except asyncio.CancelledError:
+                        if waiter.done() and not waiter.cancelled():
+                            # We were woken but will not use the slot; pass the wake-up on
+                            self._wake()
+                        raise
+                    continue
+                delay = self._token_wait(priority)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                self._shared.level -= 1.0
+                self._buckets[priority].level -= 1.0
+                self._active[priority] += 1
+                return
+        finally:
+            self._waiting[priority] -= 1
+            if priority == INTERACTIVE and self._waiting[INTERACTIVE] == 0:
+                # Background requests held back for this one may go now
+                self._wake()
+
+    def try_acquire(self, priority: int) -> bool:
+        """
+        Takes a slot and a token of `priority` if both are free right now, without waiting
+        and without overtaking queued requests. Returns False otherwise; a True must be
+        paired with release().
+        """
+        if self._waiting[priority] or not self._has_slot(priority) or self._token_wait(priority) > 0:
+            return False
+        self._shared.level -= 1.0
+        self._buckets[priority].level -= 1.0
+        self._active[priority] += 1
+        self.started[priority] += 1
+        return True
+
+    def release(self, priority: int):
+        self._active[priority] -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        """Waits until a request of `priority` may start and holds its slot for the block."""
+        queued_at = time.monotonic()
+        await self._acquire(priority)
+        self.started[priority] += 1
+        self.total_wait[priority] += time.monotonic() - queued_at
+        try:
+            yield
+        finally:
+            self.release(priority)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Per-user record of movies already suggested or favorited, so suggestions skip them.
+
+Each user has a 256-byte Bloom filter made of two 128-byte generations. New
+movies go into the current generation; once it holds GENERATION_ITEMS movies it
+becomes the previous one and a fresh generation starts, so the false-positive
+rate stays around 1% however long a user has been around, and only the oldest
+history is forgotten. Membership is a handful of bit tests. Filters are kept in
+an LRU of recently active users and persisted in the user_seen table; a user's
+first filter is seeded with their existing favorites.
+"""
+import logging
+import random
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+# Use absolute imports
+from src.config import SEEN_CACHE_SIZE
+from src.services import database, metrics
+
+logger = logging.getLogger(__name__)
+
+GENERATION_BYTES = 128
+GENERATION_BITS = GENERATION_BYTES * 8
+GENERATION_ITEMS = 100  # About 0.9% false positives per generation with HASHES = 5
+HASHES = 5
+
+_MASK64 = (1 << 64) - 1
+
+def _positions(movie_id: int) -> List[int]:
+    # splitmix64 finalizer, then double hashing for the HASHES bit positions
+    x = (movie_id + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    x ^= x >> 31
+    h1, h2 = x & 0xFFFFFFFF, (x >> 32) | 1
+    return [(h1 + i * h2) % GENERATION_BITS for i in range(HASHES)]
+
+class SeenFilter:
+    __slots__ = ("bits", "items")
+
+    def __init__(self, bits: Optional[bytes] = None, items: int = 0):
+        """`bits` is the current generation followed by the previous one."""
+        self.bits = bytearray(bits) if bits and len(bits) == 2 * GENERATION_BYTES else bytearray(2 * GENERATION_BYTES)
+        self.items = items
+
+    def __contains__(self, movie_id: int) -> bool:
+        positions = _positions(movie_id)
+        bits = self.bits
+        for offset in (0, GENERATION_BYTES):
+            if all(bits[offset + (p >> 3)] & (1 << (p & 7)) for p in positions):
+                return True
+        return False
+
+    def add(self, movie_id: int) -> bool:
+        """Adds a movie to the current generation; returns False if it was already in the filter."""
+        if movie_id in self:
+            return False
+        if self.items >= GENERATION_ITEMS:
+            # Rotate: the current generation becomes the previous one, the oldest is forgotten
+            self.bits[GENERATION_BYTES:] = self.bits[:GENERATION_BYTES]
+            self.bits[:GENERATION_BYTES] = bytes(GENERATION_BYTES)
+            self.items = 0
+        for p in _positions(movie_id):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.items += 1
+        return True
+
+_filters: "OrderedDict[int, SeenFilter]" = OrderedDict()
+
+async def get_filter(user_id: int) -> SeenFilter:
+    """Returns a user's filter from the cache, loading it (or seeding it from favorites) on a miss."""
+    seen = _filters.get(user_id)
+    if seen is not None:
+        _filters.move_to_end(user_id)
+        metrics.cache_hit("seen")
+        return seen
+    metrics.cache_miss("seen")
+    row = await database.get_user_seen(user_id)
+    if row is not None:
+        seen = SeenFilter(row[0], row[1])
+    else:
+        seen = SeenFilter()
+        for movie_id in await database.get_favorite_ids(user_id):
+            seen.add(movie_id)
+    # Another update of the same user may have loaded it meanwhile
+    seen = _filters.setdefault(user_id, seen)
+    _filters.move_to_end(user_id)
+    if len(_filters) > SEEN_CACHE_SIZE:
+        _filters.popitem(last=False)
+    return seen
+
+async def pick_unseen(user_id: int, movies: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Picks a random movie the user has not seen yet, or any movie if all were seen."""
+    seen = await get_filter(user_id)
+    unseen = [movie for movie in movies if movie.get("id") not in seen]
+    if not unseen:
+        metrics.cache_miss("unseen_pick")
+        return random.choice(movies)
+    metrics.cache_hit("unseen_pick")
+    return random.choice(unseen)
+
+async def mark_seen(user_id: int, movie_ids: Iterable[int]):
+    """Records movies as seen by a user, persisting the filter if it changed."""
+    seen = await get_filter(user_id)
+    changed = False
+    for movie_id in movie_ids:
+        changed = seen.add(movie_id) or changed
+    if changed:
+        await database.save_user_seen(user_id, bytes(seen.bits), seen.items)
+
+def stats() -> Dict[str, float]:
+    """Returns the number of cached user filters, for metrics."""
+    return {"cached_users": len(_filters)}
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+"Users who liked this also liked": similar movies from favorites co-occurrence.
+
+Every time a favorite is added or removed, the pair counts of that movie with
+the user's other favorites are updated in item_pairs (no rebuild), and the
+movies involved are flagged dirty. A background job claims dirty movies,
+recomputes their top SIMILAR_TOP_K neighbors by shrunk cosine similarity
+
+    pairs / sqrt(favorited_a * favorited_b) * pairs / (pairs + SHRINKAGE)
+
+and stores each list in item_neighbors as a blob of int32 movie IDs; the dirty
+flag is cleared by that same write, so a failed or interrupted recomputation is
+retried. Lists are
+loaded into memory at startup and refreshed from the table as workers update
+them, so the card button is a dictionary lookup and never a query. A list is
+recomputed when its own movie changes; lists that merely mention a changed
+movie keep their order until they are recomputed for another reason.
+"""
+import asyncio
+import logging
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+# Use absolute imports
+from src.config import SIMILAR_TOP_K, SIMILAR_REFRESH_SECONDS
+from src.services import database
+
+logger = logging.getLogger(__name__)
+
+SHRINKAGE = 2.0  # Pulls down similarities backed by few users
+CLAIM_BATCH = 200
+
+def rank_neighbors(favorited: int, cooccurrences: List[Tuple[int, int, int]], k: int) -> List[int]:
+    """Returns the k movies most similar to one favorited by `favorited` users, given (movie, pairs, favorited) rows."""
+    scored = []
+    for other, pairs, other_favorited in cooccurrences:
+        if pairs <= 0 or favorited <= 0 or other_favorited <= 0:
+            continue
+        similarity = pairs / (favorited * other_favorited) ** 0.5 * pairs / (pairs + SHRINKAGE)
+        scored.append((similarity, pairs, other))
+    scored.sort(reverse=True)
+    return [other for _, _, other in scored[:k]]
+
+class SimilarMovies:
+    """In-memory similar-movie lists plus the job that keeps them up to date."""
+
+    def __init__(self, top_k: int = SIMILAR_TOP_K, refresh_seconds: float = SIMILAR_REFRESH_SECONDS):
+        self.top_k = top_k
+        self.refresh_seconds = refresh_seconds
+        self._neighbors: Dict[int, array] = {}
+        self._titles: Dict[int, str] = {}
+        self._loaded_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.recomputed = 0
+        self.lookups = 0
+
+    def neighbors(self, movie_id: int, k: Optional[int] = None) -> List[Tuple[int, str]]:
+        """Returns up to k (movie_id, title) of the movies most similar to `movie_id`, most similar first."""
+        self.lookups += 1
+        neighbors = self._neighbors.get(movie_id)
+        if not neighbors:
+            return []
+        result = []
+        for other in neighbors:
+            title = self._titles.get(other)
+            if title:
+                result.append((other, title))
+                if len(result) == (k or self.top_k):
+                    break
+        return result
+
+    async def recompute_dirty(self) -> int:
+        """Recomputes the lists of movies flagged dirty, in batches. Returns the number recomputed."""
+        recomputed = 0
+        # Movies whose recomputation failed are flagged dirty again once this pass is over,
+        # so they are retried on the next pass rather than reclaimed by this one
+        failed: List[int] = []
+        try:
+            while True:
+                movie_ids = await database.claim_dirty_items(CLAIM_BATCH)
+                if not movie_ids:
+                    return recomputed
+                rows = []
+                for movie_id in movie_ids:
+                    result = await database.get_item_cooccurrences(movie_id)
+                    if result is None:
+                        failed.append(movie_id)
+                        continue
+                    favorited, title, cooccurrences = result
+                    neighbors = array("i", rank_neighbors(favorited, cooccurrences, self.top_k))
+                    rows.append((movie_id, title, neighbors.tobytes(), time.time()))
+                if not await database.save_item_neighbors(rows):
+                    failed.extend(row[0] for row in rows)
+                    return recomputed
+                recomputed += len(rows)
+                self.recomputed += len(rows)
+        finally:
+            if failed:
+                await database.release_dirty_items(failed)
+
+    async def load(self) -> int:
+        """Loads the lists updated since the last load (all of them the first time). Returns how many were read."""
+        loaded = 0
+        # Re-reads the last interval too, in case another worker committed a list stamped slightly earlier
+        since = self._loaded_until - self.refresh_seconds if self._loaded_until else 0.0
+        async for movie_id, title, blob, updated_at in database.iter_item_neighbors(since):
+            neighbors = array("i")
+            neighbors.frombytes(blob)
+            if neighbors:
+                self._neighbors[movie_id] = neighbors
+            else:
+                self._neighbors.pop(movie_id, None)
+            if title:
+                self._titles[movie_id] = title
+            self._loaded_until = max(self._loaded_until, updated_at)
+            loaded += 1
+        return loaded
+
+    async def _run(self):
+        while True:
+            try:
+                recomputed = await self.recompute_dirty()
+                await self.load()
+                if recomputed:
+                    logger.info(f"Recomputed {recomputed} similar-movie lists")
+            except Exception as e:
+                logger.error(f"Error refreshing similar movies: {e}", exc_info=True)
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def start(self):
+        """Loads the stored lists and starts the refresh job (dispatcher startup hook)."""
+        if self._task is None:
+            try:
+                # Claims left by a worker that stopped mid-recomputation; at worst a list is recomputed twice
+                await database.release_dirty_items()
+                logger.info(f"Loaded {await self.load()} similar-movie lists")
+            except Exception as e:
+                logger.error(f"Could not load similar-movie lists: {e}")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancels the refresh job (dispatcher shutdown hook)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, float]:
+        """Returns movies with lists, lists recomputed by this worker and lookups, for metrics."""
+        return {"movies": len(self._neighbors), "recomputed": self.recomputed, "lookups": self.lookups}
@@ -1,20 +1,283 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import aiohttp
 import logging
-from typing import List, Dict, Optional, Any
+import re
+import time
+from collections import OrderedDict, deque
+from typing import List, Dict, Optional, Any, Tuple
 
-# Use absolute import
-from src.config import TMDB_API_KEY
+# Use absolute imports
+from src.config import (
+    TMDB_API_KEY, TMDB_KEEPALIVE_SECONDS, TMDB_TIMEOUT_SECONDS,
+    TMDB_BREAKER_FAILURES, TMDB_BREAKER_SLOW_SECONDS, TMDB_BREAKER_OPEN_SECONDS, TMDB_STALE_CACHE_SIZE,
+    TMDB_HEDGE_ENABLED, TMDB_HEDGE_PERCENTILE, TMDB_HEDGE_MAX_RATIO, TMDB_HEDGE_MIN_DELAY_MS,
+    TMDB_RATE_PER_SECOND, TMDB_INTERACTIVE_CONCURRENCY, TMDB_BACKGROUND_CONCURRENCY, TMDB_BACKGROUND_SHARE,
+)
+from src.services import metrics
+from src.services.request_scheduler import PriorityScheduler, INTERACTIVE, BACKGROUND, request_priority, background_priority
 
 BASE_URL = "https://api.themoviedb.org/3"
 IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500" # Base URL for posters
 
 logger = logging.getLogger(__name__)
 
-async def _make_request(session: aiohttp.ClientSession, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
-    """Helper function to make asynchronous requests to TMDb API."""
+_NUMERIC_PATH_SEGMENT = re.compile(r"/\d+")
+
+def _endpoint_label(endpoint: str) -> str:
+    """Collapses IDs in an endpoint path so metrics have one series per endpoint (/movie/{id})."""
+    return _NUMERIC_PATH_SEGMENT.sub("/{id}", endpoint)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitBreaker:
+    """
+    Stops calling TMDb while it is failing.
+
+    After `failure_threshold` consecutive failures (errors, timeouts, 5xx/429, or
+    calls slower than `slow_call_seconds`) the circuit opens and requests fail
+    fast for `open_seconds`. Then a single probe request is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, slow_call_seconds: float, open_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Returns True if a request may be sent now."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            logger.info("TMDb circuit half-open, sending a probe request")
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, healthy: bool, elapsed: float):
+        """Records the outcome of a request let through by allow()."""
+        self._probe_in_flight = False
+        if healthy and elapsed < self.slow_call_seconds:
+            if self.state != CLOSED:
+                logger.info("TMDb circuit closed, requests resumed")
+            self.state = CLOSED
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._open()
+
+    def release(self):
+        """Frees the half-open probe slot when a request ends without an outcome (cancelled)."""
+        self._probe_in_flight = False
+
+    def _open(self):
+        if self.state != OPEN:
+            logger.warning(f"TMDb circuit opened after {self.failures} failed or slow requests; failing fast for {self.open_seconds:.0f}s")
+            self.times_opened += 1
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.failures = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the circuit state (0 closed, 1 half-open, 2 open) and counters, for metrics."""
+        return {
+            "state": {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}[self.state],
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "stale_entries": len(_last_good),
+        }
+
+breaker = CircuitBreaker(TMDB_BREAKER_FAILURES, TMDB_BREAKER_SLOW_SECONDS, TMDB_BREAKER_OPEN_SECONDS)
+
+# Last successful response per (endpoint, params), served when TMDb fails or the circuit is open
+_last_good: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+
+# Responses served from _last_good carry their staleness themselves rather than in a
+# context variable, so it survives being fetched in a child task (gather, prefetch)
+class _StaleDict(dict):
+    __slots__ = ()
+
+class _StaleList(list):
+    __slots__ = ()
+
+def is_stale(data: Any) -> bool:
+    """Returns True if a response, result list or single result came from the stale fallback and may be out of date."""
+    return isinstance(data, (_StaleDict, _StaleList))
+
+def stale_copy(data: Any) -> Any:
+    """
+    Returns a copy of a response or result list that is_stale() reports as stale, its
+    results included (for callers serving their own caches past their freshness).
+    """
+    if isinstance(data, list):
+        return _StaleList(_StaleDict(item) if isinstance(item, dict) else item for item in data)
+    copy = _StaleDict(data)
+    if isinstance(copy.get("results"), list):
+        copy["results"] = stale_copy(copy["results"])
+    return copy
+
+def _remember(cache_key: Tuple, data: Dict[str, Any]):
+    _last_good[cache_key] = data
+    _last_good.move_to_end(cache_key)
+    if len(_last_good) > TMDB_STALE_CACHE_SIZE:
+        _last_good.popitem(last=False)
+
+def _stale_or_none(cache_key: Tuple, endpoint: str) -> Optional[Dict[str, Any]]:
+    data = _last_good.get(cache_key)
+    if data is None:
+        metrics.cache_miss("tmdb_stale")
+        return None
+    metrics.cache_hit("tmdb_stale")
+    logger.info("Serving stale TMDb response for %s", endpoint)
+    return stale_copy(data)
+
+class Hedger:
+    """
+    Decides when a hedged GET sends its second request.
+
+    The delay is the `percentile` latency of the last `window` successful requests
+    to the same endpoint (never below `min_delay`), recomputed every few samples.
+    Hedges draw from a budget that grows by `max_ratio` per hedgeable request, so
+    at most that fraction of requests is ever duplicated.
+    """
+
+    def __init__(self, percentile: float, max_ratio: float, min_delay: float, window: int = 200, min_samples: int = 20):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_delay = min_delay
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies: Dict[str, deque] = {}
+        self._delays: Dict[str, float] = {}
+        self._budget = 0.0
+        self.requests = 0
+        self.hedged = 0
+
+    def observe(self, label: str, seconds: float):
+        samples = self._latencies.get(label)
+        if samples is None:
+            samples = self._latencies[label] = deque(maxlen=self.window)
+        samples.append(seconds)
+        if len(samples) >= self.min_samples and len(samples) % 10 == 0:
+            ordered = sorted(samples)
+            self._delays[label] = max(self.min_delay, ordered[int(self.percentile * (len(ordered) - 1))])
+
+    def delay(self, label: str) -> Optional[float]:
+        """Returns the hedge delay for an endpoint, or None until enough latencies are known."""
+        return self._delays.get(label)
+
+    def on_request(self):
+        self.requests += 1
+        # Small cap so a quiet period cannot bank a burst of hedges
+        self._budget = min(self._budget + self.max_ratio, 3.0)
+
+    def try_acquire(self) -> bool:
+        if self._budget < 1.0:
+            return False
+        self._budget -= 1.0
+        self.hedged += 1
+        return True
+
+    def refund(self):
+        """Gives back a hedge taken by try_acquire() that was not sent."""
+        self._budget += 1.0
+        self.hedged -= 1
+
+    def stats(self) -> Dict[str, float]:
+        """Returns hedgeable requests and hedges sent, for metrics."""
+        return {"requests": self.requests, "hedged": self.hedged}
+
+hedger = Hedger(TMDB_HEDGE_PERCENTILE, TMDB_HEDGE_MAX_RATIO, TMDB_HEDGE_MIN_DELAY_MS / 1000)
+
+# Admission for every TMDb request: user-facing requests first, background work within its share.
+# Wrap background callers in `with tmdb.background_priority():`
+scheduler = PriorityScheduler(TMDB_RATE_PER_SECOND, {
+    INTERACTIVE: (TMDB_INTERACTIVE_CONCURRENCY, 1.0),
+    BACKGROUND: (TMDB_BACKGROUND_CONCURRENCY, TMDB_BACKGROUND_SHARE),
+})
+
+def create_session() -> aiohttp.ClientSession:
+    """Creates the shared HTTP session; keeps idle connections and DNS answers so warmed-up TLS connections stay usable."""
+    connector = aiohttp.TCPConnector(limit=100, keepalive_timeout=TMDB_KEEPALIVE_SECONDS, ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector)
+
+async def _fetch(session: aiohttp.ClientSession, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """One GET attempt; raises on HTTP and network errors."""
+    async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=TMDB_TIMEOUT_SECONDS)) as response:
+        logger.debug("TMDb API response status for %s: %s", url, response.status)
+        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
+        return await response.json()
+
+async def _fetch_hedged(session: aiohttp.ClientSession, url: str, params: Dict[str, Any], label: str) -> Dict[str, Any]:
+    """
+    GET with a hedge: if no answer arrives within the endpoint's hedge delay, a second
+    identical request is sent (the pool opens or reuses another connection), the first
+    successful answer wins and the other request is cancelled.
+
+    The hedge is a request like any other: it takes its own scheduler slot and rate
+    token, and is skipped if none is free at once (a hedge that waits is no use).
+    """
+    primary = asyncio.ensure_future(_fetch(session, url, params))
+    backup = None
+    try:
+        delay = hedger.delay(label)
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not hedger.try_acquire():
+            return await primary
+        priority = request_priority.get()
+        if not scheduler.try_acquire(priority):
+            hedger.refund()
+            metrics.TMDB_HEDGES.inc(label, "throttled")
+            return await primary
+
+        metrics.TMDB_HEDGES.inc(label, "sent")
+        backup = asyncio.ensure_future(_fetch(session, url, params))
+        # Released however the backup ends, including cancellation before it starts
+        backup.add_done_callback(lambda _: scheduler.release(priority))
+        pending = {primary, backup}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is backup:
+                        metrics.TMDB_HEDGES.inc(label, "won")
+                    return task.result()
+        # Both attempts failed; report the primary's error
+        return primary.result()
+    finally:
+        # asyncio.wait() does not cancel what it waits on: a caller cancelled during the
+        # hedge delay must not leave the primary GET running outside its scheduler slot
+        for task in (primary, backup):
+            if task is not None and not task.done():
+                task.cancel()
+
+async def _make_request(session: aiohttp.ClientSession, endpoint: str, params: Optional[Dict[str, Any]] = None,
+                        hedge: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Helper function to make asynchronous requests to TMDb API; falls back to the last good response on failure.
+
+    Pass hedge=True only for idempotent, latency-sensitive GETs (see Hedger).
+    """
     if params is None:
         params = {}
+    cache_key = (endpoint, tuple(sorted(params.items())))
+    if not breaker.allow():
+        # Fail fast while TMDb is down instead of waiting for another timeout
+        return _stale_or_none(cache_key, endpoint)
+
     params["api_key"] = TMDB_API_KEY
     params["language"] = "ar-SA" # Request Arabic language content
 
@@ -25,28 +288,57 @@ async def _make_request(session: aiohttp.ClientSession, endpoint: str, params: O
             processed_params[key] = str(value).lower() # Convert True -> "true", False -> "false"
 
     url = f"{BASE_URL}{endpoint}"
+    label = _endpoint_label(endpoint)
     try:
-        logger.debug(f"Making TMDb API request to: {url} with params: {processed_params}")
-        async with session.get(url, params=processed_params) as response:
-            logger.debug(f"TMDb API response status: {response.status}")
-            response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-            data = await response.json()
-            logger.debug(f"TMDb API request to {url} successful.")
-            return data
+        async with scheduler.slot(request_priority.get()):
+            return await _send(session, endpoint, url, processed_params, label, cache_key, hedge)
+    except asyncio.CancelledError:
+        # Cancelled while queued: give back a half-open probe slot taken by allow()
+        breaker.release()
+        raise
+
+async def _send(session: aiohttp.ClientSession, endpoint: str, url: str, processed_params: Dict[str, Any],
+                label: str, cache_key: Tuple, hedge: bool) -> Optional[Dict[str, Any]]:
+    """Sends an admitted request and records its outcome in metrics, the breaker and the stale cache."""
+    started = time.perf_counter()
+    outcome = "error"
+    healthy = False # Whether the outcome says TMDb itself is working (client errors like 404 do)
+    try:
+        # Lazy %-style: nothing is formatted unless DEBUG is enabled (params are not logged, they hold the API key)
+        logger.debug("Making TMDb API request to %s", endpoint)
+        if hedge and TMDB_HEDGE_ENABLED:
+            hedger.on_request()
+            data = await _fetch_hedged(session, url, processed_params, label)
+        else:
+            data = await _fetch(session, url, processed_params)
+        outcome = "ok"
+        healthy = True
+        hedger.observe(label, time.perf_counter() - started)
+        _remember(cache_key, data)
+        return data
     except aiohttp.ClientResponseError as e:
-        logger.error(f"Error fetching data from TMDb API ({url}) - Status: {e.status}, Message: {e.message}, Headers: {e.headers}")
-        try:
-            error_body = await e.text()
-            logger.error(f"TMDb API error response body: {error_body}")
-        except Exception as read_err:
-            logger.error(f"Could not read error response body: {read_err}")
-        return None
+        healthy = e.status < 500 and e.status != 429
+        logger.error(f"Error fetching data from TMDb API ({url}) - Status: {e.status}, Message: {e.message}")
+        return _stale_or_none(cache_key, endpoint) if not healthy else None
     except aiohttp.ClientError as e:
         logger.error(f"Client error during TMDb API request ({url}): {e}")
-        return None
+        return _stale_or_none(cache_key, endpoint)
+    except asyncio.TimeoutError:
+        logger.error(f"TMDb API request timed out after {TMDB_TIMEOUT_SECONDS:.0f}s ({url})")
+        return _stale_or_none(cache_key, endpoint)
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
     except Exception as e:
         logger.error(f"An unexpected error occurred during TMDb API request ({url}): {e}", exc_info=True)
-        return None
+        return _stale_or_none(cache_key, endpoint)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.TMDB_REQUEST_SECONDS.observe(elapsed, label, outcome)
+        if outcome == "cancelled":
+            breaker.release()
+        else:
+            breaker.record(healthy, elapsed)
 
 async def get_genres(session: aiohttp.ClientSession) -> Optional[Dict[int, str]]:
     """Fetches movie genres from TMDb."""
@@ -70,6 +362,21 @@ async def discover_movies_by_genre(session: aiohttp.ClientSession, genre_id: int
         return data["results"]
     return None
 
+async def discover_movies(session: aiohttp.ClientSession, filters: Dict[str, Any], page: int = 1) -> Optional[Tuple[List[Dict[str, Any]], int]]:
+    """Runs one /discover/movie query with the given filter parameters; returns (results, total pages)."""
+    endpoint = "/discover/movie"
+    params = {
+        **filters,
+        "sort_by": "popularity.desc",
+        "include_adult": "false", # Pass as string "false"
+        "page": page
+    }
+    data = await _make_request(session, endpoint, params)
+    if data and "results" in data:
+        # TMDb serves at most 500 pages of any query
+        return data["results"], min(data.get("total_pages") or 1, 500)
+    return None
+
 async def search_movies(session: aiohttp.ClientSession, query: str, page: int = 1) -> Optional[List[Dict[str, Any]]]:
     """Searches for movies based on a query string."""
     endpoint = "/search/movie"
@@ -78,7 +385,7 @@ async def search_movies(session: aiohttp.ClientSession, query: str, page: int =
         "include_adult": "false", # Pass as string "false"
         "page": page
     }
-    data = await _make_request(session, endpoint, params)
+    data = await _make_request(session, endpoint, params, hedge=True)
     if data and "results" in data:
         return data["results"]
     return None
@@ -88,7 +395,7 @@ async def get_movie_details(session: aiohttp.ClientSession, movie_id: int) -> Op
     endpoint = f"/movie/{movie_id}"
     # Append recommendations and credits (cast/crew) to the response
     params = {"append_to_response": "recommendations,credits"}
-    data = await _make_request(session, endpoint, params)
+    data = await _make_request(session, endpoint, params, hedge=True)
     return data # Return the full data dictionary or None if error
 
 async def get_popular_movies(session: aiohttp.ClientSession, page: int = 1) -> Optional[List[Dict[str, Any]]]:
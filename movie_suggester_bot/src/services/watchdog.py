@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Event loop watchdog and slow-update log.
+
+A heartbeat coroutine wakes up every `interval` seconds and records how late it
+ran (scheduling lag) into metrics. A separate thread watches the heartbeat: when
+it has not ticked for `threshold` seconds the loop is blocked, and the thread
+logs a stack snapshot of the loop thread so the blocking code can be found.
+
+Updates whose handler runs longer than `slow_update_budget` are kept in a bounded
+ring buffer with their type, handler and time spent per stage (tmdb, db,
+telegram, and the remainder as "other"), which the admin can dump from the panel.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Deque, Dict, Optional
+
+# Use absolute imports
+from src.services import metrics
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class SlowUpdate:
+    """One update that exceeded the handler budget."""
+    at: float
+    update_type: str
+    description: str
+    chat_id: Optional[int]
+    handler: str
+    total: float
+    stages: Dict[str, float] = field(default_factory=dict)
+
+@dataclass
+class LoopStall:
+    """One period during which the event loop did not run the heartbeat."""
+    at: float
+    blocked_for: float
+    stack: str
+
+class LoopWatchdog:
+    def __init__(
+        self,
+        threshold: float = 0.2,
+        interval: float = 0.05,
+        slow_update_budget: float = 2.0,
+        log_size: int = 100,
+    ):
+        self.threshold = threshold
+        self.interval = interval
+        self.slow_update_budget = slow_update_budget
+        self.slow_updates: Deque[SlowUpdate] = deque(maxlen=log_size)
+        self.stalls: Deque[LoopStall] = deque(maxlen=20)
+        self.max_lag = 0.0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def start(self):
+        """Starts the heartbeat on the running loop and the watcher thread (dispatcher startup hook)."""
+        if self._heartbeat_task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._watcher = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watcher.start()
+
+    async def stop(self):
+        """Stops the heartbeat and the watcher thread (dispatcher shutdown hook)."""
+        self._stop.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+        if self._watcher is not None:
+            self._watcher.join(timeout=1)
+            self._watcher = None
+
+    async def _heartbeat(self):
+        while True:
+            due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - due)
+            self._last_beat = now
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag >= self.threshold:
+                logger.warning(f"Event loop lag: heartbeat ran {lag * 1000:.0f}ms late")
+
+    def _watch(self):
+        """Watcher thread: snapshots the loop thread's stack once per stall."""
+        reported_beat = None
+        while not self._stop.wait(self.threshold / 2):
+            last_beat = self._last_beat
+            blocked_for = time.monotonic() - last_beat - self.interval
+            if blocked_for < self.threshold or reported_beat == last_beat:
+                continue
+            reported_beat = last_beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<no frame>"
+            self.stalls.append(LoopStall(time.time(), blocked_for, stack))
+            logger.warning(f"Event loop blocked for {blocked_for * 1000:.0f}ms so far; loop thread stack:\n{stack}")
+
+    def record_update(self, update_type: str, description: str, chat_id: Optional[int], handler: str,
+                      total: float, stages: Dict[str, float]):
+        """Adds an update to the slow-update log if it went over budget."""
+        if total < self.slow_update_budget:
+            return
+        stages = dict(stages)
+        stages["other"] = max(0.0, total - sum(stages.values()))
+        self.slow_updates.append(SlowUpdate(time.time(), update_type, description, chat_id, handler, total, stages))
+        logger.info(f"Slow update: {update_type} {description} handled by {handler} in {total:.2f}s")
+
+    def stats(self) -> Dict[str, float]:
+        """Returns watchdog counters, for metrics."""
+        return {
+            "max_lag_seconds": round(self.max_lag, 4),
+            "stalls": len(self.stalls),
+            "slow_updates": len(self.slow_updates),
+        }
+
+    def report(self) -> str:
+        """Renders the slow-update log and recent loop stalls as plain text, newest first."""
+        lines = [f"Slow updates (budget {self.slow_update_budget:.1f}s, last {len(self.slow_updates)}):"]
+        for entry in reversed(self.slow_updates):
+            breakdown = ", ".join(f"{stage}={seconds:.3f}s" for stage, seconds in sorted(entry.stages.items()))
+            lines.append(
+                f"{datetime.fromtimestamp(entry.at):%Y-%m-%d %H:%M:%S} {entry.total:.3f}s "
+                f"{entry.update_type} {entry.description} chat={entry.chat_id} handler={entry.handler} [{breakdown}]"
+            )
+        lines.append("")
+        lines.append(f"Event loop stalls (threshold {self.threshold * 1000:.0f}ms, max lag {self.max_lag * 1000:.0f}ms):")
+        for stall in reversed(self.stalls):
+            lines.append(f"--- {datetime.fromtimestamp(stall.at):%Y-%m-%d %H:%M:%S} blocked >= {stall.blocked_for * 1000:.0f}ms")
+            lines.append(stall.stack)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Builds the catalogue snapshot suggestions are sampled from (see services/catalogue.py).
+
+Optionally fills the catalogue table first from TMDb's discover results (the
+first --pages pages of every genre, by popularity), and fills in up to
+--fill-in of the most popular rows only known from an ID export from their
+details. Then writes the memory-mapped snapshot of all filled-in, non-adult
+catalogue movies with at least --min-popularity as a new generation in
+--output. Running bots pick up a new snapshot on restart.
+
+    python3 -m src.tools.build_catalogue --pages 25
+    python3 -m src.tools.build_catalogue --skip-fetch --fill-in 5000 --min-popularity 1
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+# Use absolute imports
+from src.config import CATALOGUE_DIR
+from src.services import catalogue, database, tmdb
+
+logger = logging.getLogger(__name__)
+
+async def fetch(pages: int) -> int:
+    """Upserts the first `pages` discover pages of every genre into the catalogue. Returns the rows written."""
+    written = 0
+    async with tmdb.create_session() as session:
+        genres = await tmdb.get_genres(session) or {genre_id: str(genre_id) for genre_id in catalogue.GENRE_BITS}
+        for genre_id, name in genres.items():
+            results = await asyncio.gather(*(
+                tmdb.discover_movies_by_genre(session, genre_id, page) for page in range(1, pages + 1)
+            ))
+            rows = [catalogue.catalogue_row(movie) for page in results if page for movie in page if movie.get("id")]
+            written += await database.upsert_catalogue_movies(rows)
+            logger.info(f"{name}: {len(rows)} movies")
+    return written
+
+async def fill_in(limit: int, min_popularity: float, chunk: int = 50) -> int:
+    """Fills in up to `limit` ID-only catalogue rows from their details, most popular first. Returns the rows written."""
+    movie_ids = await database.get_unfilled_catalogue_ids(limit, min_popularity)
+    written = 0
+    async with tmdb.create_session() as session:
+        with tmdb.background_priority():
+            for start in range(0, len(movie_ids), chunk):
+                results = await asyncio.gather(*(
+                    tmdb.get_movie_details(session, movie_id) for movie_id in movie_ids[start:start + chunk]
+                ))
+                rows = [catalogue.catalogue_row(details) for details in results if details and details.get("title")]
+                written += await database.upsert_catalogue_movies(rows)
+                logger.info(f"Filled in {written} of {len(movie_ids)} ID-only movies")
+    return written
+
+async def build(output: str, min_popularity: float) -> int:
+    """Writes the snapshot of the catalogue table to `output`. Returns the number of movies in it."""
+    movies = []
+    async for movie_id, popularity, vote_average, release_date, mask in database.iter_catalogue_movies(min_popularity):
+        year = int(release_date[:4]) if release_date and release_date[:4].isdigit() else 0
+        movies.append((movie_id, popularity, vote_average, year, mask))
+    counts = catalogue.write_snapshot(output, movies)
+    logger.info(f"Sampling tables (genre bit: movies, -1 = all): {counts}")
+    return len(movies)
+
+async def run(args: argparse.Namespace):
+    await database.init_db()
+    started = time.perf_counter()
+    if not args.skip_fetch:
+        written = await fetch(args.pages)
+        logger.info(f"Fetched {written} catalogue rows from TMDb in {time.perf_counter() - started:.1f}s")
+    if args.fill_in:
+        started = time.perf_counter()
+        written = await fill_in(args.fill_in, args.min_popularity)
+        logger.info(f"Filled in {written} ID-only catalogue rows in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    count = await build(args.output, args.min_popularity)
+    logger.info(f"Wrote a snapshot of {count} movies to {args.output} in {time.perf_counter() - started:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=25, help="discover pages fetched per genre (20 movies each)")
+    parser.add_argument("--skip-fetch", action="store_true", help="only write the snapshot of the existing table")
+    parser.add_argument("--fill-in", type=int, default=0, help="ID-only rows filled in from their details (they are left out of the snapshot until then)")
+    parser.add_argument("--min-popularity", type=float, default=0.0)
+    parser.add_argument("--output", default=CATALOGUE_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
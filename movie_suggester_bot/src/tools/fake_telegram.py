@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Local fake Telegram sender for exercising the webhook without Telegram.
+
+Posts synthetic updates with the webhook secret header to a running
+`python3 -m src.webhook` and reports how quickly they were acknowledged:
+
+    python3 -m src.tools.fake_telegram --updates 500 --chats 50 --concurrency 20
+
+The bot's own replies still go to the real Bot API and will fail for the fake
+chat IDs; this tool measures ingestion, acknowledgement and worker routing.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+
+# Use absolute imports
+from src.config import WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET
+from src.webhook import SECRET_HEADER
+
+SAMPLE_TEXTS = ["/start", "/daily", "/genre", "/favorites", "☀️ اقتراح اليوم", "Inception", "The Matrix"]
+
+_update_ids = itertools.count(1)
+
+def fake_message_update(chat_id: int, text: str) -> Dict[str, Any]:
+    """Builds a minimal private-chat message update."""
+    update_id = next(_update_ids)
+    user = {"id": chat_id, "is_bot": False, "first_name": f"Fake {chat_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        },
+    }
+
+async def send_updates(url: str, secret: str, updates: List[Dict[str, Any]], concurrency: int) -> List[float]:
+    """Posts all updates and returns the acknowledgement latency of each, in seconds."""
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession(headers={SECRET_HEADER: secret}) as session:
+        async def post(update):
+            async with semaphore:
+                started = time.perf_counter()
+                async with session.post(url, json=update) as response:
+                    await response.read()
+                    if response.status != 200:
+                        print(f"update {update['update_id']}: HTTP {response.status}")
+                latencies.append(time.perf_counter() - started)
+        await asyncio.gather(*(post(update) for update in updates))
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET or "")
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--first-chat-id", type=int, default=900_000_000)
+    args = parser.parse_args()
+
+    chat_ids = [args.first_chat_id + i for i in range(args.chats)]
+    updates = [fake_message_update(random.choice(chat_ids), random.choice(SAMPLE_TEXTS)) for _ in range(args.updates)]
+
+    started = time.perf_counter()
+    latencies = sorted(asyncio.run(send_updates(args.url, args.secret, updates, args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    print(f"Sent {len(latencies)} updates in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s)")
+    print(f"Ack latency p50={percentile(0.50):.1f}ms p95={percentile(0.95):.1f}ms p99={percentile(0.99):.1f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Streams a TMDb daily movie ID export into the local catalogue table.
+
+TMDb publishes gzipped JSON-lines files with one movie per line:
+
+    {"adult":false,"id":3924,"original_title":"Blondie","popularity":2.4,"video":false}
+
+The file is read line by line from local disk, so memory stays constant
+however large it is. Adult and low-popularity entries are skipped, and the
+rest are upserted in large transactions; titles, posters and genres already
+filled in by build_catalogue are kept, only the popularity is refreshed. New
+movies are left out of the snapshot until they are filled in from their
+details, so rebuild it afterwards with `build_catalogue --skip-fetch --fill-in N`.
+
+    python3 -m src.tools.ingest_id_export movie_ids_10_19_2026.json.gz --min-popularity 1
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import time
+from typing import Dict, Iterator, Tuple
+
+# Use absolute imports
+from src.services import database
+
+logger = logging.getLogger(__name__)
+
+def read_export(path: str, min_popularity: float, counts: Dict[str, int]) -> Iterator[Tuple[int, str, float]]:
+    """Yields (movie_id, original_title, popularity) for every kept line, counting skipped ones in `counts`."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            counts["lines"] += 1
+            try:
+                entry = json.loads(line)
+                movie_id = int(entry["id"])
+                popularity = float(entry.get("popularity") or 0.0)
+            except (ValueError, KeyError, TypeError):
+                counts["malformed"] += 1
+                continue
+            if entry.get("adult"):
+                counts["adult"] += 1
+                continue
+            if popularity < min_popularity:
+                counts["low_popularity"] += 1
+                continue
+            yield movie_id, entry.get("original_title"), popularity
+
+async def ingest(path: str, min_popularity: float, batch_size: int) -> Dict[str, int]:
+    """Upserts the kept entries of the export in batches of `batch_size`. Returns line counts per outcome."""
+    counts = {"lines": 0, "kept": 0, "adult": 0, "low_popularity": 0, "malformed": 0, "failed": 0}
+    started = time.perf_counter()
+    batch = []
+    for row in read_export(path, min_popularity, counts):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            await _write(batch, counts, started)
+            batch = []
+    if batch:
+        await _write(batch, counts, started)
+    return counts
+
+async def _write(batch: list, counts: Dict[str, int], started: float):
+    written = await database.upsert_catalogue_ids(batch)
+    counts["kept"] += written
+    counts["failed"] += len(batch) - written
+    elapsed = time.perf_counter() - started
+    logger.info(f"{counts['lines']} lines read, {counts['kept']} upserted ({counts['lines'] / elapsed:,.0f} lines/s)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="movie ID export (.json.gz, or uncompressed JSON lines)")
+    parser.add_argument("--min-popularity", type=float, default=1.0)
+    parser.add_argument("--batch-size", type=int, default=20_000, help="rows per transaction")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    async def run():
+        await database.init_db()
+        started = time.perf_counter()
+        counts = await ingest(args.path, args.min_popularity, args.batch_size)
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"Ingested {args.path} in {elapsed:.1f}s ({counts['lines'] / elapsed:,.0f} lines/s): "
+            + ", ".join(f"{key} {value}" for key, value in counts.items())
+        )
+
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of the logging cost paid on the event loop thread per update.
+
+Replays the log calls made while handling one genre selection (aiogram's
+"Update ... is handled" line, the handler's own line and the TMDb request debug
+lines) under the old setup (synchronous StreamHandler, eager f-strings, INFO on
+every callback) and the current one (queue listener, lazy %-style, sampled
+update lines), writing to a temporary file:
+
+    python3 -m src.tools.logging_benchmark --updates 20000
+"""
+import argparse
+import logging
+import tempfile
+import time
+from typing import Tuple
+
+# Use absolute imports
+from src.services.logging_setup import LOG_FORMAT, setup_logging, shutdown_logging
+
+PARAMS = {"with_genres": 28, "sort_by": "popularity.desc", "include_adult": "false", "page": 1,
+          "api_key": "x" * 32, "language": "ar-SA"}
+URL = "https://api.themoviedb.org/3/discover/movie"
+
+def old_update(update_id: int, event_log: logging.Logger, handler_log: logging.Logger, tmdb_log: logging.Logger):
+    handler_log.info(f"Received genre selection callback. Genre ID string: {'28'}, Parsed integer ID: {28}")
+    for _ in range(2):
+        tmdb_log.debug(f"Making TMDb API request to: {URL} with params: {PARAMS}")
+        tmdb_log.debug(f"TMDb API response status: {200}")
+        tmdb_log.debug(f"TMDb API request to {URL} successful.")
+    event_log.info("Update id=%s is handled. Duration %d ms by bot id=%d", update_id, 120, 42)
+
+def new_update(update_id: int, event_log: logging.Logger, handler_log: logging.Logger, tmdb_log: logging.Logger):
+    handler_log.debug("Received genre selection callback for genre %s", 28)
+    for _ in range(2):
+        tmdb_log.debug("Making TMDb API request to %s", "/discover/movie")
+        tmdb_log.debug("TMDb API response status for %s: %s", "/discover/movie", 200)
+    event_log.info("Update id=%s is handled. Duration %d ms by bot id=%d", update_id, 120, 42)
+
+def run(variant: str, updates: int, sample_rate: float) -> Tuple[float, float]:
+    """Returns seconds spent in log calls and seconds the listener needed afterwards to drain."""
+    loggers = [logging.getLogger(name) for name in ("aiogram.event", "src.handlers.genre", "src.services.tmdb")]
+    with tempfile.TemporaryFile("w") as log_file:
+        root = logging.getLogger()
+        if variant == "old":
+            for handler in root.handlers[:]:
+                root.removeHandler(handler)
+            handler = logging.StreamHandler(log_file)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            root.addHandler(handler)
+            root.setLevel(logging.INFO)
+            update = old_update
+        else:
+            setup_logging(logging.INFO, {"aiogram.event": sample_rate}, max_queue=updates * 10, stream=log_file)
+            update = new_update
+
+        started = time.perf_counter()
+        for update_id in range(updates):
+            update(update_id, *loggers)
+        elapsed = time.perf_counter() - started
+
+        drain_started = time.perf_counter()
+        if variant == "old":
+            root.removeHandler(handler)
+        else:
+            shutdown_logging()
+        drain = time.perf_counter() - drain_started
+    return elapsed, drain
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--sample-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    for variant in ("old", "new"):
+        elapsed, drain = run(variant, args.updates, args.sample_rate)
+        print(f"{variant}: {elapsed / args.updates * 1e6:.1f} µs of logging per update on the calling thread "
+              f"(+{drain:.3f}s draining in the background)")
+
+if __name__ == '__main__':
+    main()
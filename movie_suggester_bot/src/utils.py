@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+# Use absolute imports
+from src.config import CALLBACK_WORK_DEADLINE_SECONDS, CARD_DETAILS_DEADLINE_SECONDS
+from src.services import metrics, tmdb
+
+logger = logging.getLogger(__name__)
+
+STALE_NOTICE = "⚠️ خدمة بيانات الأفلام تواجه مشكلة حاليًا، لذا قد لا تكون هذه المعلومات محدّثة."
+TIMEOUT_TEXT = "⌛ استغرق الطلب وقتًا أطول من المتوقع. يرجى المحاولة مرة أخرى بعد قليل."
+ERROR_TEXT = "حدث خطأ غير متوقع. يرجى المحاولة مرة أخرى."
+
+# Callback data of buttons that only display a status; answered without doing anything
+NOOP_CALLBACK = "noop"
+
+def with_stale_notice(text: str, *sources: Any) -> str:
+    """Appends the stale-data notice if any of the TMDb data `text` was built from came from the fallback cache."""
+    if any(tmdb.is_stale(source) for source in sources):
+        return f"{text}\n\n{STALE_NOTICE}"
+    return text
+
+def status_keyboard(text: str) -> InlineKeyboardMarkup:
+    """Single inert button used to show progress or a result in place of a message's keyboard."""
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=text, callback_data=NOOP_CALLBACK)]])
+
+async def edit_message(message: Message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> bool:
+    """Edits a message's text, or its caption for media messages. Returns False if Telegram refused."""
+    try:
+        if message.photo or message.caption is not None:
+            await message.edit_caption(caption=text, reply_markup=reply_markup)
+        else:
+            await message.edit_text(text, reply_markup=reply_markup)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not edit message {message.message_id}: {e}")
+        return False
+
+def prefetch_details(session: aiohttp.ClientSession, movie_id: int) -> "asyncio.Task[Optional[Dict[str, Any]]]":
+    """
+    Starts fetching a movie's details for complete_card(). The card is already on
+    screen, so the request runs at background priority.
+    """
+    with tmdb.background_priority():
+        return asyncio.create_task(tmdb.get_movie_details(session, movie_id))
+
+async def complete_card(
+    sent: Optional[Message],
+    details_task: "asyncio.Task[Optional[Dict[str, Any]]]",
+    render: Callable[[Dict[str, Any]], str],
+    deadline: float = CARD_DETAILS_DEADLINE_SECONDS,
+):
+    """
+    Edits a card that was sent from list data once its details arrive.
+
+    `render` builds the full caption from the details. If the details fail or take
+    longer than `deadline`, the card is left as it was sent.
+    """
+    if sent is None:
+        details_task.cancel()
+        return
+    try:
+        details = await asyncio.wait_for(details_task, deadline)
+    except asyncio.TimeoutError:
+        logger.debug("Details for card %s arrived too late; leaving it as sent", sent.message_id)
+        return
+    if not details:
+        return
+    await edit_message(sent, render(details), sent.reply_markup)
+
+class _WorkGuard:
+    """Marks whether callback work has started writing and must no longer be cancelled."""
+    __slots__ = ("writing",)
+
+    def __init__(self):
+        self.writing = False
+
+_work_guard: contextvars.ContextVar[Optional[_WorkGuard]] = contextvars.ContextVar("callback_work_guard", default=None)
+
+# Callback work counters since startup
+_callback_work = {"running": 0, "timed_out": 0, "overran": 0}
+
+def begin_writes():
+    """
+    Called by callback work right before it writes (database, sent messages).
+
+    From then on a missed deadline no longer cancels the work; it is left to
+    finish, so a write is never interrupted halfway.
+    """
+    guard = _work_guard.get()
+    if guard is not None:
+        guard.writing = True
+
+async def _run_with_deadline(name: str, message: Message, work: Callable[[], Awaitable[None]],
+                             deadline: float, fallback: Callable[[str], Awaitable[None]]):
+    started = time.perf_counter()
+    guard = _WorkGuard()
+    token = _work_guard.set(guard)
+    # The task copies the context, so begin_writes() inside the work sees this guard
+    task = asyncio.create_task(work())
+    _work_guard.reset(token)
+    _callback_work["running"] += 1
+    try:
+        done, _ = await asyncio.wait({task}, timeout=deadline)
+        if not done:
+            if guard.writing:
+                _callback_work["overran"] += 1
+                logger.warning(f"Callback work {name} for chat {message.chat.id} passed its {deadline:g}s deadline while writing; letting it finish")
+                await task
+            else:
+                _callback_work["timed_out"] += 1
+                logger.warning(f"Callback work {name} for chat {message.chat.id} missed its {deadline:g}s deadline")
+                task.cancel()
+                await fallback(TIMEOUT_TEXT)
+                return
+        task.result()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    except Exception as e:
+        logger.error(f"Callback work {name} for chat {message.chat.id} failed: {e}", exc_info=True)
+        await fallback(ERROR_TEXT)
+    finally:
+        _callback_work["running"] -= 1
+        metrics.HANDLER_SECONDS.observe(time.perf_counter() - started, "callback_work", name)
+
+async def answer_then_run(
+    callback_query: CallbackQuery,
+    name: str,
+    work: Callable[[], Awaitable[None]],
+    answer_text: Optional[str] = None,
+    progress_text: Optional[str] = None,
+    progress_markup: Optional[InlineKeyboardMarkup] = None,
+    fallback: Optional[Callable[[str], Awaitable[None]]] = None,
+    deadline: float = CALLBACK_WORK_DEADLINE_SECONDS,
+):
+    """
+    Answers a callback at once, then runs the slow part with a deadline.
+
+    The button stops spinning immediately (with `answer_text` as a toast, if given)
+    and the message is edited to `progress_text` and/or `progress_markup`. `work` is
+    then awaited inside the handler, so it keeps the chat's place in the update
+    ordering and is timed like any handler. If it fails, or misses `deadline` before
+    calling begin_writes(), it is cancelled and `fallback` is called with a short
+    explanation (by default the message is edited to show it), so the user never
+    waits on a request that will not finish.
+    """
+    message = callback_query.message
+    try:
+        await callback_query.answer(answer_text)
+    except Exception as e:
+        logger.warning(f"Could not answer callback {callback_query.id}: {e}")
+
+    if progress_text is not None:
+        await edit_message(message, progress_text, progress_markup)
+    elif progress_markup is not None:
+        try:
+            await message.edit_reply_markup(reply_markup=progress_markup)
+        except Exception as e:
+            logger.warning(f"Could not show progress on message {message.message_id}: {e}")
+
+    async def edit_to_fallback(text: str):
+        await edit_message(message, text)
+
+    await _run_with_deadline(name, message, work, deadline, fallback or edit_to_fallback)
+
+def callback_work_stats() -> dict:
+    """Returns callback work running now, cancelled at its deadline and let past it while writing, for metrics."""
+    return dict(_callback_work)
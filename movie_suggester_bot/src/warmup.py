@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Startup warm-up, run after the dispatcher is built and before updates are accepted.
+
+Every cold path the first users after a deploy would otherwise pay for is taken
+once here: the database file and FSM connection, the known-user set, the genre
+list and the popular-movies pool. The TMDb fetches run concurrently, so they
+also leave several TLS connections open in the shared session's pool. Each step
+is timed and the results are logged; failures and the overall timeout only
+cost the warm-up, never startup itself.
+"""
+import asyncio
+import logging
+import time
+from typing import List, Tuple
+
+import aiohttp
+from aiogram import Dispatcher
+
+# Use absolute imports
+from src.config import WARMUP_TIMEOUT_SECONDS
+from src.services import database
+from src.services.fsm_storage import SQLiteStorage
+from src.handlers.genre import get_genres_cached
+from src.services.daily_movie import get_popular_pool
+
+logger = logging.getLogger(__name__)
+
+async def _warm_database() -> str:
+    favorites = await database.get_total_favorites_count()
+    return f"{favorites} favorites"
+
+async def _warm_known_users() -> str:
+    return f"{await database.load_known_users()} users"
+
+async def _warm_fsm(dp: Dispatcher) -> str:
+    if isinstance(dp.storage, SQLiteStorage):
+        await dp.storage.open()
+        return "connection open"
+    return "in memory"
+
+async def _warm_genres(session: aiohttp.ClientSession) -> str:
+    genres = await get_genres_cached(session)
+    if not genres:
+        raise RuntimeError("no genres returned")
+    return f"{len(genres)} genres"
+
+async def _warm_suggestion_pool(session: aiohttp.ClientSession) -> str:
+    movies = await get_popular_pool(session)
+    if not movies:
+        raise RuntimeError("no movies returned")
+    return f"{len(movies)} movies"
+
+async def warm_up(dp: Dispatcher, session: aiohttp.ClientSession, timeout: float = WARMUP_TIMEOUT_SECONDS) -> List[Tuple[str, float, str]]:
+    """Runs all warm-up steps concurrently and returns (step, seconds, result) for each finished step."""
+    report: List[Tuple[str, float, str]] = []
+
+    async def step(name: str, coro):
+        started = time.perf_counter()
+        try:
+            result = await coro
+        except Exception as e:
+            result = f"failed: {e}"
+        report.append((name, time.perf_counter() - started, result))
+
+    started = time.perf_counter()
+    steps = [
+        step("database", _warm_database()),
+        step("known_users", _warm_known_users()),
+        step("fsm_storage", _warm_fsm(dp)),
+        step("genres", _warm_genres(session)),
+        step("suggestion_pool", _warm_suggestion_pool(session)),
+    ]
+    try:
+        await asyncio.wait_for(asyncio.gather(*steps), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Warm-up did not finish within {timeout:.0f}s; starting anyway")
+
+    summary = ", ".join(f"{name} {seconds * 1000:.0f}ms ({result})" for name, seconds, result in report)
+    logger.info(f"Warm-up finished in {(time.perf_counter() - started) * 1000:.0f}ms: {summary}")
+    return report
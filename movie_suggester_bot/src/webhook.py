@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Webhook entry point: python3 -m src.webhook
+
+The master process applies migrations, registers the webhook with Telegram and
+spawns WEBHOOK_WORKERS worker processes. All workers listen on the same public
+port (SO_REUSEPORT), so the kernel spreads incoming connections between them.
+Each chat is owned by exactly one worker (hash of the chat ID); a worker that
+receives an update for a chat it does not own forwards it to the owner over
+localhost, which keeps per-chat ordering and per-process caches coherent.
+Bot-wide jobs that must run once, like the daily push, run in worker 0 only.
+
+Updates are acknowledged as soon as they are accepted and processed in the
+background. The webhook is never deleted on shutdown, so updates that arrive
+during a deploy stay queued at Telegram until the new workers are up.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import signal
+from typing import Any, Dict, Optional, Set
+
+import aiohttp
+from aiohttp import web
+
+# Use absolute imports
+from src.config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_WORKERS, WEBHOOK_INTERNAL_PORT, DROP_PENDING_UPDATES, METRICS_PORT, WARMUP_ENABLED, DAILY_PUSH_ENABLED,
+)
+from src.services import database, metrics, tmdb
+from src.main import create_bot, create_dispatcher, run
+from src.warmup import warm_up
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+INTERNAL_PATH = "/internal/update"
+
+def chat_id_of(update: Dict[str, Any]) -> Optional[int]:
+    """Returns the chat ID an update belongs to, falling back to the sender's user ID."""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        sender = value.get("from") or value.get("user")
+        if sender and "id" in sender:
+            return sender["id"]
+    return None
+
+def owner_of(chat_id: Optional[int], workers: int) -> int:
+    """Returns the index of the worker that processes every update of a chat."""
+    if chat_id is None or workers <= 1:
+        return 0
+    return hash(chat_id) % workers
+
+class WebhookWorker:
+    """One worker process: accepts webhook requests and feeds owned updates to the dispatcher."""
+
+    def __init__(self, index: int, workers: int):
+        self.index = index
+        self.workers = workers
+        self.bot = create_bot()
+        # The daily push is paced for the whole bot, so only the first worker sends it
+        self.dp = create_dispatcher(daily_push_enabled=DAILY_PUSH_ENABLED and index == 0)
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.metrics_runner: Optional[web.AppRunner] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _authorized(self, request: web.Request) -> bool:
+        return hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET)
+
+    async def _process(self, update: Dict[str, Any]):
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Error processing update {update.get('update_id')}: {e}", exc_info=True)
+
+    async def _forward(self, owner: int, update: Dict[str, Any], body: bytes):
+        url = f"http://127.0.0.1:{WEBHOOK_INTERNAL_PORT + owner}{INTERNAL_PATH}"
+        try:
+            async with self.session.post(
+                url, data=body,
+                headers={SECRET_HEADER: WEBHOOK_SECRET, "Content-Type": "application/json"},
+                timeout=aiohttp.ClientTimeout(total=5),
+            ) as response:
+                response.raise_for_status()
+        except Exception as e:
+            # Better to break affinity for one update than to lose it
+            logger.warning(f"Could not forward update {update.get('update_id')} to worker {owner}, processing locally: {e}")
+            await self._process(update)
+
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        """Public endpoint called by Telegram."""
+        if not self._authorized(request):
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+
+        owner = owner_of(chat_id_of(update), self.workers)
+        if owner == self.index:
+            self._spawn(self._process(update))
+        else:
+            self._spawn(self._forward(owner, update, body))
+        # Acknowledge right away; Telegram holds back the next updates until we answer
+        return web.Response()
+
+    async def handle_internal(self, request: web.Request) -> web.Response:
+        """Localhost endpoint receiving updates forwarded by other workers."""
+        if not self._authorized(request):
+            return web.Response(status=401)
+        self._spawn(self._process(await request.json()))
+        return web.Response()
+
+    async def on_startup(self, app: web.Application):
+        self.session = tmdb.create_session()
+        self.dp["session"] = self.session
+        # Runs before the site starts listening, so no update waits on a cold path
+        if WARMUP_ENABLED:
+            await warm_up(self.dp, self.session)
+        if METRICS_PORT:
+            self.metrics_runner = await metrics.start_metrics_server(METRICS_PORT + self.index)
+        await self.dp.emit_startup(bot=self.bot, **self.dp.workflow_data)
+
+    async def on_cleanup(self, app: web.Application):
+        if self._tasks:
+            logger.info(f"Worker {self.index}: waiting for {len(self._tasks)} in-flight updates")
+            await asyncio.wait(set(self._tasks), timeout=10)
+        await self.dp.emit_shutdown(bot=self.bot, **self.dp.workflow_data)
+        await self.session.close()
+        await self.bot.session.close()
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+
+async def _serve(index: int, workers: int):
+    worker = WebhookWorker(index, workers)
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, worker.handle_webhook)
+    app.router.add_post(INTERNAL_PATH, worker.handle_internal)
+    app.on_startup.append(worker.on_startup)
+    app.on_cleanup.append(worker.on_cleanup)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=workers > 1).start()
+    if workers > 1:
+        await web.TCPSite(runner, "127.0.0.1", WEBHOOK_INTERNAL_PORT + index).start()
+    logger.info(f"Webhook worker {index + 1}/{workers} listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    logger.info(f"Webhook worker {index} shutting down...")
+    await runner.cleanup()
+
+def run_worker(index: int, workers: int):
+    """Process target for a single webhook worker."""
+    run(_serve(index, workers))
+
+async def _prepare():
+    """One-time setup done by the master before workers start."""
+    await database.init_db()
+    await database.enable_wal()
+    bot = create_bot()
+    try:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            drop_pending_updates=DROP_PENDING_UPDATES,
+            allowed_updates=create_dispatcher().resolve_used_update_types(),
+        )
+        logger.info(f"Webhook registered at {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    finally:
+        await bot.session.close()
+
+def main():
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_URL and WEBHOOK_SECRET must be set to run in webhook mode")
+    asyncio.run(_prepare())
+
+    # Workers are always separate processes so the master only supervises
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(index, WEBHOOK_WORKERS), name=f"webhook-worker-{index}")
+        for index in range(WEBHOOK_WORKERS)
+    ]
+    for process in processes:
+        process.start()
+
+    def _terminate(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGINT, _terminate)
+    for process in processes:
+        process.join()
+    logger.info("All webhook workers stopped.")
+
+if __name__ == '__main__':
+    main()
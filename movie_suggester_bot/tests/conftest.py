@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# src.config refuses to import without these; tests never reach Telegram or TMDb
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:test")
+os.environ.setdefault("TMDB_API_KEY", "test")
+os.environ.setdefault("ADMIN_ID", "1")
+
+# Use absolute imports (src.*) as the bot does when run with python3 -m
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+
+import aiosqlite
+
+from src.services import database
+from src.tools import ingest_id_export
+
+# 1001 lines: 100 adult, 90 below popularity 1, one with a non-numeric popularity
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "movie_ids_sample.json.gz")
+
+def test_read_export_skip_counts():
+    counts = {"lines": 0, "adult": 0, "low_popularity": 0, "malformed": 0}
+    kept = list(ingest_id_export.read_export(FIXTURE, 1.0, counts))
+    assert len(kept) == 810
+    assert counts == {"lines": 1001, "adult": 100, "low_popularity": 90, "malformed": 1}
+    assert all(isinstance(popularity, float) and popularity >= 1.0 for _, _, popularity in kept)
+
+def test_ingest_upserts_kept_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_DIR", str(tmp_path))
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "bot_data.db"))
+
+    async def run():
+        await database.init_db()
+        counts = await ingest_id_export.ingest(FIXTURE, 1.0, batch_size=300)
+        async with aiosqlite.connect(database.DB_PATH) as db:
+            async with db.execute("SELECT COUNT(*) FROM catalogue") as cursor:
+                return counts, (await cursor.fetchone())[0]
+
+    counts, rows = asyncio.run(run())
+    assert counts["kept"] == rows == 810
+    assert counts["failed"] == 0
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from src.services import tmdb
+
+def test_cancelled_hedged_call_cancels_primary(monkeypatch):
+    started = []
+
+    async def slow_fetch(session, url, params):
+        started.append(asyncio.current_task())
+        await asyncio.sleep(10)
+        return {}
+
+    monkeypatch.setattr(tmdb, "_fetch", slow_fetch)
+    monkeypatch.setitem(tmdb.hedger._delays, "test", 1.0)
+
+    async def run():
+        call = asyncio.create_task(tmdb._fetch_hedged(None, "https://example.invalid", {}, "test"))
+        await asyncio.sleep(0.05) # Inside the hedge delay, before any backup is sent
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+        await asyncio.sleep(0) # Let the primary process its cancellation
+        # Checked inside the loop: asyncio.run() would cancel a leftover primary on exit anyway
+        assert call.cancelled()
+        assert len(started) == 1
+        assert started[0].cancelled()
+
+    asyncio.run(run())
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from src.services import tmdb
+from src.utils import STALE_NOTICE, with_stale_notice
+
+def test_stale_responses_are_marked_across_tasks(monkeypatch):
+    monkeypatch.setattr(tmdb, "_last_good", tmdb.OrderedDict())
+    tmdb._remember(("/movie/7", (("append_to_response", "recommendations,credits"),)), {"id": 7, "title": "Old"})
+    # Circuit open: responses come from the fallback cache without any request
+    monkeypatch.setattr(tmdb.breaker, "allow", lambda: False)
+
+    async def run():
+        # Fetched in a child task, as card prefetches are
+        return await asyncio.create_task(tmdb.get_movie_details(None, 7))
+
+    details = asyncio.run(run())
+    assert details == {"id": 7, "title": "Old"}
+    assert tmdb.is_stale(details)
+    assert with_stale_notice("caption", details).endswith(STALE_NOTICE)
+    # Only the cards built from stale data get the notice
+    assert with_stale_notice("caption", {"id": 8}) == "caption"
+
+def test_stale_copy_marks_results():
+    response = tmdb.stale_copy({"results": [{"id": 1}, {"id": 2}]})
+    assert tmdb.is_stale(response["results"])
+    assert all(tmdb.is_stale(movie) for movie in response["results"])